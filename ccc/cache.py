@@ -2,23 +2,159 @@
 # -*- coding: utf-8 -*-
 """cache.py
 
-simple caching using shelve/pickle.
+simple file-based caching: one file (or directory) per entry.
+
+DataFrames, arrays and sets of integers are stored in columnar format
+(see storage.py), all other objects are pickled.
+
+all operations are instrumented per artifact type (see CacheStats).
 
 """
+import json
 import logging
 import os
-import shelve
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
 from glob import glob
 from hashlib import sha256
+from pickle import UnpicklingError
+from time import time
+from timeit import default_timer
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:     # not available on Windows
+    fcntl = None
+
+# requirements
+import numpy as np
+from pandas import DataFrame, Index, RangeIndex, Series
+from pandas.util import hash_pandas_object
+
+# part of module
+from .storage import (columnar_version, is_columnar, read_columnar,
+                      read_pickle, remove_columnar, remove_pickle,
+                      write_columnar, write_pickle)
 
 logger = logging.getLogger(__name__)
 
+# upper bounds of latency histogram buckets (in seconds): 1µs … ~17min
+LATENCY_BUCKETS = [2 ** e for e in range(-20, 11)]
+
+# schema versions of cached artifacts (see artifact_type): increase
+# when the format of an artifact changes; entries of other versions
+# are ignored, all other artifacts stay valid across releases
+SCHEMA = {
+    'df_dump': 1,
+    'spans': 1,
+    'marginals': 1,
+    'matches': 1,
+    'contexts': 1,
+    'f1_set': 1,
+    'df_cooc': 1,
+    'node_freq': 1,
+    'matchcounts': 1,
+    'foldmap': 1,
+    'other': 1
+}
+
+# statistics are shared between all Cache objects of one path
+_STATS = dict()
+_STATS_LOCK = threading.Lock()
+
+# in-process locks per entry (see Cache.lock): (directory, key) -> [lock, nr_users]
+_LOCKS = dict()
+_LOCKS_LOCK = threading.Lock()
+
+
+def _hash_values(values, h):
+    """update hash with content of one column / array"""
+
+    if isinstance(values, RangeIndex):
+        h.update(repr(values).encode())
+        return
+
+    values = values.to_numpy() if isinstance(values, (Index, Series)) else values
+
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        h.update(values.dtype.str.encode())
+        h.update(str(values.shape).encode())
+        h.update(memoryview(np.ascontiguousarray(values)).cast('B'))
+    else:
+        # vectorized hashing of object / extension columns
+        h.update(str(values.dtype).encode())
+        h.update(hash_pandas_object(Series(values, copy=False), index=False).values.tobytes())
+
+
+def hash_object(obj):
+    """Hash DataFrames, Series, Index, arrays and sets by their content
+    (instead of their string representation, which only shows a
+    preview).  Returns None for all other objects.
+
+    :param obj: object to hash
+
+    :return: hex digest or None
+    :rtype: str
+    """
+
+    h = sha256()
+
+    if isinstance(obj, DataFrame):
+        h.update(b"DataFrame")
+        h.update(str(obj.shape).encode())
+        for name, level in zip(obj.index.names, range(obj.index.nlevels)):
+            h.update(repr(name).encode())
+            _hash_values(obj.index.get_level_values(level), h)
+        for nr, label in enumerate(obj.columns):
+            h.update(repr(label).encode())
+            _hash_values(obj.iloc[:, nr], h)
+
+    elif isinstance(obj, Series):
+        h.update(b"Series")
+        h.update(repr(obj.name).encode())
+        _hash_values(obj.index, h)
+        _hash_values(obj, h)
+
+    elif isinstance(obj, Index):
+        h.update(b"Index")
+        for name, level in zip(obj.names, range(obj.nlevels)):
+            h.update(repr(name).encode())
+            _hash_values(obj.get_level_values(level), h)
+
+    elif isinstance(obj, np.ndarray):
+        h.update(b"ndarray")
+        _hash_values(obj, h)
+
+    elif isinstance(obj, (set, frozenset)):
+        h.update(b"set")
+        if all(isinstance(v, (int, np.integer)) for v in obj):
+            _hash_values(np.sort(np.fromiter(obj, dtype=np.int64, count=len(obj))), h)
+        else:
+            h.update("\x00".join(sorted(repr(v) for v in obj)).encode())
+
+    else:
+        return None
+
+    return h.hexdigest()[:32]
+
+
+def _identify(idx):
+    """content hash for data, string representation otherwise"""
+    digest = hash_object(idx)
+    return str(idx) if digest is None else digest
+
 
 def generate_idx(identifiers, prefix='', length=10):
     """generate an ID from an iterable
 
+    DataFrames, Series, Index, arrays and sets are identified by their
+    content (see hash_object), everything else by its string
+    representation.
+
     """
-    string = ''.join([str(idx) for idx in identifiers])
+    string = ''.join([_identify(idx) for idx in identifiers])
     identifier = sha256(str(string).encode()).hexdigest()
     return prefix + identifier[:length]
 
@@ -37,15 +173,402 @@ def generate_library_idx(lib_dir, prefix='', length=10):
     return generate_idx(identifiers, prefix, length)
 
 
+def artifact_type(key):
+    """type of cached artifact, derived from its key:
+    - prefix before ":" (e.g. "df_dump:…" → "df_dump")
+    - suffix after last "-" (e.g. "…-marginals" → "marginals")
+    - "other" for plain identifiers
+
+    :param str key: key of the cache entry
+
+    :return: artifact type
+    :rtype: str
+    """
+
+    if ":" in key:
+        return key.split(":", 1)[0]
+    if "-" in key:
+        return key.rsplit("-", 1)[1]
+    return "other"
+
+
+def _entry_size(path):
+    """size of file or current version of columnar entry in bytes; 0 if missing"""
+
+    try:
+        if os.path.isdir(path):
+            return sum(entry.stat().st_size for entry in os.scandir(columnar_version(path)) if entry.is_file())
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+class CacheStats:
+    """Counters and latency histograms of cache operations per artifact
+    type (see artifact_type()):
+
+    - hits, misses, sets, deletes
+    - get/set latency (total seconds and histogram, see LATENCY_BUCKETS)
+    - bytes read and written (size of the entries on disk)
+
+    Decisions and run times of counting strategies (see
+    Counts.dump, Counts.matches) are recorded per strategy.
+
+    Statistics are kept in memory (per process).  If an interval is
+    given, they are appended to a JSON-lines file at most every
+    interval seconds (checked after each operation).
+
+    """
+
+    COUNTERS = ['hits', 'misses', 'sets', 'deletes', 'waits', 'bytes_read', 'bytes_written',
+                'get_seconds', 'set_seconds', 'wait_seconds']
+    STRATEGY_COUNTERS = ['chosen', 'runs', 'seconds', 'estimated_runs', 'estimated_seconds']
+
+    def __init__(self, path=None, interval=None):
+        """
+        :param str path: /path/to/stats.jsonl for periodic dumps
+        :param float interval: seconds between dumps (None: no dumps)
+        """
+
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last_dump = default_timer()
+        self.reset()
+
+    def reset(self):
+        """reset all counters and histograms"""
+
+        with self._lock:
+            self._counters = defaultdict(lambda: dict.fromkeys(self.COUNTERS, 0))
+            self._histograms = defaultdict(lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+            self._strategies = defaultdict(lambda: dict.fromkeys(self.STRATEGY_COUNTERS, 0))
+
+    def record(self, key, operation, seconds=0., nr_bytes=0, hit=True):
+        """record one cache operation
+
+        :param str key: key of the cache entry
+        :param str operation: 'get', 'set', 'delete', or 'wait' (for a
+                              concurrent computation, see Cache.lock)
+        :param float seconds: duration of the operation
+        :param int nr_bytes: size of the entry
+        :param bool hit: was the entry found? (only for 'get')
+        """
+
+        artifact = artifact_type(key)
+        with self._lock:
+            counters = self._counters[artifact]
+            if operation == 'get':
+                counters['hits' if hit else 'misses'] += 1
+                counters['bytes_read'] += nr_bytes
+            elif operation == 'set':
+                counters['sets'] += 1
+                counters['bytes_written'] += nr_bytes
+            elif operation == 'wait':
+                counters['waits'] += 1
+            else:
+                counters['deletes'] += 1
+                return
+            counters[operation + '_seconds'] += seconds
+            bucket = sum(1 for bound in LATENCY_BUCKETS if seconds > bound)
+            self._histograms[(artifact, operation)][bucket] += 1
+
+        if self.interval is not None and default_timer() - self._last_dump >= self.interval:
+            self.dump()
+
+    def record_strategy(self, name, seconds=None, estimate=None):
+        """record the automatic choice (seconds is None) or one run of
+        a counting strategy
+
+        :param str name: name of strategy in cost model (see counts.COSTS)
+        :param float seconds: duration of the run
+        :param float estimate: estimated duration of the run (see Counts._estimate)
+        """
+
+        with self._lock:
+            counters = self._strategies[name]
+            if seconds is None:
+                counters['chosen'] += 1
+            else:
+                counters['runs'] += 1
+                counters['seconds'] += seconds
+                if estimate is not None:
+                    counters['estimated_runs'] += 1
+                    counters['estimated_seconds'] += estimate
+
+        if self.interval is not None and default_timer() - self._last_dump >= self.interval:
+            self.dump()
+
+    def strategies(self):
+        """counters of counting strategies
+
+        :return: choices, runs, mean seconds and mean estimated seconds, indexed by strategy
+        :rtype: DataFrame
+        """
+
+        with self._lock:
+            df = DataFrame.from_dict(
+                {name: dict(counters) for name, counters in self._strategies.items()},
+                orient='index', columns=self.STRATEGY_COUNTERS
+            )
+        df.index.name = 'strategy'
+        df = df.sort_index()
+
+        df['mean'] = (df['seconds'] / df['runs'].where(df['runs'] > 0)).fillna(0)
+        df['estimated_mean'] = (
+            df['estimated_seconds'] / df['estimated_runs'].where(df['estimated_runs'] > 0)
+        ).fillna(0)
+
+        return df
+
+    def to_frame(self):
+        """counters per artifact type
+
+        :return: counters, hit rate and mean latencies, indexed by artifact type
+        :rtype: DataFrame
+        """
+
+        with self._lock:
+            df = DataFrame.from_dict(
+                {artifact: dict(counters) for artifact, counters in self._counters.items()},
+                orient='index', columns=self.COUNTERS
+            )
+        df.index.name = 'artifact'
+        df = df.sort_index()
+
+        gets = df['hits'] + df['misses']
+        df['hit_rate'] = (df['hits'] / gets.where(gets > 0)).fillna(0)
+        df['get_mean'] = (df['get_seconds'] / gets.where(gets > 0)).fillna(0)
+        df['set_mean'] = (df['set_seconds'] / df['sets'].where(df['sets'] > 0)).fillna(0)
+        df['wait_mean'] = (df['wait_seconds'] / df['waits'].where(df['waits'] > 0)).fillna(0)
+
+        return df
+
+    def histogram(self, artifact, operation='get'):
+        """latency histogram of one artifact type and operation
+
+        :param str artifact: artifact type
+        :param str operation: 'get', 'set', or 'wait'
+
+        :return: number of operations indexed by upper bound of bucket (seconds)
+        :rtype: Series
+        """
+
+        with self._lock:
+            counts = list(self._histograms.get((artifact, operation), [0] * (len(LATENCY_BUCKETS) + 1)))
+
+        return Series(counts, index=Index(LATENCY_BUCKETS + [float('inf')], name='seconds'), name=operation)
+
+    def to_dict(self):
+        """counters and non-empty histograms as JSON-serializable dict"""
+
+        with self._lock:
+            return {
+                'counters': {artifact: dict(counters) for artifact, counters in self._counters.items()},
+                'histograms': {
+                    f'{artifact}:{operation}': counts for (artifact, operation), counts in self._histograms.items()
+                },
+                'strategies': {name: dict(counters) for name, counters in self._strategies.items()},
+                'buckets': LATENCY_BUCKETS
+            }
+
+    def dump(self, path=None):
+        """append current statistics (with timestamp and pid) to JSON-lines file
+
+        :param str path: /path/to/stats.jsonl (default: self.path)
+        """
+
+        path = self.path if path is None else path
+        self._last_dump = default_timer()
+        if path is None:
+            logger.error('no path for cache statistics')
+            return
+
+        record = self.to_dict()
+        record['time'] = time()
+        record['pid'] = os.getpid()
+        with open(path, "at") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def cache_stats(path, interval=None):
+    """get (or create) the statistics object shared by all Cache objects
+    of one path
+
+    :param str path: path of the cache
+    :param float interval: seconds between dumps (None: keep setting)
+
+    :return: statistics
+    :rtype: CacheStats
+    """
+
+    with _STATS_LOCK:
+        if path not in _STATS:
+            _STATS[path] = CacheStats(None if path is None else path + ".stats.jsonl")
+        stats = _STATS[path]
+    if interval is not None:
+        stats.interval = interval
+    return stats
+
+
 class Cache:
+    """File-based cache that is safe for concurrent readers and writers
+    in several processes.
+
+    Each entry is stored separately in a sharded directory next to
+    the given path (<path>.d/<fingerprint>/<shard>/<key>@<schema>):
+    - DataFrames, arrays and sets of integers in columnar format
+    - all other objects as pickles (<key>@<schema>.pkl)
+
+    The fingerprint identifies the data the entries are derived from
+    (see datadir.corpus_fingerprint), the schema is the version of
+    the artifact (see SCHEMA).
+
+    Writes are atomic (temporary file or directory + rename), readers
+    do not need any locks.
+
+    Hits, misses, latencies and bytes are recorded per artifact type
+    in self.stats (shared by all Cache objects of the same path).
 
-    def __init__(self, path=None):
+    Concurrent computations of the same entry can be avoided by
+    computing it within self.lock(identifier).
+
+    """
+
+    def __init__(self, path=None, stats_interval=None, fingerprint=None, process_locks=True,
+                 compression=None):
+        """
+        :param str path: /path/to/cache
+        :param float stats_interval: dump statistics to <path>.stats.jsonl every … seconds
+        :param str fingerprint: fingerprint of the underlying data
+        :param bool process_locks: use lock files to synchronize computations across processes
+        :param str compression: compress entries: None, 'auto', or codec (see storage.CODECS)
+        """
 
         self.path = path
+        self.process_locks = process_locks and fcntl is not None
+        self.compression = compression
+        self.stats = cache_stats(path, stats_interval)
+        self.fingerprint = "default" if fingerprint is None else fingerprint
 
         if path:
             directory = os.path.dirname(path)
             os.makedirs(directory, exist_ok=True)
+            self.directory = os.path.join(path + ".d", self.fingerprint)
+
+    def _key(self, identifier):
+
+        if isinstance(identifier, str):
+            return identifier
+        return generate_idx(identifier)
+
+    def _paths(self, key):
+        """paths of columnar and pickled entry"""
+
+        shard = sha256(key.encode()).hexdigest()[:2]
+        name = quote(key, safe=":") + "@" + str(SCHEMA.get(artifact_type(key), 1))
+        base = os.path.join(self.directory, shard, name)
+
+        return base, base + ".pkl"
+
+    def exists(self, identifier):
+        """Is there an entry for identifier?  Does not read the entry.
+
+        :param identifier: identifier of entry (see get)
+
+        :rtype: bool
+        """
+
+        if self.path is None:
+            return False
+
+        path_columnar, path_pickle = self._paths(self._key(identifier))
+
+        return os.path.isdir(path_columnar) or os.path.isfile(path_pickle)
+
+    @contextmanager
+    def lock(self, identifier):
+        """Single-flight computation of an entry: only one thread (and
+        process, see process_locks) at a time holds the lock of an
+        identifier; all others wait until it is released.  Time spent
+        waiting is recorded in self.stats.  Lock files are removed
+        when the lock is released.
+
+        Yields whether the caller had to wait, i.e. whether the entry
+        might have been computed concurrently:
+
+        >>> value = cache.get(identifier)
+        >>> if value is None:
+        >>>     with cache.lock(identifier) as waited:
+        >>>         if waited:
+        >>>             value = cache.get(identifier)
+        >>>         if value is None:
+        >>>             value = compute()
+        >>>             cache.set(identifier, value)
+
+        :param identifier: identifier of entry (see get)
+
+        :return: whether the caller waited for another computation
+        :rtype: bool
+        """
+
+        if self.path is None:
+            yield False
+            return
+
+        key = self._key(identifier)
+        with _LOCKS_LOCK:
+            entry = _LOCKS.setdefault((self.directory, key), [threading.Lock(), 0])
+            entry[1] += 1
+
+        start = default_timer()
+        waited = not entry[0].acquire(blocking=False)
+        if waited:
+            entry[0].acquire()
+
+        f = None
+        try:
+            if self.process_locks:
+                lock_dir = os.path.join(self.directory, ".locks")
+                lock_path = os.path.join(lock_dir, sha256(key.encode()).hexdigest()[:32])
+                while f is None:
+                    os.makedirs(lock_dir, exist_ok=True)
+                    f = open(lock_path, "ab")
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        waited = True
+                        fcntl.flock(f, fcntl.LOCK_EX)
+                    # the previous holder might have removed the lock file
+                    try:
+                        current = os.stat(lock_path).st_ino == os.fstat(f.fileno()).st_ino
+                    except FileNotFoundError:
+                        current = False
+                    if not current:
+                        f.close()
+                        f = None
+
+            if waited:
+                seconds = default_timer() - start
+                logger.info(f'waited {seconds:.2f}s for concurrent computation of "{key}"')
+                self.stats.record(key, 'wait', seconds)
+
+            yield waited
+
+        finally:
+            if f is not None:
+                # remove lock file while holding the lock (waiting processes open a new one)
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            entry[0].release()
+            with _LOCKS_LOCK:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _LOCKS[(self.directory, key)]
 
     def delete(self, identifier):
 
@@ -53,15 +576,13 @@ class Cache:
             logger.info('no cache path')
             return
 
-        if isinstance(identifier, str):
-            key = identifier
-        else:
-            key = generate_idx(identifier)
+        key = self._key(identifier)
+        path_columnar, path_pickle = self._paths(key)
 
-        with shelve.open(self.path) as shelf:
-            if key in shelf.keys():
-                logger.info(f'deleting object "{key}" from cache')
-                del shelf[key]
+        logger.info(f'deleting object "{key}" from cache')
+        remove_columnar(path_columnar)
+        remove_pickle(path_pickle)
+        self.stats.record(key, 'delete')
 
     def get(self, identifier):
 
@@ -69,15 +590,37 @@ class Cache:
             logger.info('no cache path')
             return
 
-        if isinstance(identifier, str):
-            key = identifier
-        else:
-            key = generate_idx(identifier)
+        key = self._key(identifier)
+        path_columnar, path_pickle = self._paths(key)
+
+        # entries might be replaced or deleted while reading
+        start = default_timer()
+        try:
+            if os.path.isdir(path_columnar):
+                value = read_columnar(path_columnar)
+                nr_bytes = _entry_size(path_columnar)
+            else:
+                value = read_pickle(path_pickle)
+                nr_bytes = _entry_size(path_pickle)
+        except FileNotFoundError:
+            self.stats.record(key, 'get', default_timer() - start, hit=False)
+            return
+        except (ValueError, AttributeError, ImportError, UnpicklingError) as e:
+            # written by an incompatible release
+            logger.warning(f'cannot read object "{key}" from cache ({e}), deleting')
+            self.delete(key)
+            self.stats.record(key, 'get', default_timer() - start, hit=False)
+            return
+        self.stats.record(key, 'get', default_timer() - start, nr_bytes)
 
-        with shelve.open(self.path) as shelf:
-            if key in shelf.keys():
-                logger.info(f'retrieving object "{key}" from cache')
-                return shelf[key]
+        # mark as used (see DataDirectory.collect)
+        try:
+            os.utime(path_columnar if os.path.isdir(path_columnar) else path_pickle)
+        except FileNotFoundError:
+            pass
+
+        logger.info(f'retrieving object "{key}" from cache')
+        return value
 
     def set(self, identifier, value):
 
@@ -85,11 +628,17 @@ class Cache:
             logger.error('no cache path')
             return
 
-        if isinstance(identifier, str):
-            key = identifier
-        else:
-            key = generate_idx(identifier)
+        key = self._key(identifier)
+        path_columnar, path_pickle = self._paths(key)
 
-        with shelve.open(self.path) as shelf:
-            logger.info(f'saving object "{key}" to cache')
-            shelf[key] = value
+        logger.info(f'saving object "{key}" to cache')
+        start = default_timer()
+        if is_columnar(value):
+            write_columnar(path_columnar, value, self.compression)
+            remove_pickle(path_pickle)
+            nr_bytes = _entry_size(path_columnar)
+        else:
+            write_pickle(path_pickle, value, self.compression)
+            remove_columnar(path_columnar)
+            nr_bytes = _entry_size(path_pickle)
+        self.stats.record(key, 'set', default_timer() - start, nr_bytes)
@@ -283,6 +283,46 @@ cdef class PosAttrib:
     cpdef cpos2id(self, int offset):
         return cl_cpos2id(self.att, offset)
 
+    def cpos2ids(self, const int[:] cpos, int[:] ids):
+        """fill ids with the lexicon ids of the corpus positions"""
+        cdef Py_ssize_t i
+        cdef int val
+        if ids.shape[0] < cpos.shape[0]:
+            raise ValueError('output buffer too small')
+        for i in range(cpos.shape[0]):
+            val = cl_cpos2id(self.att, cpos[i])
+            if val < 0:
+                raise IndexError(cdperror_string(val))
+            ids[i] = val
+
+    def ids2strs(self, const int[:] ids):
+        """list of the strings of the lexicon ids"""
+        cdef Py_ssize_t i
+        cdef char * s
+        result = []
+        for i in range(ids.shape[0]):
+            s = cl_id2str(self.att, ids[i])
+            if s == NULL:
+                raise IndexError('lexicon id out of bounds')
+            result.append(self.parent.to_unicode(s))
+        return result
+
+    def max_id(self):
+        """size of the lexicon"""
+        return cl_max_id(self.att)
+
+    def strs2ids(self, strs, int[:] ids):
+        """fill ids with the lexicon ids of the strings (-1 if not in lexicon)"""
+        cdef Py_ssize_t i
+        cdef int val
+        cdef bytes s
+        if ids.shape[0] < len(strs):
+            raise ValueError('output buffer too small')
+        for i, tag in enumerate(strs):
+            s = self.parent.to_str(tag)
+            val = cl_str2id(self.att, s)
+            ids[i] = val if val >= 0 else -1
+
     def find(self, tag):
         cdef int tagid
         cdef IDList lst
@@ -6,18 +6,21 @@ definition of dump2cooc() and the Collocates class.
 
 """
 import logging
-from itertools import chain
 
 # requirements
-from pandas import DataFrame, to_numeric
+import numpy as np
+from pandas import DataFrame, concat, to_numeric
 
 # part of module
 from .cache import generate_idx
-from .counts import score_counts
-from .utils import node2cotext
+from .counts import (CodedFreqFrame, packable, pack_ids, score_counts,
+                     unpack_keys)
 
 logger = logging.getLogger(__name__)
 
+# maximum number of cells (types × offsets) of the offset cube
+CUBE_SIZE = 2 ** 24
+
 
 class Collocates:
     """ collocation analysis """
@@ -50,36 +53,87 @@ class Collocates:
 
             # get from cache if possible
             identifier = generate_idx(
-                [df_dump.reset_index()[['match', 'matchend', 'context', 'contextend']], mws, p_query]
+                [df_dump[['context', 'contextend']], mws, p_query]
             )
-            f1_set = self.corpus.cache.get(identifier + "-f1_set")
-            df_cooc = self.corpus.cache.get(identifier + "-df_cooc")
-            node_freq = self.corpus.cache.get(identifier + "-node_freq")
+            f1_set, df_cooc, node_freq = self._get_cached(identifier)
 
-            # create and cache otherwise
+            # create and cache otherwise (wait for concurrent creation)
             if not isinstance(df_cooc, DataFrame):
-                # create collocation database
-                logger.info('creating')
-                logger.info('.. collecting cpos of matches and context')
-                df_cooc, f1_set = dump2cooc(df_dump, self.mws)
-                node_freq = self.corpus.counts.cpos(f1_set, self.p_query)
-                logger.info(f'.. collected {len(df_cooc)} corpus positions')
-                self.corpus.cache.set(identifier + "-f1_set", f1_set)
-                self.corpus.cache.set(identifier + "-df_cooc", df_cooc)
-                self.corpus.cache.set(identifier + "-node_freq", node_freq)
+                with self.corpus.cache.lock(identifier + "-df_cooc") as waited:
+                    if waited:
+                        f1_set, df_cooc, node_freq = self._get_cached(identifier)
+                    if not isinstance(df_cooc, DataFrame):
+                        # create collocation database
+                        logger.info('creating')
+                        logger.info('.. collecting cpos of matches and context')
+                        df_cooc, f1_set = dump2cooc(df_dump, self.mws)
+                        node_freq = self.corpus.counts.cpos(f1_set, self.p_query)
+                        logger.info(f'.. collected {len(df_cooc)} corpus positions')
+                        self.corpus.cache.set(identifier + "-f1_set", f1_set)
+                        self.corpus.cache.set(identifier + "-node_freq", node_freq)
+                        self.corpus.cache.set(identifier + "-df_cooc", df_cooc)
 
         elif df_cooc is None or f1_set is None or node_freq is None:
             logger.error('if no dump is given, you have to provide all frequencies')
             return
 
         self.identifier = generate_idx(
-            [df_cooc.head(min(100, len(df_cooc))).reset_index(), f1_set, node_freq]
+            [df_cooc, f1_set, node_freq]
         )
         self.df_cooc = df_cooc
         self.f1_set = f1_set
         self.node_freq = node_freq
+        self._cube = None
+        self._marginals = None
+        self._node_freq = None
+
+    def _get_cached(self, identifier):
+        """retrieve f1_set, df_cooc, and node_freq from cache"""
+
+        f1_set = self.corpus.cache.get(identifier + "-f1_set")
+        df_cooc = self.corpus.cache.get(identifier + "-df_cooc")
+        node_freq = self.corpus.cache.get(identifier + "-node_freq")
+
+        return f1_set, df_cooc, node_freq
+
+    def cube(self):
+        """Count the p-attribute (combination) in df_cooc once per type
+        and absolute offset.  The counts are accumulated over offsets,
+        so the counts of any window are one column of the cube.
+
+        :return: sorted packed keys of types, cumulative counts (types × absolute offsets);
+                 None if the cube would be too large or the keys cannot be packed
+        :rtype: tuple(ndarray, ndarray)
+        """
+
+        if self._cube is None:
 
-    def count(self, window):
+            counts = self.corpus.counts
+            sizes = counts.sizes(self.p_query)
+            offsets = np.abs(self.df_cooc['offset'].values).astype(np.int64)
+            width = int(offsets.max()) + 1 if len(offsets) > 0 else 1
+
+            if not packable(sizes):
+                logger.info('cannot pack keys: counting windows separately')
+                self._cube = False
+                return None
+
+            logger.info('counting types × offsets')
+            cpos = np.ascontiguousarray(self.df_cooc['cpos'].values, dtype=np.int32)
+            keys, inverse = np.unique(pack_ids(counts._ids(cpos, self.p_query), sizes), return_inverse=True)
+            if len(keys) * width > CUBE_SIZE:
+                logger.info(f'{len(keys)} types × {width} offsets exceed cube size: counting windows separately')
+                self._cube = False
+                return None
+
+            cube = np.bincount(
+                inverse.ravel() * width + offsets, minlength=len(keys) * width
+            ).reshape(len(keys), width)
+            self._cube = keys, np.cumsum(cube, axis=1)
+
+        return self._cube if self._cube is not False else None
+
+    def count(self, window, coded=False):
 
         # check window
         mws = window if self.mws is None else self.mws
@@ -87,15 +141,68 @@ class Collocates:
             logger.warning('requested window outside maximum window size')
             window = mws
 
+        # one column of the offset cube
+        cube = self.cube()
+        if cube is not None:
+            logger.info(f'counting window {window} from offset cube')
+            keys, cumulative = cube
+            column = min(window, cumulative.shape[1] - 1)
+            freqs = cumulative[:, column] if column >= 0 else np.zeros(len(keys), dtype=np.int64)
+            keys, freqs = keys[freqs > 0], freqs[freqs > 0]
+            sizes = self.corpus.counts.sizes(self.p_query)
+            return self.corpus.counts._decode(keys, unpack_keys(keys, sizes), freqs, self.p_query, coded=coded)
+
         # slice window
         logger.info(f'slicing window {window}')
         relevant = self.df_cooc.loc[abs(self.df_cooc['offset']) <= window]
 
         # frequency counts
-        f = self.corpus.counts.cpos(relevant['cpos'], self.p_query)
+        f = self.corpus.counts.cpos(relevant['cpos'], self.p_query, coded=coded)
 
         return f
 
+    def marginals(self, items, coded=False):
+        """Corpus marginals of items; items that have been looked up
+        before are not retrieved again.
+
+        :param list items: items (or packed keys) to get marginals for
+        :param bool coded: items are packed keys?
+
+        :return: frequencies of the items in the whole corpus indexed by items (or keys)
+        :rtype: DataFrame
+        """
+
+        def lookup(items):
+            if coded:
+                return self.corpus.marginals(items, self.p_query, coded=True).df
+            return self.corpus.marginals(items, self.p_query)
+
+        if self._marginals is None:
+            self._marginals = lookup(list(items))
+            return self._marginals
+
+        missing = [item for item in items if item not in self._marginals.index]
+        if len(missing) > 0:
+            self._marginals = concat([self._marginals, lookup(missing)])
+
+        return self._marginals.loc[self._marginals.index.isin(items)]
+
+    def node_frequencies(self, coded=False):
+        """Frequencies of the types of the nodes.
+
+        :param bool coded: index by packed keys?
+
+        :return: frequencies indexed by items (or keys)
+        :rtype: DataFrame
+        """
+
+        if not coded:
+            return self.node_freq
+        if self._node_freq is None:
+            self._node_freq = CodedFreqFrame.from_freqframe(self.node_freq, self.corpus.counts, self.p_query).df
+
+        return self._node_freq
+
     def show(self, window=5, order='log_likelihood', cut_off=100,
              ams=None, min_freq=2, flags=None, marginals='corpus',
              show_negative=False):
@@ -113,9 +220,13 @@ class Collocates:
 
         if not isinstance(collocates, DataFrame):
 
+            # join on packed keys if possible, materialize items after scoring
+            coded = packable(self.corpus.counts.sizes(self.p_query))
+
             logger.info('.. counting')
             # get window counts and apply min freq
-            f = self.count(window).rename(columns={'freq': 'f'})
+            f = self.count(window, coded)
+            f = (f.df if coded else f).rename(columns={'freq': 'f'})
             vocab = len(f)
             f1 = f['f'].sum()
             f = f.loc[f['f'] >= min_freq]
@@ -125,18 +236,20 @@ class Collocates:
             if isinstance(marginals, str):
                 if marginals == 'corpus':
                     N = self.corpus.corpus_size - len(self.f1_set)
-                    marginals = self.corpus.marginals(f.index, self.p_query)
+                    marginals = self.marginals(f.index, coded)
                 else:
                     raise NotImplementedError
             elif isinstance(marginals, DataFrame):
                 # DataFrame must contain a column 'freq'
                 N = marginals['freq'].sum()
+                if coded:
+                    marginals = CodedFreqFrame.from_freqframe(marginals, self.corpus.counts, self.p_query).df
             else:
                 raise NotImplementedError
 
             # f2 = marginals - node frequencies
             f2 = marginals[['freq']].rename(columns={'freq': 'marginal'}).join(
-                self.node_freq[['freq']].rename(columns={'freq': 'in_nodes'})
+                self.node_frequencies(coded)[['freq']].rename(columns={'freq': 'in_nodes'})
             )
             f2['in_nodes'] = to_numeric(f2['in_nodes'], downcast='integer')
             f2 = f2.fillna(0)  # , downcast='infer')
@@ -149,12 +262,16 @@ class Collocates:
             df['f1'] = f1
             df['N'] = N
             df = df.fillna(0)  # , downcast='infer')
+            if coded:
+                df = CodedFreqFrame(df, self.corpus.counts, self.p_query)
 
             # score
             collocates = score_counts(df, order=order, cut_off=None,
                                       flags=flags, ams=ams, vocab=vocab)
 
             # add node and marginal frequencies
+            if coded:
+                f2 = CodedFreqFrame(f2, self.corpus.counts, self.p_query).to_freqframe()
             collocates = collocates.join(f2[['in_nodes', 'marginal']], how='left')
 
             # put in cache
@@ -177,9 +294,8 @@ def dump2cooc(df_dump, context=None, rm_nodes=True, drop_duplicates=True):
     """ converts df_dump to df_cooc + f1_set
 
     strategy:
-    (1a) create overlapping contexts with nodes
-    (1b) concatenate local contexts
-    (2a) sort by abs(offset)
+    (1) expand contexts to corpus positions (np.repeat / cumsum)
+    (2a) sort by abs(offset), cpos (stable)
     (2b) deduplicate by cpos, keep first occurrences (=smallest offset)
     (3a) f1_set = (cpos where offset == 0)
     (3b) remove rows where cpos in f1_set
@@ -216,28 +332,37 @@ def dump2cooc(df_dump, context=None, rm_nodes=True, drop_duplicates=True):
         df['end'] = df['matchend'] + context
         df['end'] = df[['end', 'contextend']].min(axis=1)
 
-    logger.info("(1a) create local contexts")
-    df = DataFrame.from_records(
-        node2cotext(df['match'], df['matchend'], df['context'], df['contextend'])
-    )
-
-    logger.info("(1b) concatenate local contexts")
-    df_infl = DataFrame({
-        'match': list(chain.from_iterable(df['match_list'].values)),
-        'cpos': list(chain.from_iterable(df['cpos_list'].values)),
-        'offset': list(chain.from_iterable(df['offset_list'].values))
-    })
+    logger.info("(1) expand contexts")
+    match = df['match'].values.astype(np.int32)
+    matchend = df['matchend'].values.astype(np.int32)
+    starts = df['context'].values.astype(np.int32)
+    lengths = (df['contextend'].values.astype(np.int32) - starts + 1).clip(min=0)
+    rows = np.repeat(np.arange(len(df), dtype=np.int32), lengths)
+    firsts = np.repeat(np.cumsum(lengths) - lengths, lengths).astype(np.int32)
+    cpos = starts[rows] + (np.arange(len(rows), dtype=np.int32) - firsts)
+    match_cpos = match[rows]
+    matchend_cpos = matchend[rows]
+    offset = np.where(
+        cpos < match_cpos, cpos - match_cpos,
+        np.where(cpos > matchend_cpos, cpos - matchend_cpos, 0)
+    ).astype(np.int32)
 
     if drop_duplicates:
-        logger.info("(2a) sort by absolute offset")
-        df_infl['abs_offset'] = df_infl.offset.abs()
-        df_infl = df_infl.sort_values(by=['abs_offset', 'cpos'])
-        df_infl = df_infl.drop(["abs_offset"], axis=1)
+        logger.info("(2a) sort by absolute offset (stable)")
+        order = np.lexsort((cpos, np.abs(offset)))
 
         logger.info("(2b) drop duplicates")
-        df_defl = df_infl.drop_duplicates(subset='cpos')
+        _, first = np.unique(cpos[order], return_index=True)
+        index = order[np.sort(first)]
+        labels = index.astype(np.int64)
     else:
-        df_defl = df_infl
+        index, labels = slice(None), None
+
+    df_defl = DataFrame({
+        'match': match_cpos[index].astype(np.int64),
+        'cpos': cpos[index].astype(np.int64),
+        'offset': offset[index].astype(np.int64)
+    }, index=labels)
 
     if not rm_nodes:
         return df_defl
@@ -8,19 +8,41 @@ methods for counting and scoring items.
 import logging
 import subprocess
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from io import StringIO
-from tempfile import NamedTemporaryFile
+from itertools import repeat
+from tempfile import NamedTemporaryFile, TemporaryFile
+from timeit import default_timer
 
 # requirements
+import numpy as np
 from association_measures import measures
-from pandas import DataFrame, MultiIndex, read_csv
+from association_measures.frequencies import expected_frequencies, observed_frequencies
+from pandas import (Categorical, DataFrame, Index, MultiIndex, Series, concat,
+                    read_csv)
+from pandas.errors import EmptyDataError
 
 # part of module
 from .cl import Corpus as Crps
-from .utils import fold_df, time_it
+from .utils import fold_df, fold_string, time_it
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 2 ** 20
+SHARD_SIZE = 2 ** 24
+SCORE_CHUNK_SIZE = 2 ** 18
+
+# cost model of counting strategies (see Counts.calibrate): seconds
+# (fixed, per match, per token and p-attribute)
+COSTS = {
+    'dump-1-split': (1e-3, 5e-6, 4e-6),
+    'dump-1-mwu': (2e-3, 2e-6, 2e-7),
+    'dump-2-split': (2e-3, 1e-7, 4e-8),
+    'matches-1': (5e-3, 1e-6, 2e-6),
+    'matches-2': (5e-3, 2e-6, 1e-6),
+    'matches-3': (1e-2, 1e-6, 5e-8)
+}
+
 
 def count_items(items, names, tuples=True):
     """Get type frequency table of items.
@@ -41,7 +63,7 @@ def count_items(items, names, tuples=True):
     if tuples:
         df_counts.index = MultiIndex.from_tuples(df_counts.index, names=names)
         df_counts = df_counts.reset_index()
-        df_counts['item'] = df_counts[names].agg(' '.join, axis=1)
+        df_counts['item'] = join_items(df_counts, names)
         df_counts = df_counts.set_index('item')
     else:
         df_counts = df_counts.reset_index()
@@ -56,39 +78,356 @@ def count_items(items, names, tuples=True):
     return df_counts
 
 
-def read_freq_list(path, min_freq=2, columns=None):
-    """Read frequency list, e.g. output of lexdecode (see below)
+def join_items(df, columns):
+    """Join values of columns with " " (vectorized).
+
+    :param DataFrame df: table containing the columns
+    :param list columns: names of columns to join
+
+    :return: joined values
+    :rtype: Series
+    """
+
+    if len(columns) == 1:
+        return df[columns[0]]
+    values = [df[c].astype(str) for c in columns]
+    return values[0].str.cat(values[1:], sep=' ')
+
+
+def _index_items(df, values, p_atts):
+    """index numeric counts by items of attribute values, sum up
+    duplicate items, sort by item (like utils.fold_df)"""
+
+    df.index = Index(join_items(values, p_atts).values, name='item', dtype=object)
+    if not df.index.is_unique:
+        # values containing blanks
+        df = df.groupby(level=0).sum()
+
+    return df.sort_index()
+
+
+def split_items(items, n):
+    """Values of each p-attribute of items.  Items are tuples of values
+    or strings (values joined by " "); items that do not split into n
+    values get None.
+
+    :param list items: items
+    :param int n: number of p-attributes
+
+    :return: one list of values per p-attribute
+    :rtype: list
+    """
+
+    values = [list() for _ in range(n)]
+    for item in items:
+        parts = list(item) if isinstance(item, tuple) else (item.split(" ") if n > 1 else [item])
+        if len(parts) != n:
+            parts = [None] * n
+        for v, part in zip(values, parts):
+            v.append(part)
+
+    return values
+
+
+def packable(sizes):
+    """Do packed keys of attributes with these lexicon sizes fit into int64?
+
+    :param list sizes: lexicon sizes
+
+    :rtype: bool
+    """
+
+    return np.prod(np.array(sizes, dtype=float)) < 2 ** 63
+
+
+def pack_ids(ids, sizes):
+    """Pack lexicon ids of several p-attributes into one int64 key per
+    position.  The radices are the lexicon sizes, so the keys of a
+    p-attribute combination are the same in all frequency tables.
+
+    :param list ids: one array of lexicon ids per p-attribute
+    :param list sizes: lexicon sizes of the p-attributes
+
+    :return: keys
+    :rtype: ndarray (int64)
+    """
+
+    if not packable(sizes):
+        raise ValueError("lexicons are too large for packing keys into int64")
+
+    keys = np.asarray(ids[0], dtype=np.int64)
+    for att_ids, size in zip(ids[1:], sizes[1:]):
+        keys = keys * size + np.asarray(att_ids, dtype=np.int64)
+
+    return keys
+
+
+def unpack_keys(keys, sizes):
+    """Unpack keys (see pack_ids) into lexicon ids.
+
+    :param ndarray keys: packed keys
+    :param list sizes: lexicon sizes of the p-attributes
+
+    :return: one array of lexicon ids per p-attribute
+    :rtype: list
+    """
+
+    keys = np.asarray(keys, dtype=np.int64)
+    ids = list()
+    for size in reversed(sizes[1:]):
+        ids.insert(0, keys % size)
+        keys = keys // size
+    ids.insert(0, keys)
+
+    return ids
+
+
+def keys2items(df_counts):
+    """Index frequency table by items: " "-joined attribute values.
+
+    :param DataFrame df_counts: freq and attribute columns (values or categorical codes)
+
+    :return: counts indexed by item
+    :rtype: FreqFrame
+    """
+
+    names = [c for c in df_counts.columns if c != 'freq']
+    df_counts = df_counts.reset_index(drop=True)
+    for name in names:
+        df_counts[name] = np.asarray(df_counts[name], dtype=object)
+    df_counts.index = Index(join_items(df_counts, names).values, name='item', dtype=object)
+
+    return df_counts.sort_values(by=['freq', 'item'], ascending=False)
+
+
+class CodedFreqFrame:
+    """Frequency table coded by lexicon ids: a DataFrame indexed by
+    packed keys (see pack_ids) with numeric columns only (e.g. freq),
+    and a reference to the lexicons of the p-attributes (Counts).
+
+    Joins are integer joins on the keys; strings are only
+    materialized when converting to a FreqFrame (to_freqframe).  Keys
+    are the same in all tables of a corpus, so coded frames of the same
+    corpus and p-attribute (combination) can be joined directly.
+
+    """
+
+    def __init__(self, df, counts, p_atts=['word']):
+        """
+        :param DataFrame df: numeric columns indexed by 'key'
+        :param Counts counts: counts of the corpus (lexicons)
+        :param list p_atts: p-attribute (combination)
+        """
+
+        self.df = df
+        self.counts = counts
+        self.p_atts = p_atts
+        self.sizes = counts.sizes(p_atts)
+
+    def __len__(self):
+
+        return len(self.df)
+
+    def __repr__(self):
+
+        return f'CodedFreqFrame of "{" ".join(self.p_atts)}" ({len(self)} rows)\n{repr(self.df)}'
+
+    @classmethod
+    def from_keys(cls, keys, freqs, counts, p_atts=['word']):
+        """Create from packed keys and frequencies.
+
+        :param ndarray keys: packed keys
+        :param ndarray freqs: frequencies
+        :param Counts counts: counts of the corpus (lexicons)
+        :param list p_atts: p-attribute (combination)
+
+        :rtype: CodedFreqFrame
+        """
 
-    :param str path: path to read from
+        df = DataFrame({'freq': np.asarray(freqs, dtype=np.int64)},
+                       index=Index(np.asarray(keys, dtype=np.int64), name='key'))
+
+        return cls(df, counts, p_atts)
+
+    @classmethod
+    def from_freqframe(cls, df, counts, p_atts=['word']):
+        """Encode a FreqFrame (indexed by item; attribute columns are used
+        if available).  Items that are not in the lexicons are dropped.
+
+        :param FreqFrame df: counts indexed by item
+        :param Counts counts: counts of the corpus (lexicons)
+        :param list p_atts: p-attribute (combination)
+
+        :rtype: CodedFreqFrame
+        """
+
+        if set(p_atts).issubset(df.columns):
+            # values may contain blanks
+            keys = counts.encode(zip(*[df[p_att] for p_att in p_atts]), p_atts)
+        else:
+            keys = counts.encode(df.index, p_atts)
+        known = keys >= 0
+        if not known.all():
+            logger.info(f'dropping {(~known).sum()} items that are not in lexicon')
+        columns = [c for c in df.columns if c not in p_atts]
+        df = df.loc[known, columns].copy()
+        df.index = Index(keys[known], name='key')
+
+        return cls(df, counts, p_atts)
+
+    @property
+    def keys(self):
+        """packed keys"""
+
+        return self.df.index.to_numpy(dtype=np.int64)
+
+    def codes(self, p_att):
+        """lexicon ids of a p-attribute
+
+        :param str p_att: p-attribute
+
+        :rtype: ndarray
+        """
+
+        return unpack_keys(self.keys, self.sizes)[self.p_atts.index(p_att)]
+
+    def _check(self, other):
+
+        if not isinstance(other, CodedFreqFrame) or other.p_atts != self.p_atts or other.sizes != self.sizes:
+            raise ValueError("coded frames of different p-attributes or lexicons cannot be joined")
+
+    def join(self, other, how='left', lsuffix='', rsuffix='', fill_value=None):
+        """Join on keys (integer join).
+
+        :param CodedFreqFrame other: coded frame of the same p-attribute (combination)
+        :param str how: 'left', 'right', 'outer', 'inner'
+        :param str lsuffix: suffix of overlapping columns of self
+        :param str rsuffix: suffix of overlapping columns of other
+        :param fill_value: value for missing rows (None: NaN)
+
+        :rtype: CodedFreqFrame
+        """
+
+        self._check(other)
+        df = self.df.join(other.df, how=how, lsuffix=lsuffix, rsuffix=rsuffix)
+        if fill_value is not None:
+            df = df.fillna(fill_value)
+
+        return CodedFreqFrame(df, self.counts, self.p_atts)
+
+    def reindex(self, keys, fill_value=0):
+        """Select rows by keys (or rows of another coded frame).
+
+        :param keys: packed keys or CodedFreqFrame
+        :param fill_value: value for keys that are not in self
+
+        :rtype: CodedFreqFrame
+        """
+
+        if isinstance(keys, CodedFreqFrame):
+            self._check(keys)
+            keys = keys.keys
+        df = self.df.reindex(Index(np.asarray(keys, dtype=np.int64), name='key'), fill_value=fill_value)
+
+        return CodedFreqFrame(df, self.counts, self.p_atts)
+
+    def to_freqframe(self):
+        """Materialize strings: index by item, add attribute columns.
+
+        :return: counts indexed by item (sorted by freq and item, if there is a freq column)
+        :rtype: FreqFrame
+        """
+
+        df = self.df.reset_index(drop=True)
+        for p_att, ids in zip(self.p_atts, unpack_keys(self.keys, self.sizes)):
+            distinct, codes = np.unique(ids, return_inverse=True)
+            values = self.counts._attribute(p_att).ids2strs(np.ascontiguousarray(distinct, dtype=np.int32))
+            df[p_att] = np.asarray(values, dtype=object)[codes.ravel()] if len(values) > 0 else np.array([], dtype=object)
+        df.index = Index(join_items(df, self.p_atts).values, name='item', dtype=object)
+
+        if 'freq' in df.columns:
+            df = df.sort_values(by=['freq', 'item'], ascending=False)
+
+        return df
+
+
+def valid_intervals(starts, ends):
+    """Intervals [start .. end] without negative or empty intervals.
+
+    :param starts: start positions of intervals
+    :param ends: end positions of intervals
+
+    :return: starts and ends
+    :rtype: tuple(ndarray, ndarray)
+    """
+
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    valid = (starts >= 0) & (ends >= starts)
+
+    return starts[valid], ends[valid]
+
+
+def intervals2cpos(starts, ends):
+    """Corpus positions of intervals [start .. end] (inclusive), in order
+    of the intervals.  Intervals with negative start or end < start
+    are skipped.
+
+    :param starts: start positions of intervals
+    :param ends: end positions of intervals
+
+    :return: corpus positions
+    :rtype: ndarray (int32)
+    """
+
+    starts, ends = valid_intervals(starts, ends)
+
+    lengths = ends - starts + 1
+    offsets = np.cumsum(lengths) - lengths
+    cpos = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+    return cpos.astype(np.int32)
+
+
+def read_freq_list(path, min_freq=2, columns=None, chunksize=CHUNK_SIZE):
+    """Read frequency list, e.g. output of lexdecode (see below).  The
+    list is parsed in chunks of rows and filtered while reading, so
+    memory is bounded by the size of the filtered list.
+
+    :param path: path or (binary) stream to read from
     :param int min_freq: drop everything that doesn't appear at least this often
+    :param list columns: names of the value columns
+    :param int chunksize: number of rows to parse at once
 
     :return: frequency list (index: item, columns: freq) and original size
     :rtype: tuple(DataFrame, int)
 
     """
 
-    # read data
+    # read data and apply frequency threshold
     logger.info('reading frequency list ...')
-    df = read_csv(path, sep="\t", header=None, quoting=3,
-                  keep_default_na=False)
-    logger.info(f'reading frequency list ... {df.shape[0]} items')
-
-    # get corpus size
-    R = df[0].sum()
-
-    # apply frequency threshold
-    logger.info('applying frequency threshold ...')
-    df = df.loc[df[0] >= min_freq]
-    logger.info(f'applying frequency threshold ... {df.shape[0]} items')
+    R, nr_items, chunks = 0, 0, list()
+    try:
+        reader = read_csv(path, sep="\t", header=None, quoting=3, dtype=str,
+                          keep_default_na=False, chunksize=chunksize)
+        for chunk in reader:
+            chunk[0] = chunk[0].astype(np.int64)
+            R += int(chunk[0].sum())
+            nr_items += len(chunk)
+            chunks.append(chunk.loc[chunk[0] >= min_freq])
+    except EmptyDataError:
+        pass
+    if len(chunks) > 0:
+        df = concat(chunks)
+    else:
+        df = DataFrame({c: Series(dtype=np.int64 if c == 0 else object) for c in range(1 + max(1, len(columns or [])))})
+    logger.info(f'reading frequency list ... {nr_items} items, {df.shape[0]} with frequency >= {min_freq}')
 
     # indexing
     logger.info('combining relevant columns ...')
     col = list(df.columns[1:]) if columns is None else columns
     df.columns = ['freq'] + col
-    if len(col) > 1:
-        df['item'] = df[col].agg(' '.join, axis=1)
-    else:
-        df['item'] = df[col]
+    df['item'] = join_items(df, col)
     df = df.set_index('item')
     logger.info(
         'combining relevant columns ... item="%s"' % " ".join([str(c) for c in col])
@@ -99,6 +438,29 @@ def read_freq_list(path, min_freq=2, columns=None):
     return df, R
 
 
+def _read_freq_list_process(command, min_freq, columns):
+    """Run command and read its output as frequency list while it is
+    being written.
+
+    :param list command: command line
+    :param int min_freq: drop everything that doesn't appear at least this often
+    :param list columns: names of the value columns
+
+    :return: frequency list of p-attribute values and corpus size
+    :rtype: tuple(DataFrame, int)
+    """
+
+    with TemporaryFile() as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        with process.stdout:
+            df_counts, R = read_freq_list(process.stdout, min_freq=min_freq, columns=columns)
+        if process.wait() != 0:
+            stderr.seek(0)
+            logger.error(f'{command[0]} failed: {stderr.read().decode(errors="replace")}')
+
+    return df_counts, R
+
+
 def cwb_lexdecode(corpus_name, registry_dir,
                   p_att='word', cmd='cwb-lexdecode', min_freq=2):
     """Run cwb-lexdecode: create frequency list of p-attribute.
@@ -117,11 +479,7 @@ def cwb_lexdecode(corpus_name, registry_dir,
 
     logger.info("running cwb-lexdecode ...")
     command = [cmd, '-f', '-P', p_att, '-r', registry_dir, corpus_name]
-    lexdecode = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    ret = lexdecode.communicate()[0].decode()
-    df_counts, R = read_freq_list(StringIO(ret), min_freq=min_freq, columns=[p_att])
+    df_counts, R = _read_freq_list_process(command, min_freq, [p_att])
 
     return df_counts, R
 
@@ -151,15 +509,38 @@ def cwb_scan_corpus(corpus_name, registry_dir, path=None,
     if path is not None:
         command += ['-R', path]
     command += [corpus_name] + p_atts
-    scan = subprocess.Popen(
-        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    ret = scan.communicate()[0].decode()
-    df_counts, R = read_freq_list(StringIO(ret), min_freq=min_freq, columns=p_atts)
+    df_counts, R = _read_freq_list_process(command, min_freq, p_atts)
 
     return df_counts, R
 
 
+def merge_counts(parts):
+    """Merge partial counts (reduction over all parts).
+
+    :param list parts: tuples of keys and frequencies
+
+    :return: sorted keys and summed frequencies
+    :rtype: tuple(ndarray, ndarray)
+    """
+
+    if len(parts) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    if len(parts) == 1:
+        return parts[0]
+
+    keys, inverse = np.unique(np.concatenate([k for k, _ in parts]), return_inverse=True)
+    freqs = np.bincount(inverse.ravel(), weights=np.concatenate([f for _, f in parts]), minlength=len(keys))
+
+    return keys, freqs.astype(np.int64)
+
+
+def _count_shard(corpus_name, registry_dir, p_atts, starts, ends):
+    """count packed keys of p-attributes in intervals (in a worker process)"""
+
+    counts = Counts(corpus_name, registry_dir)
+    return counts._count_keys(counts._ids(intervals2cpos(starts, ends), p_atts), counts.sizes(p_atts))
+
+
 class Counts:
     """All methods return a FreqFrame
 
@@ -169,18 +550,455 @@ class Counts:
 
     If index is not split, MWUs are " "-joined.
 
+    Counting on lexicon ids (Counts.cpos, Counts.intervals) can return
+    frames indexed by packed int64 keys (see pack_ids) with
+    categorical attribute columns instead (items=False); keys2items
+    creates the item index.  With coded=True, no strings are decoded
+    at all (see CodedFreqFrame).
+
     TODO: counting with group?
 
     """
     def __init__(self, corpus_name,
-                 registry_dir='/usr/local/share/cwb/registry/'):
+                 registry_dir='/usr/local/share/cwb/registry/', workers=1):
+        """
+        :param str corpus_name: name of corpus in CWB registry
+        :param str registry_dir: /path/to/cwb/registry/
+        :param int workers: number of worker processes for scanning (see scan)
+        """
 
         self.corpus_name = corpus_name
         self.registry_dir = registry_dir
+        self.workers = workers
         self.attributes = Crps(
             self.corpus_name,
             registry_dir=registry_dir
         )
+        self.costs = dict(COSTS)
+        self.stats = None       # CacheStats for recording strategies (see Corpus)
+        self.cache = None       # Cache for storing fold maps (see Corpus)
+        self._handles = dict()
+        self._fold_maps = dict()
+
+    def _attribute(self, p_att):
+        """cached handle of p-attribute"""
+
+        if p_att not in self._handles:
+            self._handles[p_att] = self.attributes.attribute(p_att, 'p')
+        return self._handles[p_att]
+
+    def sizes(self, p_atts=['word']):
+        """Lexicon sizes of p-attributes, i.e. the radices of packed keys.
+
+        :param list p_atts: p-attributes
+
+        :return: number of types of each p-attribute
+        :rtype: list
+        """
+
+        return [self._attribute(p_att).max_id() for p_att in p_atts]
+
+    def lexicon_frequencies(self, ids, p_att='word'):
+        """Corpus frequencies of lexicon ids (the lexicon is looked up by
+        string).
+
+        :param ndarray ids: lexicon ids
+        :param str p_att: p-attribute
+
+        :return: frequencies
+        :rtype: ndarray (int64)
+        """
+
+        att = self._attribute(p_att)
+        ids = np.ascontiguousarray(ids, dtype=np.int32)
+        strings = att.ids2strs(ids) if len(ids) > 0 else []
+
+        return np.array([att.frequency(string) for string in strings], dtype=np.int64)
+
+    def encode(self, items, p_atts=['word']):
+        """Packed keys of items (see pack_ids); -1 if not in lexicons.
+
+        :param list items: tuples of values or strings (values joined by " ")
+        :param list p_atts: p-attribute (combination)
+
+        :return: keys
+        :rtype: ndarray (int64)
+        """
+
+        items = list(items)
+        ids = list()
+        for p_att, values in zip(p_atts, split_items(items, len(p_atts))):
+            att_ids = np.empty(len(items), dtype=np.int32)
+            self._attribute(p_att).strs2ids(["" if v is None else v for v in values], att_ids)
+            att_ids[[v is None for v in values]] = -1
+            ids.append(att_ids)
+
+        known = np.all(np.stack(ids) >= 0, axis=0) if len(items) > 0 else np.array([], dtype=bool)
+        keys = pack_ids([np.where(known, i, 0) for i in ids], self.sizes(p_atts))
+
+        return np.where(known, keys, -1)
+
+    def fold_map(self, p_att='word', flags="%cd"):
+        """Map of lexicon ids to ids of folded types (built once per
+        p-attribute and flags from the lexicon, see utils.fold_string,
+        and stored in self.cache).
+
+        :param str p_att: p-attribute
+        :param str flags: %c, %d, %cd
+
+        :return: folded id of each lexicon id, folded types (sorted)
+        :rtype: tuple(ndarray, ndarray)
+        """
+
+        key = (p_att, "c" in flags, "d" in flags)
+        if key not in self._fold_maps:
+            identifier = f"{p_att}-{'c' * key[1]}{'d' * key[2]}-foldmap"
+            df = None if self.cache is None else self.cache.get(identifier)
+            if df is None:
+                logger.info(f'building fold map of "{p_att}" ({flags})')
+                att = self._attribute(p_att)
+                strings = att.ids2strs(np.arange(att.max_id(), dtype=np.int32))
+                folded = np.array([fold_string(string, flags) for string in strings], dtype=object)
+                _, fold = np.unique(folded, return_inverse=True)
+                df = DataFrame({'fold': fold.ravel().astype(np.int32), 'folded': folded})
+                if self.cache is not None:
+                    self.cache.set(identifier, df)
+            fold = np.asarray(df['fold'].values)
+            types = np.empty(fold.max() + 1 if len(fold) > 0 else 0, dtype=object)
+            types[fold] = df['folded'].values
+            self._fold_maps[key] = (fold, types)
+
+        return self._fold_maps[key]
+
+    def fold(self, df_counts, flags="%cd", p_atts=None, items=False):
+        """Fold counts indexed by packed key (see items=False): lexicon ids
+        are remapped to folded ids (fold_map), numeric columns of
+        types that fold to the same item are summed up.
+
+        Keys of the result are packed with the numbers of folded
+        types as radices.
+
+        :param DataFrame df_counts: counts indexed by packed key
+        :param str flags: %c, %d, %cd
+        :param list p_atts: p-attributes of the keys (None: non-numeric columns)
+        :param bool items: index by folded items and drop attribute columns (like utils.fold_df)?
+
+        :return: folded counts indexed by packed key (or item)
+        :rtype: FreqFrame
+        """
+
+        if flags is None:
+            return df_counts
+
+        numeric = list(df_counts.select_dtypes(include=np.number).columns)
+        p_atts = [c for c in df_counts.columns if c not in numeric] if p_atts is None else p_atts
+
+        if "c" not in flags and "d" not in flags:
+            # nothing to fold: no fold maps needed
+            if not items:
+                return df_counts
+            df = df_counts[numeric].copy()
+            values = DataFrame({
+                p_att: self._attribute(p_att).ids2strs(np.ascontiguousarray(ids, dtype=np.int32))
+                for p_att, ids in zip(p_atts, unpack_keys(df_counts.index.values, self.sizes(p_atts)))
+            })
+            return _index_items(df, values, p_atts)
+
+        maps = [self.fold_map(p_att, flags) for p_att in p_atts]
+        ids = unpack_keys(df_counts.index.values, self.sizes(p_atts))
+        sizes = [len(types) for _, types in maps]
+
+        keys, inverse = np.unique(
+            pack_ids([fold[i] for (fold, _), i in zip(maps, ids)], sizes), return_inverse=True
+        )
+        inverse = inverse.ravel()
+
+        df = DataFrame(index=Index(keys, name='key'))
+        for column in numeric:
+            df[column] = np.bincount(
+                inverse, weights=df_counts[column].values, minlength=len(keys)
+            ).astype(df_counts[column].dtype)
+
+        if items:
+            values = DataFrame({
+                p_att: types[folded_ids] for p_att, (_, types), folded_ids in zip(p_atts, maps, unpack_keys(keys, sizes))
+            })
+            return _index_items(df, values, p_atts)
+
+        for p_att, (_, types), folded_ids in zip(p_atts, maps, unpack_keys(keys, sizes)):
+            distinct, codes = np.unique(folded_ids, return_inverse=True)
+            df[p_att] = Categorical.from_codes(codes.ravel(), categories=types[distinct])
+
+        return df.sort_values(by=numeric[0], ascending=False, kind='stable')
+
+    def _count_ids(self, cpos, p_atts=['word'], items=True, coded=False):
+        """Count p-attribute (combinations) at corpus positions via their
+        lexicon ids: ids are gathered through the CL, counted with
+        np.bincount (single attribute, small lexicon) or np.unique on
+        packed keys (combinations), and only the distinct types are
+        decoded.
+
+        :param ndarray cpos: corpus positions (duplicates are counted)
+        :param list p_atts: p-attribute (combinations) to count
+        :param bool items: index by item? (else: by packed key)
+        :param bool coded: return CodedFreqFrame?
+
+        :return: counts of the p_attribute (combinations) of the positions
+        :rtype: FreqFrame
+
+        """
+
+        cpos = np.ascontiguousarray(cpos, dtype=np.int32)
+        sizes = self.sizes(p_atts)
+        ids = self._ids(cpos, p_atts)
+
+        if packable(sizes):
+            keys, freqs = self._count_keys(ids, sizes)
+            types = unpack_keys(keys, sizes)
+
+        elif not items or coded:
+            raise ValueError(f'cannot pack keys of {" ".join(p_atts)}: lexicons are too large')
+
+        else:
+            keys = None
+            rows, freqs = np.unique(np.stack(ids, axis=1), axis=0, return_counts=True)
+            types = [rows[:, i] for i in range(len(p_atts))]
+
+        return self._decode(keys, types, freqs, p_atts, items, coded)
+
+    @staticmethod
+    def _count_keys(ids, sizes):
+        """count packed keys of lexicon ids (np.bincount for a single
+        attribute with small lexicon, np.unique otherwise)
+
+        :return: sorted keys and their frequencies
+        :rtype: tuple(ndarray, ndarray)
+        """
+
+        if len(sizes) == 1 and sizes[0] <= 4 * len(ids[0]):
+            counts = np.bincount(ids[0], minlength=sizes[0])
+            keys = np.flatnonzero(counts)
+            return keys.astype(np.int64), counts[keys].astype(np.int64)
+
+        keys, freqs = np.unique(pack_ids(ids, sizes), return_counts=True)
+        return keys, freqs.astype(np.int64)
+
+    def _decode(self, keys, types, freqs, p_atts, items=True, coded=False):
+        """decode distinct types of each attribute (compact codes) and
+        create frequency table
+
+        :param ndarray keys: packed keys (None if not packable)
+        :param list types: lexicon ids of each attribute
+        :param ndarray freqs: frequencies
+        :param list p_atts: p-attributes
+        :param bool items: index by item? (else: by packed key)
+        :param bool coded: do not decode at all (CodedFreqFrame)?
+
+        :rtype: FreqFrame
+        """
+
+        if coded:
+            if keys is None:
+                raise ValueError(f'cannot pack keys of {" ".join(p_atts)}: lexicons are too large')
+            return CodedFreqFrame.from_keys(keys, freqs, self, p_atts)
+
+        df_counts = DataFrame({'freq': np.asarray(freqs, dtype=np.int64)})
+        for p_att, t in zip(p_atts, types):
+            distinct, codes = np.unique(t, return_inverse=True)
+            values = self._attribute(p_att).ids2strs(np.ascontiguousarray(distinct, dtype=np.int32))
+            df_counts[p_att] = Categorical.from_codes(codes.ravel(), categories=values)
+
+        if not items:
+            df_counts.index = Index(np.asarray(keys, dtype=np.int64), name='key')
+            return df_counts.sort_values(by='freq', ascending=False, kind='stable')
+
+        return keys2items(df_counts)
+
+    def _ids(self, cpos, p_atts):
+        """lexicon ids of corpus positions (one array per attribute)"""
+
+        ids = list()
+        for p_att in p_atts:
+            att_ids = np.empty(len(cpos), dtype=np.int32)
+            self._attribute(p_att).cpos2ids(cpos, att_ids)
+            ids.append(att_ids)
+
+        return ids
+
+    def shards(self, starts=None, ends=None, nr_shards=1, s_att=None):
+        """Split intervals into nr_shards disjoint groups of intervals with
+        (about) the same number of tokens.  Intervals are cut at the
+        boundaries of the groups; if s_att is given, cuts are moved
+        to the start of the region of s_att at the boundary (e.g. to
+        keep texts in one group).
+
+        :param starts: start positions of intervals (None: whole corpus)
+        :param ends: end positions of intervals (inclusive)
+        :param int nr_shards: number of groups
+        :param str s_att: s-attribute to align cuts with
+
+        :return: starts and ends of each group
+        :rtype: list of tuple(ndarray, ndarray)
+        """
+
+        if starts is None:
+            starts, ends = [0], [len(self._attribute('word')) - 1]
+        starts, ends = valid_intervals(starts, ends)
+
+        # token offsets of intervals
+        lengths = ends - starts + 1
+        cum = np.cumsum(lengths)
+        total = int(cum[-1]) if len(cum) > 0 else 0
+
+        # boundaries of shards (token offsets), optionally aligned
+        boundaries = [0]
+        att = self.attributes.attribute(s_att, 's') if s_att else None
+        for k in range(1, nr_shards):
+            offset = (total * k) // nr_shards
+            i = int(np.searchsorted(cum, offset, side='right'))
+            if i >= len(cum):
+                break
+            if att is not None:
+                cpos = int(starts[i] + offset - (cum[i] - lengths[i]))
+                try:
+                    region_start = att[att.cpos2struc(cpos)][0]
+                    offset = int(cum[i] - lengths[i] + max(region_start - starts[i], 0))
+                except KeyError:
+                    pass
+            boundaries.append(max(offset, boundaries[-1]))
+        boundaries.append(total)
+
+        shards = list()
+        for lo, hi in zip(boundaries[:-1], boundaries[1:]):
+            if hi <= lo:
+                continue
+            i0 = int(np.searchsorted(cum, lo, side='right'))
+            i1 = int(np.searchsorted(cum, hi - 1, side='right'))
+            s = starts[i0: i1 + 1].copy()
+            e = ends[i0: i1 + 1].copy()
+            s[0] += lo - (cum[i0] - lengths[i0])
+            e[-1] -= cum[i1] - hi
+            shards.append((s, e))
+
+        return shards
+
+    def scan(self, p_atts=['word'], starts=None, ends=None, workers=None, s_att=None, items=True, coded=False,
+             shard_size=SHARD_SIZE):
+        """Count p-attribute (combinations) of all tokens in [start .. end]
+        (default: whole corpus).  The intervals are split into shards
+        of at most shard_size tokens (see shards), which are counted
+        in worker processes (if workers > 1) and merged.
+
+        :param list p_atts: p-attribute (combinations) to count
+        :param starts: start positions of intervals (None: whole corpus)
+        :param ends: end positions of intervals (inclusive)
+        :param int workers: number of worker processes (None: self.workers)
+        :param str s_att: s-attribute to align shards with
+        :param bool items: index by item? (else: by packed key, see pack_ids)
+        :param bool coded: return CodedFreqFrame (no strings)?
+        :param int shard_size: maximum number of tokens per shard
+
+        :return: counts of the p_attribute (combinations) in the intervals
+        :rtype: FreqFrame
+        """
+
+        workers = self.workers if workers is None else workers
+        sizes = self.sizes(p_atts)
+        if starts is None:
+            starts, ends = [0], [len(self._attribute('word')) - 1]
+        starts, ends = valid_intervals(starts, ends)
+        if not packable(sizes):
+            return self._count_ids(intervals2cpos(starts, ends), p_atts, items, coded)
+
+        total = int((ends - starts + 1).sum())
+        nr_shards = max(workers, -(-total // shard_size))
+        shards = self.shards(starts, ends, nr_shards, s_att)
+        logger.info(f'scanning {total} tokens in {len(shards)} shard(s) with {workers} worker(s)')
+
+        if workers > 1 and len(shards) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_count_shard, self.corpus_name, self.registry_dir, p_atts, s, e)
+                           for s, e in shards]
+                parts = [future.result() for future in futures]
+        else:
+            parts = [self._count_keys(self._ids(intervals2cpos(s, e), p_atts), sizes) for s, e in shards]
+
+        keys, freqs = merge_counts(parts)
+
+        return self._decode(keys, unpack_keys(keys, sizes), freqs, p_atts, items, coded)
+
+    def intervals(self, starts, ends, p_atts=['word'], items=True, coded=False):
+        """Create a frequency table for the p-attribute values of all
+        tokens in [start .. end] (in-process replacement of
+        cwb-scan-corpus -R).
+
+        :param starts: start positions of intervals
+        :param ends: end positions of intervals (inclusive)
+        :param list p_atts: p-attribute (combinations) to count
+        :param bool items: index by item? (else: by packed key, see pack_ids)
+        :param bool coded: return CodedFreqFrame (no strings)?
+
+        :return: counts of the p_attribute (combinations) in the intervals
+        :rtype: FreqFrame
+
+        """
+
+        return self.scan(p_atts, starts, ends, items=items, coded=coded)
+
+    def _count_mwus(self, starts, ends, p_atts=['word']):
+        """Count MWUs, i.e. the sequences of p-attribute (combinations) in
+        [start .. end].  Tokens are coded once via their lexicon ids,
+        identical sequences are grouped per length (np.unique on the
+        rows of a matrix of token codes), and each token type is
+        decoded once.  Empty and negative intervals are skipped.
+
+        :param starts: start positions of intervals
+        :param ends: end positions of intervals (inclusive)
+        :param list p_atts: p-attribute (combinations) to count
+
+        :return: counts of the MWUs (values are " "-joined per p-attribute)
+        :rtype: FreqFrame
+        """
+
+        starts, ends = valid_intervals(starts, ends)
+        lengths = ends - starts + 1
+        cpos = intervals2cpos(starts, ends)
+
+        if len(cpos) == 0:
+            return keys2items(DataFrame({'freq': np.array([], dtype=np.int64), **{p_att: [] for p_att in p_atts}}))
+
+        # code tokens: one code per distinct p-attribute combination
+        attributes = [self._attribute(p_att) for p_att in p_atts]
+        sizes = self.sizes(p_atts)
+        ids = self._ids(cpos, p_atts)
+        if packable(sizes):
+            tokens, codes = np.unique(pack_ids(ids, sizes), return_inverse=True)
+            token_ids = unpack_keys(tokens, sizes)
+        else:
+            tokens, codes = np.unique(np.stack(ids, axis=1), axis=0, return_inverse=True)
+            token_ids = [tokens[:, i] for i in range(len(p_atts))]
+        codes = codes.ravel()
+
+        # group identical sequences of the same length
+        offsets = np.cumsum(lengths) - lengths
+        mwus, freqs = list(), list()
+        for length in np.unique(lengths):
+            sequences = codes[offsets[lengths == length][:, None] + np.arange(length)]
+            distinct, counts = np.unique(sequences, axis=0, return_counts=True)
+            mwus.extend(distinct)
+            freqs.extend(counts)
+
+        # decode
+        df_counts = DataFrame({'freq': np.asarray(freqs, dtype=np.int64)})
+        for p_att, att, t in zip(p_atts, attributes, token_ids):
+            values = np.array(att.ids2strs(np.ascontiguousarray(t, dtype=np.int32)), dtype=object)
+            df_counts[p_att] = [" ".join(values[mwu]) for mwu in mwus]
+
+        # different sequences can be joined to the same strings
+        if len(p_atts) > 0:
+            df_counts = df_counts.groupby(p_atts, sort=False)['freq'].sum().reset_index()
+
+        return keys2items(df_counts[['freq'] + p_atts])
 
     def _cpos2patts(self, cpos, p_atts=['word'], ignore=True):
         """Retrieve p-attributes of corpus position.
@@ -198,31 +1016,141 @@ class Counts:
             token = [None] * len(p_atts)
         else:
             token = [
-                self.attributes.attribute(p_att, 'p')[cpos] for p_att in p_atts
+                self._attribute(p_att)[cpos] for p_att in p_atts
             ]
 
         return tuple(token)
 
-    def cpos(self, cpos_list, p_atts=['word']):
+    def cpos(self, cpos_list, p_atts=['word'], items=True, coded=False):
         """Create a frequency table for the p-attribute values of the
         cpos-list.
 
         - strategy: split   /YES; flags  ; combo x
 
-        :param list cpos_list: corpus positions to fill
+        Positions are counted on lexicon ids; -1 is ignored.
+
+        :param cpos_list: corpus positions to fill (list, set, Series, or ndarray)
         :param list p_atts: p-attribute (combinations) to count
+        :param bool items: index by item? (else: by packed key, see pack_ids)
+        :param bool coded: return CodedFreqFrame (no strings)?
 
         :return: counts of the p_attribute (combinations) of the positions
         :rtype: FreqFrame
 
         """
-        items = [self._cpos2patts(p, p_atts=p_atts) for p in cpos_list]
-        df_counts = count_items(items, p_atts)
-        return df_counts
+        if isinstance(cpos_list, (set, frozenset)):
+            cpos = np.fromiter(cpos_list, dtype=np.int64, count=len(cpos_list))
+        else:
+            cpos = np.asarray(cpos_list, dtype=np.int64)
+        cpos = cpos[cpos >= 0]
+
+        return self._count_ids(cpos, p_atts, items, coded)
+
+    def _estimate(self, name, nr_matches, nr_tokens, nr_atts):
+        """estimated seconds of a strategy according to the cost model"""
+
+        fixed, per_match, per_token = self.costs[name]
+        return fixed + per_match * nr_matches + per_token * nr_tokens * nr_atts
+
+    def _choose_strategy(self, method, candidates, nr_matches, nr_tokens, nr_atts):
+        """Choose the cheapest of the candidate strategies according to
+        the cost model.
+
+        :param str method: 'dump' or 'matches'
+        :param dict candidates: strategy → name of entry in cost model
+        :param int nr_matches: number of matches
+        :param int nr_tokens: number of tokens in matches
+        :param int nr_atts: number of p-attributes
+
+        :return: strategy
+        :rtype: int
+        """
+
+        estimates = {
+            strategy: self._estimate(name, nr_matches, nr_tokens, nr_atts) for strategy, name in candidates.items()
+        }
+        strategy = min(estimates, key=estimates.get)
+        logger.info(
+            f'{method}: choosing strategy {strategy} for {nr_matches} matches, {nr_tokens} tokens, '
+            f'{nr_atts} p-attribute(s) (estimated seconds: '
+            f'{", ".join(f"{s}: {e:.4f}" for s, e in estimates.items())})'
+        )
+        if self.stats is not None:
+            self.stats.record_strategy(candidates[strategy])
+
+        return strategy
+
+    def _log_costs(self, method, name, seconds, nr_matches, nr_tokens, nr_atts):
+        """log (and record) time of strategy and estimate of the cost
+        model (if number of matches is known)"""
+
+        estimate = None if nr_matches is None else self._estimate(name, nr_matches, nr_tokens, nr_atts)
+        logger.info(
+            f'{method}: {name} took {seconds:.4f} seconds' +
+            ('' if estimate is None else f' (estimated: {estimate:.4f})')
+        )
+        if self.stats is not None:
+            self.stats.record_strategy(name, seconds, estimate)
+
+    def calibrate(self, dumps, p_atts=['word'], cqp=None, rounds=3):
+        """Calibrate the cost model of dump (and matches, if cqp is
+        given): time all strategies on dumps of different sizes and fit
+        fixed costs, costs per match, and costs per token and
+        p-attribute (least squares).  Updates self.costs.
+
+        :param list dumps: dumps (indexed by match, matchend) of different sizes
+        :param list p_atts: p-attribute (combination) to count
+        :param CQP cqp: running cqp process
+        :param int rounds: number of runs per strategy (minimum is used)
+
+        :return: name of strategy, matches, tokens, attributes, seconds
+        :rtype: DataFrame
+        """
+
+        def timing(task):
+            seconds = list()
+            for _ in range(rounds):
+                begin = default_timer()
+                task()
+                seconds.append(default_timer() - begin)
+            return min(seconds)
+
+        combinations = [p_atts[:1], p_atts] if len(p_atts) > 1 else [p_atts]
+        records = list()
+        for df_dump in dumps:
+            df = df_dump.reset_index()
+            nr_matches = len(df)
+            nr_tokens = int((df['matchend'] - df['match'] + 1).sum())
+            if cqp is not None:
+                cqp.Undump('Calibration', df_dump)
+            for atts in combinations:
+                tasks = {
+                    'dump-1-split': lambda: self.dump(df_dump, p_atts=atts, split=True, strategy=1),
+                    'dump-1-mwu': lambda: self.dump(df_dump, p_atts=atts, split=False, strategy=1),
+                    'dump-2-split': lambda: self.dump(df_dump, p_atts=atts, split=True, strategy=2)
+                }
+                if cqp is not None:
+                    tasks['matches-3'] = lambda: self.matches(cqp, 'Calibration', p_atts=atts, split=True, strategy=3)
+                    if len(atts) == 1:
+                        tasks['matches-1'] = lambda: self.matches(cqp, 'Calibration', p_atts=atts, flags='', strategy=1)
+                        tasks['matches-2'] = lambda: self.matches(cqp, 'Calibration', p_atts=atts, flags='', strategy=2)
+                for name, task in tasks.items():
+                    # number of tokens is estimated by number of matches in matches
+                    tokens = nr_matches if name.startswith('matches') else nr_tokens
+                    records.append((name, nr_matches, tokens, len(atts), timing(task)))
+
+        df_timings = DataFrame(records, columns=['name', 'matches', 'tokens', 'attributes', 'seconds'])
+        for name, df in df_timings.groupby('name'):
+            X = np.column_stack([np.ones(len(df)), df['matches'], df['tokens'] * df['attributes']])
+            coefficients = np.linalg.lstsq(X, df['seconds'].values, rcond=None)[0]
+            self.costs[name] = tuple(float(c) for c in coefficients.clip(min=0))
+            logger.info(f'calibrated costs of {name}: {self.costs[name]}')
+
+        return df_timings
 
     @time_it
     def dump(self, df_dump, start='match', end='matchend',
-             p_atts=['word'], split=False, strategy=2):
+             p_atts=['word'], split=False, strategy=None):
         """Count tokens in [start .. end] (columns or index columns in df_dump).
 
         - strategy 1: split NO/YES; flags  ; combo x
@@ -233,24 +1161,35 @@ class Counts:
         :param str end: column name where to end counting
         :param list p_atts: p-attribute (combinations) to count
         :param bool split: token-based count? (default: MWU)
-        :param int strategy: strategy 2 (cwb-scan-corpus) is faster,
-                             does not support MWU counts though
+        :param int strategy: strategy 2 (counting lexicon ids) is faster,
+                             does not support MWU counts though;
+                             None: cheapest strategy according to cost model
 
         :return: counts of the p_att (combin.) in the spans of two columns of the dump
         :rtype: FreqFrame
 
         """
 
+        # for working with match, matchend
+        df_dump = df_dump.reset_index()
+        nr_matches = len(df_dump)
+        nr_tokens = int((df_dump[end] - df_dump[start] + 1).clip(lower=0).sum()) if nr_matches > 0 else 0
+
         # choose strategy
+        candidates = {1: 'dump-1-split', 2: 'dump-2-split'} if split else {1: 'dump-1-mwu'}
+        if strategy is None:
+            strategy = self._choose_strategy('dump', candidates, nr_matches, nr_tokens, len(p_atts))
         if strategy == 2 and not split:
-            logger.info("dump: cannot use cwb-scan-corpus for MWUs, extracting and splitting tokens instead")
+            logger.info("dump: cannot count lexicon ids for MWUs, extracting and splitting tokens instead")
             strategy = 1
         logger.info(f"dump: strategy {strategy}")
+        begin = default_timer()
 
-        # for working with match, matchend
-        df_dump = df_dump.reset_index()
+        if strategy == 1 and not split:
+            logger.info("... counting MWUs")
+            df_counts = self._count_mwus(df_dump[start].values, df_dump[end].values, p_atts)
 
-        if strategy == 1:
+        elif strategy == 1:
 
             logger.info("... extracting tokens")
             ls = df_dump.apply(
@@ -260,30 +1199,21 @@ class Counts:
             ).values            # list of list of tuples (p_att_1, p_att_2, ...)
 
             logger.info("... splitting")
-            if split:
-                tokens = [token for tokens in ls for token in tokens]
-            else:
-                tokens = [
-                    tuple([" ".join(m) for m in zip(*mwu_list)]) for mwu_list in ls
-                ]
+            tokens = [token for tokens in ls for token in tokens]
 
             df_counts = count_items(tokens, p_atts)
 
         elif strategy == 2:
-            df_dump = df_dump.reset_index()
-            with NamedTemporaryFile(mode="wt") as f:
-                logger.info("... writing dump temporarily to disk")
-                df_dump[[start, end]].to_csv(f.name, sep="\t", header=None, index=False)
-                df_counts, R = cwb_scan_corpus(
-                    self.corpus_name, self.registry_dir, f.name, p_atts, min_freq=1
-                )
+            logger.info("... counting lexicon ids")
+            df_counts = self.intervals(df_dump[start].values, df_dump[end].values, p_atts)
 
         df_counts = df_counts.sort_values(by=['freq', 'item'], ascending=False)
+        self._log_costs('dump', candidates[strategy], default_timer() - begin, nr_matches, nr_tokens, len(p_atts))
 
         return df_counts
 
     @time_it
-    def matches(self, cqp, name, p_atts=["word"], split=False, flags=None, strategy=3):
+    def matches(self, cqp, name, p_atts=["word"], split=False, flags=None, strategy=None):
         """Counts tokens in [match .. matchend] of named subcorpus defined in
         running cqp.
 
@@ -296,6 +1226,8 @@ class Counts:
         :param list p_atts: p-attribute(-combinations) to count
         :param bool split: token-based count? (default: MWU)
         :param str flags: %c, %d, %cd
+        :param int strategy: see above (None: cheapest available
+                             strategy according to cost model)
 
         :return: counts of the p_attribute (combinations) of the matches
         :rtype: FreqFrame
@@ -336,6 +1268,19 @@ class Counts:
                         ]]))
                 )
 
+        # the number of tokens is not known before dumping; estimated by the number of matches
+        nr_matches = None
+        if strategy is None:
+            nr_matches = int(cqp.Exec(f'size {name};') or 0)
+            candidates = dict()
+            if not split and not combo:
+                candidates[1] = 'matches-1'
+            if not combo:
+                candidates[2] = 'matches-2'
+            if split and not flags:
+                candidates[3] = 'matches-3'
+            strategy = self._choose_strategy('matches', candidates, nr_matches, nr_matches, len(p_atts))
+
         if strategy == 1:
             if split or combo:
                 logger.warning(
@@ -351,10 +1296,11 @@ class Counts:
         if strategy == 3:
             if flags or not split:
                 logger.warning(
-                    "matches: cannot use cwb-scan-corpus"
+                    "matches: cannot count lexicon ids"
                 )
                 strategy = 2
         logger.info(f"matches: strategy {strategy}")
+        begin = default_timer()
 
         if strategy == 1:
             # split NO; flags NO/YES; combo NO
@@ -386,12 +1332,65 @@ class Counts:
             with NamedTemporaryFile(mode="wt") as f:
                 logger.info("... writing dump temporarily to disk")
                 cqp.Exec(f'dump {name} > "{f.name}";')
-                df_counts, R = cwb_scan_corpus(
-                    self.corpus_name, self.registry_dir, f.name, p_atts, min_freq=1
-                )
+                try:
+                    df_dump = read_csv(f.name, sep="\t", header=None, usecols=[0, 1],
+                                       names=['match', 'matchend'])
+                except EmptyDataError:
+                    df_dump = DataFrame(columns=['match', 'matchend'], dtype=int)
+            logger.info("... counting lexicon ids")
+            df_counts = self.intervals(df_dump['match'].values, df_dump['matchend'].values, p_atts)
+            nr_matches = len(df_dump)
+
+        self._log_costs('matches', f'matches-{strategy}', default_timer() - begin, nr_matches, nr_matches, len(p_atts))
 
         return df_counts
 
+    def _mwus_batch(self, cqp, queries, p_atts=None, name='Tmp'):
+        """Run batches of queries in one CQP command each (query, size,
+        dump), count matches and MWUs per query.
+
+        :param CQP cqp: running cqp process
+        :param list queries: query strings
+        :param list p_atts: p-attribute (combinations) for breakdown (None: no breakdown)
+        :param str name: name of temporary NQR
+
+        :return: counts of the queries or of the items of each query
+        :rtype: FreqFrame
+        """
+
+        freqs, matches = list(), list()
+        for i in range(0, len(queries), MWU_BATCH):
+            batch = queries[i: i + MWU_BATCH]
+            result = cqp.Exec(" ".join(f'{name}={query}; size {name}; dump {name};' for query in batch))
+            if not cqp.Ok():
+                raise ValueError(f'mwus: CQP error in batch of queries: {cqp.Error_message()}')
+
+            # parse: size followed by <size> lines of dump
+            lines = result.split("\n") if result else []
+            k = 0
+            for query in batch:
+                size = int(lines[k])
+                freqs.append(size)
+                matches.append([line.split("\t")[:2] for line in lines[k + 1: k + 1 + size]])
+                k += 1 + size
+
+        if not p_atts:
+            df = DataFrame({'freq': freqs}, index=Index(queries, name='item', dtype=object))
+            return df.sort_values(by=['freq', 'item'], ascending=False)
+
+        breakdowns = list()
+        for query, rows in zip(queries, matches):
+            intervals = np.array(rows, dtype=np.int64).reshape(-1, 2)
+            df = self._count_mwus(intervals[:, 0], intervals[:, 1], p_atts)
+            df['query'] = query
+            breakdowns.append(df.reset_index())
+
+        df = concat(breakdowns) if breakdowns else DataFrame(columns=['query', 'item', 'freq'] + p_atts)
+        df = df.set_index(['query', 'item'])[['freq'] + p_atts]
+        df['freq'] = df['freq'].astype(int)
+
+        return df
+
     @time_it
     def mwus(self, cqp, queries, p_atts=None, fill_missing=True, strategy=1):
         """Calculates frequencies for MWU queries in activated subcorpus.
@@ -402,6 +1401,7 @@ class Counts:
         - strategy 1: split NO| - ; flags x; combo x; mwu NO
         - strategy 2: split NO| - ; flags x; combo x; mwu YES
         - strategy 3: split NO| - ; flags x; combo  ; mwu YES
+        - strategy 4: split NO| - ; flags x; combo x; mwu YES (per query)
 
         caveat: strategy 1 does not yield breakdown in attributes
         this implies also different indexing
@@ -417,13 +1417,18 @@ class Counts:
         - Strategy 3:
           1. run query for all items at the same time
           2. count_matches()
+        - Strategy 4: for batches of items in one CQP command
+          1. run query, get size and dump of NQR via CQP
+          2. count MWUs of each query (if p_atts are given)
 
         :param CQP cqp: running cqp process
         :param set queries: set of query strings to get frequency breakdown for
         :param bool fill_missing: count 0 for missing items?
         :param int strategy: strategy to use (see below)
 
-        :return: counts of the queries (strategy 1) or the items in the queries
+        :return: counts of the queries (strategy 1 and 4 w/o p_atts),
+                 the items in the queries (strategies 2 and 3), or the
+                 items of each query (strategy 4, indexed by query and item)
         :rtype: FreqFrame
 
         """
@@ -439,6 +1444,10 @@ class Counts:
                 )
                 strategy = 2
 
+        if strategy == 4:
+            logger.info("mwus: strategy 4")
+            return self._mwus_batch(cqp, list(queries), p_atts, name)
+
         # necessary for strategies 2 & 3:
         p_atts = ['word'] if not p_atts else p_atts
 
@@ -482,17 +1491,148 @@ class Counts:
         return df
 
 
+MWU_BATCH = 100
+
+# measures that are <= 0 for all rows with O11 <= E11
+SIGNED_MEASURES = [
+    'z_score', 't_score', 'log_likelihood', 'simple_ll', 'liddell',
+    'local_mutual_information', 'conservative_log_ratio'
+]
+
+
+def _score_chunk(df, ams, freq, digits, vocab):
+    """score one chunk of counts (in a worker process)"""
+
+    return measures.score(df, measures=ams, freq=freq, per_million=True,
+                          digits=digits, boundary='poisson', vocab=vocab)
+
+
+def score_chunks(df, ams=None, freq=True, digits=6, vocab=None,
+                 chunk_size=SCORE_CHUNK_SIZE, workers=1):
+    """Calculate association measures (measures.score) on chunks of rows
+    of df, in worker processes if workers > 1, and concatenate the
+    results.  All measures are calculated row by row, the size of the
+    vocabulary is taken from the whole table; results are thus the
+    same as scoring df in one call.
+
+    :param DataFrame df: DataFrame with reasonably-named columns, index 'item'
+    :param list ams: association measures to calculate (None=all)
+    :param bool freq: also return observed and expected frequencies?
+    :param int digits: round scores
+    :param int vocab: size of vocabulary (None: number of rows)
+    :param int chunk_size: number of rows per chunk (None: one chunk)
+    :param int workers: number of worker processes
+
+    :return: scored counts
+    :rtype: ScoreFrame
+    """
+
+    vocab = len(df) if vocab is None else vocab
+    if chunk_size is None or len(df) <= chunk_size:
+        return _score_chunk(df, ams, freq, digits, vocab)
+
+    chunks = [df.iloc[start: start + chunk_size] for start in range(0, len(df), chunk_size)]
+    logger.info(f'scoring {len(df)} counts in {len(chunks)} chunks with {workers} worker(s)')
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(_score_chunk, chunks, repeat(ams), repeat(freq), repeat(digits), repeat(vocab)))
+    else:
+        parts = [_score_chunk(chunk, ams, freq, digits, vocab) for chunk in chunks]
+
+    return concat(parts)
+
+
+def top_k(df, order, k):
+    """The k rows with the highest values of order (ties are broken by
+    item, as in sort_values), found by partial selection: only rows
+    reaching the k-th highest value are sorted.
+
+    :param DataFrame df: DataFrame with column order, index 'item'
+    :param str order: column to sort by (in descending order)
+    :param int k: number of rows
+
+    :return: k rows, sorted
+    :rtype: DataFrame
+    """
+
+    values = df[order].to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    if valid.sum() > k:
+        threshold = np.partition(values[valid], valid.sum() - k)[valid.sum() - k]
+        df = df.loc[values >= threshold]
+
+    return df.sort_values(by=[order, 'item'], ascending=[False, True]).head(k)
+
+
+def prune_counts(df, order='log_likelihood', cut_off=1000, digits=6, vocab=None,
+                 chunk_size=SCORE_CHUNK_SIZE, workers=1):
+    """Candidates for the cut_off highest scoring rows of df.
+
+    For measures in SIGNED_MEASURES, only rows with O11 > E11 are
+    scored (if there are at least cut_off of them, and the cut_off-th
+    score is positive).  Only the ranking measure is calculated; the
+    top rows are found by partial selection (see top_k).  Frequency
+    columns (O11, E11, ...) are used directly.  Other columns cannot be
+    used for pruning.
+
+    :param DataFrame df: DataFrame with reasonably-named columns, index 'item'
+    :param str order: association measure for sorting (in descending order)
+    :param int cut_off: number of items to retrieve
+    :param int digits: round scores
+    :param int vocab: size of vocabulary (see measures.score)
+    :param int chunk_size: number of rows per chunk (see score_chunks)
+    :param int workers: number of worker processes
+
+    :return: cut_off rows of df (or df, if order or cut_off cannot be used for pruning)
+    :rtype: DataFrame
+    """
+
+    if cut_off <= 0:
+        logger.info(f'cannot prune counts to {cut_off} candidates')
+        return df
+
+    df_freq = expected_frequencies(observed_frequencies(df), observed=True)
+
+    if order in measures.list_measures():
+        candidates = (df_freq['O11'] > df_freq['E11']) if order in SIGNED_MEASURES else None
+        if candidates is not None and candidates.sum() < cut_off:
+            candidates = None
+        scores = score_chunks(df if candidates is None else df.loc[candidates], [order], False, digits, vocab,
+                              chunk_size, workers)
+        if candidates is not None and not top_k(scores, order, cut_off)[order].iloc[-1] > 0:
+            # rows with O11 <= E11 might tie with candidates
+            scores = score_chunks(df, [order], False, digits, vocab, chunk_size, workers)
+
+    elif order in df_freq.columns:
+        scores = round(df_freq[[order]], digits) if digits is not None else df_freq[[order]]
+
+    else:
+        logger.info(f'cannot prune counts by "{order}"')
+        return df
+
+    logger.info(f'pruned {len(df)} counts to {cut_off} candidates ({len(scores)} scored by "{order}")')
+
+    return df.loc[top_k(scores, order, cut_off).index]
+
+
 def score_counts(df, order='log_likelihood', cut_off=1000,
-                 flags=None, ams=None, digits=6, vocab=None):
+                 flags=None, ams=None, digits=6, vocab=None, prune=True,
+                 chunk_size=SCORE_CHUNK_SIZE, workers=1):
     """score counts in DataFrame.
 
     :param DataFrame df: DataFrame with reasonably-named columns, index 'item'
+                         (or CodedFreqFrame; items are materialized or folded before scoring)
 
     :param str order: association measure for sorting (in descending order)
     :param int cut_off: number of items to retrieve
     :param str flags: '%c' / '%d' / '%cd' (cwb-ccc algorithm)
     :param list ams: association measures to calculate (None=all)
     :param int digits: round dataframe
+    :param int vocab: size of vocabulary (None: number of rows)
+    :param bool prune: score only the candidates for the cut_off highest
+                       scoring rows with all measures (see prune_counts)?
+    :param int chunk_size: number of rows scored at once (see score_chunks)
+    :param int workers: number of worker processes for scoring chunks
 
     :return: scored counts
     :rtype: ScoreFrame
@@ -501,12 +1641,23 @@ def score_counts(df, order='log_likelihood', cut_off=1000,
 
     logger.info(f'scoring {len(df)} counts')
 
-    # post-processing: fold items
-    df = fold_df(df, flags)
+    # post-processing: fold items (coded frames: on lexicon ids)
+    if isinstance(df, CodedFreqFrame) and flags is not None:
+        df = df.counts.fold(df.df, flags, df.p_atts, items=True)
+    elif isinstance(df, CodedFreqFrame):
+        df = df.to_freqframe()[list(df.df.columns)]
+    else:
+        df = fold_df(df, flags)
+
+    # vocabulary of the whole table (not of chunks or candidates)
+    vocab = len(df) if vocab is None else vocab
+
+    # top-k mode
+    if prune and cut_off is not None and len(df) > cut_off:
+        df = prune_counts(df, order, cut_off, digits, vocab, chunk_size, workers)
 
     # calculate associations
-    df = measures.score(df, measures=ams, freq=True, per_million=True,
-                        digits=digits, boundary='poisson', vocab=vocab)
+    df = score_chunks(df, ams, True, digits, vocab, chunk_size, workers)
 
     # sort
     df = df.sort_values(by=[order, 'item'], ascending=[False, True])
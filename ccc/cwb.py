@@ -19,14 +19,16 @@ from .cache import Cache, generate_idx, generate_library_idx
 from .cl import Corpus as Attributes
 from .collocates import Collocates
 from .concordances import Concordance, format_line
-from .counts import Counts, cwb_scan_corpus
+from .counts import CodedFreqFrame, Counts, packable
 from .cqp import start_cqp
+from .datadir import DataDirectory, corpus_fingerprint
 from .keywords import Keywords
+from .marginals import MarginalsIndex
+from .textmatrix import TextMatrix, text_matrices
 from .utils import (aggregate_matches, chunk_anchors, correct_anchors,
                     decode, dump_left_join, fold_df, format_roles,
                     intersect_intervals, merge_intervals,
                     preprocess_query, time_it)
-from .version import __version__
 
 logger = logging.getLogger(__name__)
 
@@ -130,7 +132,7 @@ def init_data_dir(data_dir, corpus_name, lib_dir=None, inval_cache=True):
     """
 
     if data_dir is None:
-        data_dir = os.path.join("/tmp", "ccc-" + str(__version__))
+        data_dir = os.path.join("/tmp", "ccc-data")
     if not isinstance(data_dir, str):
         raise ValueError("parameter data_dir must be str")
 
@@ -204,11 +206,16 @@ class Corpus:
         # get corpus size
         self.corpus_size = len(self.attributes.attribute('word', 'p'))
 
-        # init cache
-        self.cache = Cache(os.path.join(self.data_dir, "CACHE"))
+        # init index of data directory and cache (valid for current version of corpus)
+        self.fingerprint = corpus_fingerprint(self.corpus_name, self.registry_dir)
+        self.directory = DataDirectory(self.data_dir, self.corpus_name)
+        self.directory.validate(self.fingerprint)
+        self.cache = Cache(os.path.join(self.data_dir, "CACHE"), fingerprint=self.fingerprint)
 
         # init counts
         self.counts = Counts(self.corpus_name, self.registry_dir)
+        self.counts.stats = self.cache.stats
+        self.counts.cache = self.cache
 
     def __str__(self):
         """Method for printing.
@@ -301,6 +308,9 @@ class Corpus:
 
         """
 
+        if self.subcorpus_name is not None:
+            self.directory.touch(self.subcorpus_name)
+
         return start_cqp(
             self.cqp_bin,
             self.registry_dir,
@@ -344,7 +354,7 @@ class Corpus:
 
         return self.counts._cpos2patts(cpos, p_atts, ignore)
 
-    def marginals(self, items=None, p_atts=['word'], flags=0, pattern=False):
+    def marginals(self, items=None, p_atts=['word'], flags=0, pattern=False, coded=False):
         """Extract marginal frequencies. If no items are given, return
         frequencies of all items.
 
@@ -352,6 +362,7 @@ class Corpus:
         :param str p_att: p-attribute to get frequencies for
         :param int flags: 1 = %c, 2 = %d, 3 = %cd (will activate wildcards)
         :param bool pattern: activate wildcards?
+        :param bool coded: items are packed keys (see counts.pack_ids), return CodedFreqFrame?
 
         :return: frequencies of the items in the whole corpus indexed by items
         :rtype: FreqFrame
@@ -361,6 +372,19 @@ class Corpus:
         # allow lazy evocation
         p_atts = [p_atts] if isinstance(p_atts, str) else p_atts
 
+        # packed keys
+        if coded:
+            return self._marginals_coded(items, p_atts)
+
+        # persistent index (see warmup)
+        if flags == 0 and not pattern:
+            index = self.marginals_index(p_atts)
+            if index.exists():
+                if self.subcorpus_name is not None:
+                    logger.warning('retrieving corpus marginals, not subcorpus marginals')
+                logger.info(f'using {str(index)}')
+                return index.frame() if items is None else index.lookup(items)
+
         # simple
         if len(p_atts) == 1 and items is not None:
             return self._marginals_simple(items, p_atts[0], flags, pattern)
@@ -368,6 +392,89 @@ class Corpus:
         else:
             return self._marginals_complex(items, p_atts)
 
+    def marginals_index(self, p_atts=['word']):
+        """Persistent index of corpus marginals of a p-attribute
+        (combination), stored in the cache directory.  Build it with
+        .build() or ccc-warmup --index.
+
+        :param list p_atts: p-attribute (combination)
+
+        :return: index (may not be built yet)
+        :rtype: MarginalsIndex
+        """
+
+        return MarginalsIndex(self.cache.directory, self.counts, p_atts)
+
+    def text_matrix(self, s_att='text', p_atts=['word']):
+        """Persistent sparse frequency matrix of the regions of an
+        s-attribute × the types of a p-attribute (combination), stored
+        in the cache directory.  Build it with .build() or ccc-warmup
+        --matrix.  Used for marginals of subcorpora.
+
+        :param str s_att: s-attribute (e.g. texts)
+        :param list p_atts: p-attribute (combination)
+
+        :return: matrix (may not be built yet)
+        :rtype: TextMatrix
+        """
+
+        return TextMatrix(self.cache.directory, self.counts, s_att, p_atts)
+
+    def _marginals_coded(self, keys=None, p_atts=['word']):
+        """Extract marginal frequencies of packed keys without
+        materializing strings (except for lexicon lookups of single
+        p-attributes).  0 if not in corpus.
+
+        :param ndarray keys: packed keys (see counts.pack_ids)
+        :param list p_atts: p-attribute (combination)
+
+        :return: counts of the keys in the whole corpus indexed by keys
+        :rtype: CodedFreqFrame
+
+        """
+
+        if self.subcorpus_name is not None:
+            logger.warning('retrieving corpus marginals, not subcorpus marginals')
+
+        index = self.marginals_index(p_atts)
+        if index.exists():
+            logger.info(f'using {str(index)}')
+            df = index.coded()
+
+        elif len(p_atts) == 1 and keys is not None:
+            # keys of single p-attributes are lexicon ids
+            freqs = self.counts.lexicon_frequencies(keys, p_atts[0])
+            return CodedFreqFrame.from_keys(keys, freqs, self.counts, p_atts)
+
+        else:
+            df = self._marginals_scan_coded(p_atts)
+
+        return df if keys is None else df.reindex(keys, fill_value=0)
+
+    def _marginals_scan_coded(self, p_atts=['word']):
+        """Extract all marginal frequencies of p-attribute (combination)
+        indexed by packed keys (see Counts.scan), cached as
+        "<p_atts>-coded-marginals" (see warmup).
+
+        :param list p_atts: p-attribute (combination)
+
+        :return: counts of all types in the whole corpus indexed by packed keys
+        :rtype: CodedFreqFrame
+
+        """
+
+        identifier = "-".join(p_atts) + "-coded-marginals"
+        df_keys = self.cache.get(identifier)
+        if df_keys is None:
+            with self.cache.lock(identifier) as waited:
+                if waited:
+                    df_keys = self.cache.get(identifier)
+                if df_keys is None:
+                    df_keys = self.counts.scan(p_atts, coded=True).df
+                    self.cache.set(identifier, df_keys)
+
+        return CodedFreqFrame(df_keys, self.counts, p_atts)
+
     def _marginals_simple(self, items, p_att='word', flags=0, pattern=False):
         """Extract marginal frequencies for given unigrams or unigram patterns
         of a single p-attribute.  0 if not in corpus.  For
@@ -415,7 +522,8 @@ class Corpus:
     def _marginals_complex(self, items, p_atts=['word']):
         """Extract marginal frequencies for p-attribute combinations,
         e.g. ["lemma", "pos"].  0 if not in corpus.  Marginals are
-        retrieved using cwb-scan-corpus, result is cached.
+        counted by scanning the corpus (see Counts.scan; set
+        self.counts.workers for parallel scans), result is cached.
 
         :param list items: list of tuples
         :param list p_atts: list of p-attributes
@@ -435,11 +543,14 @@ class Corpus:
             # get from cache if possible
             logger.info('using cached version of marginals of "%s"' % "_".join(p_atts))
         else:
-            # calculate all marginals for p-att combination
-            df, R = cwb_scan_corpus(
-                self.corpus_name, self.registry_dir, p_atts=p_atts, min_freq=0
-            )
-            self.cache.set(identifier, df)
+            # wait for concurrent scans of the same p-att combination
+            with self.cache.lock(identifier) as waited:
+                if waited:
+                    df = self.cache.get(identifier)
+                if df is None:
+                    # calculate all marginals for p-att combination
+                    df = self.counts.scan(p_atts)
+                    self.cache.set(identifier, df)
 
         if items is not None:
             # preprocess tuples
@@ -607,9 +718,26 @@ class Corpus:
 
         # retrieve from cache if possible
         df_dump = self.cache.get(identifier)
-        if df_dump is not None:
-            logger.info(f'using cached version "{identifier}" of df_dump with {len(df_dump)} matches')
-            return df_dump
+        if df_dump is None:
+            # wait for concurrent execution of the same query
+            with self.cache.lock(identifier) as waited:
+                if waited:
+                    df_dump = self.cache.get(identifier)
+                if df_dump is None:
+                    return self._dump_from_query(identifier, query, s_query, anchors, match_strategy,
+                                                 name, save, cwb_version, propagate_error)
+
+        logger.info(f'using cached version "{identifier}" of df_dump with {len(df_dump)} matches')
+        return df_dump
+
+    def _dump_from_query(self, identifier, query, s_query, anchors, match_strategy,
+                         name, save, cwb_version, propagate_error):
+        """Execute query and cache df_dump, see dump_from_query.
+
+        :return: df_dump
+        :rtype: DataFrame
+
+        """
 
         # init cqp and set matching strategy
         cqp = self.start_cqp()
@@ -705,6 +833,7 @@ class Corpus:
 
         if save:
             cqp.nqr_save(self.corpus_name, name)
+            self.directory.register(name)
 
         cqp.__del__()
 
@@ -1118,6 +1247,9 @@ class Corpus:
                 cqp.Query(f'{identifier} = {disjunction} within {s_context} expand to {s_context};')
                 logger.info(f'.. saving {identifier} in CWB binary format')
                 cqp.Exec(f'save {identifier};')
+                self.directory.register(identifier)
+            else:
+                self.directory.touch(identifier)
 
             cqp.__del__()
 
@@ -1143,6 +1275,9 @@ class Corpus:
                 cqp.Query(f'{topic_identifier} = {topic_query} expand to {s_context};')
                 logger.info(f'.. saving {topic_identifier} in CWB binary format')
                 cqp.Exec(f'save {topic_identifier};')
+                self.directory.register(topic_identifier)
+            else:
+                self.directory.touch(topic_identifier)
             logger.info('.. size: ' + cqp.Exec(f'size {topic_identifier};'))
 
             # FILTER
@@ -1156,6 +1291,9 @@ class Corpus:
             # SAVE
             logger.info(f'.. saving {filter_identifier} in CWB binary format')
             cqp.Exec(f'save {filter_identifier};')
+            self.directory.register(filter_identifier)
+        else:
+            self.directory.touch(filter_identifier)
 
         cqp.__del__()
 
@@ -1402,7 +1540,7 @@ class SubCorpus(Corpus):
 
     def _assign(self, subcorpus_name, df_dump, overwrite):
 
-        if subcorpus_name in self.show_nqr()['subcorpus'].values:
+        if self.directory.has_nqr(subcorpus_name):
             # NQR exists
             if overwrite:
                 logger.info(f'NQR "{subcorpus_name}" exists, overwriting')
@@ -1421,10 +1559,12 @@ class SubCorpus(Corpus):
             cqp.nqr_save(self.corpus_name, subcorpus_name)
             cqp.__del__()
 
-        if subcorpus_name not in self.show_nqr()['subcorpus'].values:
+        if not self.directory.has_nqr(subcorpus_name):
             logger.error(f'could not assigne NQR "{subcorpus_name}" from dataframe')
-        elif overwrite:
-            logger.info(f'assigned NQR "{subcorpus_name}" from dataframe')
+        else:
+            self.directory.register(subcorpus_name)
+            if overwrite:
+                logger.info(f'assigned NQR "{subcorpus_name}" from dataframe')
 
     def __str__(self):
 
@@ -1483,6 +1623,15 @@ class SubCorpus(Corpus):
         """
 
         logger.info('creating frequency breakdown')
+
+        if split and flags and len(self.df) > 0 and packable(self.counts.sizes(p_atts)):
+            # fold lexicon ids instead of strings
+            df_dump = self.df.reset_index()
+            breakdown = self.counts.intervals(
+                df_dump[start].values, df_dump[end].values, p_atts, items=False
+            )
+            return self.counts.fold(breakdown, flags, p_atts, items=True)
+
         breakdown = self.counts.dump(
             df_dump=self.df,
             start=start, end=end,
@@ -1499,7 +1648,7 @@ class SubCorpus(Corpus):
         :rtype: set
         """
 
-        identifier = generate_idx([self.df.reset_index()[['match', 'matchend']]]) + "-matches"
+        identifier = generate_idx([self.df.index]) + "-matches"
         f1 = self.cache.get(identifier)
         if not isinstance(f1, set):
             f1 = set()
@@ -1525,19 +1674,39 @@ class SubCorpus(Corpus):
             self.cache.set(identifier, df)
         return df
 
-    def marginals(self, items=None, p_atts=['word'], start='match', end='matchend'):
-        """
+    def marginals(self, items=None, p_atts=['word'], start='match', end='matchend', s_att=None):
+        """Counts of the p-attribute (combination) in the subcorpus.  If a
+        text matrix of the p-attribute (combination) is built (see
+        Corpus.text_matrix), regions of its s-attribute that are
+        covered completely are summed up from the matrix, remaining
+        tokens are counted exactly.
+
+        :param list items: items to get marginals for (None: all)
+        :param list p_atts: p-attribute (combination)
+        :param str start: column name where to start counting
+        :param str end: column name where to end counting
+        :param str s_att: s-attribute of text matrix to use (None: any built one)
+
         :return: counts of (start .. end) regions including matches
         :rtype: DataFrame
         """
 
-        identifier = generate_idx([self.df.reset_index()[[start, end]]]) + "-".join(p_atts) + "-marginals"
-        df = self.cache.get(identifier)
-        if not isinstance(df, DataFrame):
-            df = self.counts.dump(
-                self.df, start=start, end=end, p_atts=p_atts, split=True
-            )
-            self.cache.set(identifier, df)
+        matrices = text_matrices(self.cache.directory, self.counts, p_atts)
+        if s_att is not None:
+            matrices = [matrix for matrix in matrices if matrix.s_att == s_att]
+
+        if len(matrices) > 0:
+            logger.info(f'using {str(matrices[0])}')
+            df_dump = self.df.reset_index()
+            df = matrices[0].intervals(df_dump[start].values, df_dump[end].values)
+        else:
+            identifier = generate_idx([self.df.reset_index()[[start, end]]]) + "-".join(p_atts) + "-marginals"
+            df = self.cache.get(identifier)
+            if not isinstance(df, DataFrame):
+                df = self.counts.dump(
+                    self.df, start=start, end=end, p_atts=p_atts, split=True
+                )
+                self.cache.set(identifier, df)
 
         if items is not None:
             # preprocess tuples
@@ -0,0 +1,369 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""datadir.py
+
+management of the data directory of a corpus:
+
+- NQRs saved by CQP (one file "<CORPUS>:<name>" per NQR)
+- cache entries (see cache.py)
+- persistent indexes in the cache directory (see INDEXES)
+
+entries are only valid as long as the corpus does not change; the
+data directory thus stores a fingerprint of the corpus and discards
+NQRs and cache entries of other fingerprints.
+
+the last use of an entry is its modification time, which is updated
+whenever an entry is used; all processes working on the same data
+directory thus share the same index.  unused entries are evicted
+according to an age and size policy, which is stored in the data
+directory.
+
+"""
+import json
+import logging
+import os
+import shutil
+from hashlib import sha256
+from time import time
+
+# requirements
+from pandas import DataFrame, Series
+
+logger = logging.getLogger(__name__)
+
+POLICY = "gc-policy.json"
+FINGERPRINT = "fingerprint"
+CACHE = "CACHE.d"
+# persistent indexes in the cache directory of a fingerprint: name → depth of entries
+INDEXES = {'marginals': 1, 'textmatrix': 2}
+
+
+def _size(path):
+    """size of file or directory (recursive) in bytes; 0 if missing"""
+
+    try:
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        size = 0
+        for root, _, files in os.walk(path):
+            size += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def _listdir(path):
+    """entries of directory; empty if directory (no longer) exists"""
+
+    try:
+        return os.listdir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _remove(path):
+    """remove file or directory (if it exists)"""
+
+    try:
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _registry_home(registry):
+    """HOME directory of corpus given in registry entry (None if not given)"""
+
+    for line in registry.splitlines():
+        fields = line.strip().split(None, 1)
+        if len(fields) == 2 and fields[0] == "HOME":
+            return fields[1].strip().strip('"')
+    return None
+
+
+def _registry_attributes(registry):
+    """names of positional, structural and alignment attributes declared in registry entry"""
+
+    attributes = set()
+    for line in registry.splitlines():
+        fields = line.strip().split()
+        if len(fields) >= 2 and fields[0] in ("ATTRIBUTE", "STRUCTURE", "ALIGNED"):
+            attributes.add(fields[1])
+    return attributes
+
+
+def corpus_fingerprint(corpus_name, registry_dir):
+    """fingerprint of an encoded corpus: hash of its registry entry and
+    of name, size and modification time of the files of all attributes
+    declared in the registry entry ("<attribute>.*" in its HOME
+    directory; other files and subdirectories are not visited).
+    re-encoding the corpus changes the fingerprint.
+
+    :param str corpus_name: name of corpus in CWB registry
+    :param str registry_dir: /path/to/cwb/registry/
+
+    :return: fingerprint (None if registry entry cannot be read)
+    :rtype: str
+    """
+
+    try:
+        with open(os.path.join(registry_dir, corpus_name.lower()), "rb") as f:
+            registry = f.read()
+    except OSError:
+        logger.warning(f'cannot read registry entry of corpus "{corpus_name}"')
+        return None
+
+    h = sha256(registry)
+    registry = registry.decode('utf-8', errors='replace')
+    home = _registry_home(registry)
+    if home is not None and os.path.isdir(home):
+        attributes = _registry_attributes(registry)
+        files = list()
+        with os.scandir(home) as entries:
+            for entry in entries:
+                if entry.name.split(".", 1)[0] in attributes and entry.is_file():
+                    stat = entry.stat()
+                    files.append(f"{entry.name}\t{stat.st_size}\t{stat.st_mtime_ns}")
+        h.update("\n".join(sorted(files)).encode())
+
+    return h.hexdigest()[:16]
+
+
+class DataDirectory:
+    """Index of NQRs, cache entries and indexes in a data directory with
+    garbage collection of unused entries.
+
+    """
+
+    def __init__(self, path, corpus_name):
+        """
+        :param str path: /path/to/data/dir/ (DataDirectory of CQP)
+        :param str corpus_name: name of corpus in CWB registry
+        """
+
+        self.path = path
+        self.corpus_name = corpus_name
+
+    def __str__(self):
+
+        return f'data directory "{self.path}" of corpus "{self.corpus_name}"'
+
+    ##########
+    # POLICY #
+    ##########
+    @property
+    def policy(self):
+        """eviction policy of the data directory
+
+        :return: max_size (bytes) and max_age (seconds); None = unlimited
+        :rtype: dict
+        """
+
+        try:
+            with open(os.path.join(self.path, POLICY), "rt") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'max_size': None, 'max_age': None}
+
+    def set_policy(self, max_size=None, max_age=None):
+        """Set eviction policy for all processes using the data directory.
+        Entries are evicted when NQRs are registered, or when
+        calling collect().
+
+        :param int max_size: maximum size of all entries (bytes)
+        :param float max_age: maximum time since last use (seconds)
+        """
+
+        tmp = os.path.join(self.path, f".{POLICY}.{os.getpid()}")
+        with open(tmp, "wt") as f:
+            json.dump({'max_size': max_size, 'max_age': max_age}, f)
+        os.replace(tmp, os.path.join(self.path, POLICY))
+
+    def validate(self, fingerprint):
+        """Make sure all entries belong to the current version of the
+        corpus: if the fingerprint changed, remove all saved NQRs of
+        the corpus and all cache entries of other fingerprints.
+
+        :param str fingerprint: fingerprint of the corpus (see corpus_fingerprint)
+
+        :return: whether entries were valid
+        :rtype: bool
+        """
+
+        if fingerprint is None:
+            return True
+
+        path = os.path.join(self.path, FINGERPRINT)
+        try:
+            with open(path, "rt") as f:
+                stored = f.read().strip()
+        except FileNotFoundError:
+            stored = None
+
+        if stored == fingerprint:
+            return True
+
+        if stored is not None:
+            logger.warning(f'corpus "{self.corpus_name}" changed, invalidating {str(self)}')
+            for kind, name, entry, _ in self._scan():
+                if kind == 'nqr':
+                    _remove(entry)
+            cache = os.path.join(self.path, CACHE)
+            for namespace in _listdir(cache):
+                if namespace != fingerprint:
+                    _remove(os.path.join(cache, namespace))
+
+        tmp = f"{path}.{os.getpid()}"
+        with open(tmp, "wt") as f:
+            f.write(str(fingerprint))
+        os.replace(tmp, path)
+
+        return stored is None
+
+    ########
+    # NQRS #
+    ########
+    def nqr_path(self, name):
+        """path of saved NQR
+
+        :param str name: name of NQR
+
+        :return: /path/to/data/dir/<CORPUS>:<name>
+        :rtype: str
+        """
+
+        return os.path.join(self.path, f"{self.corpus_name}:{name}")
+
+    def has_nqr(self, name):
+        """Is NQR saved in data directory?  Does not start CQP and does not
+        list the directory.
+
+        :param str name: name of NQR
+
+        :rtype: bool
+        """
+
+        return os.path.isfile(self.nqr_path(name))
+
+    def touch(self, name):
+        """Mark NQR as used.
+
+        :param str name: name of NQR
+
+        :return: whether NQR exists
+        :rtype: bool
+        """
+
+        try:
+            os.utime(self.nqr_path(name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def register(self, name):
+        """Mark NQR as used after saving it, evict old entries according
+        to policy (but never the given NQR).
+
+        :param str name: name of NQR
+        """
+
+        if not self.touch(name):
+            logger.warning(f'NQR "{name}" is not saved in data directory')
+        policy = self.policy
+        if policy['max_size'] is not None or policy['max_age'] is not None:
+            self.collect(keep=[name], **policy)
+
+    ###########
+    # ENTRIES #
+    ###########
+    def _scan(self):
+        """yield (kind, name, path, stat) of all entries"""
+
+        prefix = self.corpus_name + ":"
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.startswith(prefix):
+                    yield 'nqr', entry.name[len(prefix):], entry.path, entry.stat()
+
+        # <CACHE.d>/<fingerprint>/<shard>/<entry>
+        cache = os.path.join(self.path, CACHE)
+        if not os.path.isdir(cache):
+            return
+        for namespace in _listdir(cache):
+            for shard in _listdir(os.path.join(cache, namespace)):
+                if shard.startswith("."):
+                    continue
+                if shard in INDEXES:
+                    yield from self._scan_index(os.path.join(cache, namespace, shard), shard, INDEXES[shard])
+                    continue
+                for name in _listdir(os.path.join(cache, namespace, shard)):
+                    if name.startswith("."):
+                        continue
+                    entry = os.path.join(cache, namespace, shard, name)
+                    try:
+                        yield 'cache', name, entry, os.stat(entry)
+                    except FileNotFoundError:
+                        pass
+
+    def _scan_index(self, path, kind, depth):
+        """yield (kind, name, path, stat) of all built indexes of one kind
+        (skipping indexes that are being built)"""
+
+        names = [""]
+        for _ in range(depth):
+            names = [
+                os.path.join(name, sub) for name in names for sub in _listdir(os.path.join(path, name))
+                if not sub.startswith(".") and not sub.endswith(".tmp")
+            ]
+        for name in names:
+            try:
+                yield kind, name, os.path.join(path, name), os.stat(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+
+    def entries(self):
+        """NQRs, cache entries and indexes in the data directory.
+
+        :return: kind, name, size (bytes), last_use (timestamp), path
+        :rtype: DataFrame
+        """
+
+        records = list()
+        for kind, name, path, stat in self._scan():
+            size = stat.st_size if kind == 'nqr' else _size(path)
+            records.append((kind, name, size, stat.st_mtime, path))
+
+        return DataFrame(records, columns=['kind', 'name', 'size', 'last_use', 'path'])
+
+    def collect(self, max_size=None, max_age=None, keep=[]):
+        """Evict entries that have not been used for max_age seconds, then
+        least recently used entries until all entries together are
+        smaller than max_size bytes.
+
+        :param int max_size: maximum size of all entries (bytes)
+        :param float max_age: maximum time since last use (seconds)
+        :param list keep: names of NQRs that must not be evicted
+
+        :return: evicted entries
+        :rtype: DataFrame
+        """
+
+        df = self.entries().sort_values('last_use', ascending=False)
+        protected = (df['kind'] == 'nqr') & df['name'].isin(keep)
+
+        evict = Series(False, index=df.index)
+        if max_age is not None:
+            evict |= (df['last_use'] < time() - max_age) & ~protected
+        if max_size is not None:
+            # keep most recently used entries that fit into max_size
+            evict |= (df['size'].where(~evict, 0).cumsum() > max_size) & ~protected
+
+        evicted = df.loc[evict]
+        for path in evicted['path']:
+            _remove(path)
+        if len(evicted) > 0:
+            logger.info(f'evicted {len(evicted)} entries ({evicted["size"].sum()} bytes) from {str(self)}')
+
+        return evicted.reset_index(drop=True)
@@ -289,9 +289,10 @@ class Constellation:
                    flags=None, ams=None, min_freq=2,
                    order='log_likelihood', cut_off=None,
                    marginals='corpus'):
-        """Retrieve collocates for constellation.
+        """Retrieve collocates for constellation.  All windows are
+        counted from one offset cube (see Collocates.cube).
 
-        :param int window: window around node for pre-selected matches
+        :param list windows: windows around node for pre-selected matches
 
         :return: collocates
         :rtype: list of DataFrames
@@ -299,7 +300,7 @@ class Constellation:
 
         # get df_cooc, f1_set, node_freq from cache if possible
         identifier = generate_idx(
-            [self.df.reset_index()[['match', 'matchend', 'context', 'contextend']], p_show, min_freq, self.discoursemes.values()]
+            [self.df[['context', 'contextend']], p_show, min_freq, self.discoursemes.values()]
         )
         f1_set = self.corpus.cache.get(identifier + "-f1_set")
         df_cooc = self.corpus.cache.get(identifier + "-df_cooc")
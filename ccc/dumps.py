@@ -115,14 +115,11 @@ class Dumps:
             logger.info(f"... table {i+1} of {len(subset)}")
 
             # determine reference frequencies
+            reference = marginals
             if isinstance(marginals, str):
                 if marginals == 'local':
-                    # get local marginals
-                    # THIS is expensive, use subcorpus.marginals instead!
-                    marginals = self.corpus.counts.dump(
-                        self.dumps[s].df, split=True, p_atts=p_query
-                    )
-                    # marginals = self.corpus.marginals(p_atts=p_query)
+                    # get local marginals (sums of rows of text matrix, if built)
+                    reference = self.dumps[s].marginals(p_atts=p_query)
                 elif marginals == 'corpus':
                     pass
                 else:
@@ -139,7 +136,7 @@ class Dumps:
             )
             table = collocates.show(
                 window=window, order=order, cut_off=cut_off,
-                ams=ams, min_freq=min_freq, flags=flags, marginals=marginals
+                ams=ams, min_freq=min_freq, flags=flags, marginals=reference
             )
             if len(table) > 0:
                 table['subcorpus'] = s
@@ -13,7 +13,7 @@ from pandas import DataFrame
 
 # part of module
 from .cache import generate_idx
-from .counts import score_counts
+from .counts import CodedFreqFrame, packable, score_counts
 
 logger = logging.getLogger(__name__)
 
@@ -41,10 +41,26 @@ class Keywords:
             self.p_query = ['word']
 
         # collect context and save result
-        if df_dump is not None:
+        if df_dump is not None and packable(self.corpus.counts.sizes(self.p_query)):
+
+            # counts indexed by packed keys: get from cache if possible
+            identifier = generate_idx([df_dump.index, p_query])
+            df_keys = self.corpus.cache.get(identifier + "-matchkeys")
+
+            # create and cache otherwise
+            if not isinstance(df_keys, DataFrame):
+                logger.info('collecting token counts of subcorpus')
+                df = df_dump.reset_index()
+                df_keys = corpus.counts.intervals(
+                    df['match'].values, df['matchend'].values, self.p_query, coded=True
+                ).df
+                self.corpus.cache.set(identifier + "-matchkeys", df_keys)
+            counts = CodedFreqFrame(df_keys, self.corpus.counts, self.p_query)
+
+        elif df_dump is not None:
 
             # get from cache if possible
-            identifier = generate_idx([df_dump.reset_index()[['match', 'matchend']], p_query])
+            identifier = generate_idx([df_dump.index, p_query])
             counts = self.corpus.cache.get(identifier + "-matchcounts")
 
             # create and cache otherwise
@@ -67,12 +83,15 @@ class Keywords:
              show_negative=False):
 
         # consistency check
-        if self.counts.empty:
+        if len(self.counts) == 0:
             logger.warning("nothing to show")
             return DataFrame()
 
+        # join on packed keys if possible, materialize items after scoring
+        coded = isinstance(self.counts, CodedFreqFrame)
+
         # get subcorpus frequencies und apply min freq
-        f = self.counts.rename(columns={'freq': 'f'})
+        f = (self.counts.df if coded else self.counts).rename(columns={'freq': 'f'})
         vocab = len(f)
         f1 = f['f'].sum()
         f = f.loc[f['f'] >= min_freq]
@@ -81,12 +100,15 @@ class Keywords:
         if isinstance(marginals, str):
             if marginals == 'corpus':
                 N = self.corpus.corpus_size
-                marginals = self.corpus.marginals(f.index, self.p_query)
+                marginals = self.corpus.marginals(f.index, self.p_query, coded=coded)
+                marginals = marginals.df if coded else marginals
             else:
                 raise NotImplementedError
         elif isinstance(marginals, DataFrame):
             # DataFrame must contain a column 'freq'
             N = marginals['freq'].sum()
+            if coded:
+                marginals = CodedFreqFrame.from_freqframe(marginals, self.corpus.counts, self.p_query).df
         else:
             raise NotImplementedError
 
@@ -96,6 +118,8 @@ class Keywords:
         df = df.fillna(0)
         df['f1'] = f1
         df['N'] = N
+        if coded:
+            df = CodedFreqFrame(df, self.corpus.counts, self.p_query)
 
         # score
         keywords = score_counts(df, order=order, cut_off=cut_off,
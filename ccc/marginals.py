@@ -0,0 +1,171 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""marginals.py
+
+persistent index of corpus marginals of a p-attribute (combination):
+
+- keys.npy: sorted packed keys of all types (see counts.pack_ids)
+- freqs.npy: corpus frequencies of the types
+- meta.json: p-attributes, lexicon sizes, corpus size
+
+the index is built once (e.g. by ccc-warmup --index) and
+memory-mapped afterwards; looking up items is a binary search
+(searchsorted) on the keys.  the index lives in the cache directory
+of the corpus and is thus invalidated with the cache when the corpus
+changes; it is evicted like cache entries when it has not been used
+(see DataDirectory.collect).
+
+"""
+import json
+import logging
+import os
+import shutil
+
+# requirements
+import numpy as np
+from pandas import DataFrame, Index
+
+# part of module
+from .counts import CodedFreqFrame, keys2items, split_items, unpack_keys
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2 ** 22
+
+
+class MarginalsIndex:
+    """Memory-mapped corpus marginals of a p-attribute (combination)."""
+
+    def __init__(self, directory, counts, p_atts=['word']):
+        """
+        :param str directory: /path/to/cache/directory/
+        :param Counts counts: counts of the corpus (attribute handles)
+        :param list p_atts: p-attribute (combination)
+        """
+
+        self.path = os.path.join(directory, "marginals", "-".join(p_atts))
+        self.counts = counts
+        self.p_atts = p_atts
+        self._arrays = None
+
+    def __str__(self):
+
+        return f'marginals index of "{" ".join(self.p_atts)}" in "{self.path}"'
+
+    def exists(self):
+        """Is the index built (for the current lexicon sizes)?
+
+        :rtype: bool
+        """
+
+        try:
+            with open(os.path.join(self.path, "meta.json"), "rt") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        return meta['sizes'] == self.counts.sizes(self.p_atts)
+
+    def remove(self):
+        """Remove the index."""
+
+        self._arrays = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def build(self, chunk_size=CHUNK_SIZE, workers=None):
+        """Count all types of the p-attribute (combination) in chunks of
+        corpus positions (see Counts.scan) and write the index
+        (atomically).
+
+        :param int chunk_size: number of corpus positions per chunk
+        :param int workers: number of worker processes (None: counts.workers)
+        """
+
+        logger.info(f'building {str(self)}')
+        sizes = self.counts.sizes(self.p_atts)
+        corpus_size = len(self.counts._attribute('word'))
+        coded = self.counts.scan(self.p_atts, workers=workers, coded=True, shard_size=chunk_size)
+        keys, freqs = coded.keys, coded.df['freq'].values
+
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, "keys.npy"), keys)
+        np.save(os.path.join(tmp, "freqs.npy"), freqs.astype(np.int64))
+        with open(os.path.join(tmp, "meta.json"), "wt") as f:
+            json.dump({'p_atts': self.p_atts, 'sizes': sizes, 'size': int(corpus_size)}, f)
+
+        self.remove()
+        try:
+            os.replace(tmp, self.path)
+        except OSError:
+            # concurrently built by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        logger.info(f'built {str(self)}: {len(keys)} types')
+
+    @property
+    def arrays(self):
+        """memory-mapped keys and freqs"""
+
+        if self._arrays is None:
+            self._arrays = (
+                np.load(os.path.join(self.path, "keys.npy"), mmap_mode='r'),
+                np.load(os.path.join(self.path, "freqs.npy"), mmap_mode='r')
+            )
+            # mark as used (see DataDirectory.collect)
+            os.utime(self.path)
+        return self._arrays
+
+    def lookup(self, items):
+        """Corpus frequencies of items.  Items are tuples of values or
+        strings (values joined by " ").  0 if not in corpus.
+
+        :param list items: items to get marginals for
+
+        :return: counts of the items in the whole corpus indexed by items
+        :rtype: FreqFrame
+        """
+
+        keys, freqs = self.arrays
+        items = list(items)
+
+        # binary search
+        item_keys = self.counts.encode(items, self.p_atts)
+        item_freqs = np.zeros(len(items), dtype=np.int64)
+        if len(keys) > 0:
+            pos = np.searchsorted(keys, item_keys).clip(max=len(keys) - 1)
+            found = (item_keys >= 0) & (keys[pos] == item_keys)
+            item_freqs = np.where(found, freqs[pos], 0)
+
+        df = DataFrame({'freq': item_freqs.astype(np.int64)})
+        for p_att, v in zip(self.p_atts, split_items(items, len(self.p_atts))):
+            df[p_att] = v
+        df.index = Index([" ".join(i) if isinstance(i, tuple) else i for i in items], name='item', dtype=object)
+
+        return df.sort_values(by=['freq', 'item'], ascending=False)
+
+    def frame(self):
+        """All marginals.
+
+        :return: counts of all types in the whole corpus indexed by items
+        :rtype: FreqFrame
+        """
+
+        keys, freqs = self.arrays
+        sizes = self.counts.sizes(self.p_atts)
+        df = DataFrame({'freq': np.asarray(freqs, dtype=np.int64)})
+        for p_att, ids in zip(self.p_atts, unpack_keys(np.asarray(keys), sizes)):
+            att = self.counts._attribute(p_att)
+            df[p_att] = att.ids2strs(np.ascontiguousarray(ids, dtype=np.int32))
+
+        return keys2items(df)
+
+    def coded(self):
+        """All marginals without materializing strings.
+
+        :return: counts of all types in the whole corpus indexed by packed keys
+        :rtype: CodedFreqFrame
+        """
+
+        keys, freqs = self.arrays
+
+        return CodedFreqFrame.from_keys(keys, freqs, self.counts, self.p_atts)
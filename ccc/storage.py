@@ -0,0 +1,656 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""storage.py
+
+columnar, memory-mappable serialization of DataFrames, arrays and sets;
+atomic pickling of all other objects.
+
+an entry is a directory containing a small manifest and one file per
+column:
+
+- numeric columns are stored as raw little-endian arrays (.npy)
+- string columns are stored as offsets (.npy) plus UTF-8 bytes (.bin)
+- missing values are stored as boolean masks (.npy)
+
+reading memory-maps all arrays (copy-on-write), i.e. there is no copy
+on load and several processes reading the same entry share pages of
+the page cache.
+
+all writes go to a temporary file or directory first and are then
+renamed into place.  columnar entries keep each version in its own
+directory next to a small pointer file naming the current version;
+the pointer is replaced atomically, so concurrent readers either see
+the complete old or the complete new version of an entry.
+
+optionally, files and pickles are compressed with a codec of the
+standard library (zlib, bz2, lzma); sorted integer arrays are delta
+encoded before compression.  compressed files are decoded on load
+(i.e. not memory-mapped).  with compression='auto', the codec is
+chosen per file: a sample is compressed with each codec and the codec
+with the lowest estimated load time (measured decoding time plus
+reading the compressed bytes) is used -- unless reading the raw bytes
+is faster.
+
+"""
+import bz2
+import json
+import logging
+import lzma
+import os
+import pickle
+import shutil
+import zlib
+from timeit import default_timer
+from uuid import uuid4
+
+# requirements
+import numpy as np
+from pandas import DataFrame, Index, MultiIndex, RangeIndex
+from pandas.api.types import is_bool_dtype, is_numeric_dtype, is_object_dtype
+from pandas.arrays import BooleanArray, FloatingArray, IntegerArray
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+POINTER = "current"
+FORMAT = "ccc-columnar"
+VERSION = 1
+RETRIES = 10
+
+# codecs: name → (compress, decompress)
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'bz2': (lambda data: bz2.compress(data, 9), bz2.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress)
+}
+# smaller files are never compressed
+COMPRESS_MIN_SIZE = 2 ** 16
+# size of sample for choosing codec
+COMPRESS_SAMPLE_SIZE = 2 ** 20
+# assumed bandwidth of reading from disk (bytes per second)
+READ_BANDWIDTH = 2 ** 28
+# header of compressed pickles
+PICKLE_MAGIC = b"ccc-compressed:"
+
+MASKED_ARRAYS = {
+    'i': IntegerArray,
+    'u': IntegerArray,
+    'f': FloatingArray,
+    'b': BooleanArray
+}
+
+
+###########
+# HELPERS #
+###########
+def _label(label):
+    """convert numpy scalars to their Python equivalent"""
+    return label.item() if isinstance(label, np.generic) else label
+
+
+def _is_label(label):
+    """can the label be represented in JSON without loss?"""
+    return label is None or isinstance(_label(label), (str, bool, int, float))
+
+
+def _is_missing(value):
+    """None or NaN"""
+    return value is None or (isinstance(value, float) and value != value)
+
+
+def _column_kind(values):
+    """determine how to store a column (None if it cannot be stored)
+
+    :param values: column values (numpy array or pandas extension array)
+
+    :return: 'numeric', 'masked', 'string', or None
+    :rtype: str
+    """
+
+    dtype = values.dtype
+
+    if isinstance(values, np.ndarray):
+        if dtype.kind in 'biuf':
+            return 'numeric'
+        if is_object_dtype(dtype):
+            if all(isinstance(v, str) or _is_missing(v) for v in values):
+                return 'string'
+        return None
+
+    if (is_numeric_dtype(dtype) or is_bool_dtype(dtype)) and hasattr(values, '_mask'):
+        return 'masked'
+
+    return None
+
+
+def _little_endian(array):
+    """make sure array is stored as little-endian"""
+    if array.dtype.byteorder == '>':
+        array = array.astype(array.dtype.newbyteorder('<'))
+    return array
+
+
+def _map_array(path):
+    """memory-map .npy file (copy-on-write); empty arrays are read normally"""
+    array = np.load(path, mmap_mode='c')
+    if array.size == 0:
+        array = np.load(path)
+    return array
+
+
+###############
+# COMPRESSION #
+###############
+def choose_codec(data, compression='auto'):
+    """Choose codec for compressing data.
+
+    :param bytes data: data to compress
+    :param str compression: None, 'auto', or name of codec (see CODECS)
+
+    :return: name of codec or None (do not compress)
+    :rtype: str
+    """
+
+    if compression is None or len(data) < COMPRESS_MIN_SIZE:
+        return None
+
+    if compression != 'auto':
+        if compression not in CODECS:
+            raise ValueError(f'unknown codec "{compression}"')
+        return compression
+
+    # estimated load time: decoding + reading compressed bytes
+    sample = data[:COMPRESS_SAMPLE_SIZE]
+    scale = len(data) / len(sample)
+    best, best_seconds = None, len(data) / READ_BANDWIDTH
+    for codec, (compress, decompress) in CODECS.items():
+        compressed = compress(sample)
+        start = default_timer()
+        decompress(compressed)
+        seconds = (default_timer() - start + len(compressed) / READ_BANDWIDTH) * scale
+        if seconds < best_seconds:
+            best, best_seconds = codec, seconds
+
+    return best
+
+
+def _is_sorted(array):
+    """is integer array sorted in ascending order?"""
+    return array.ndim == 1 and array.dtype.kind in 'iu' and len(array) > 1 and bool((array[1:] >= array[:-1]).all())
+
+
+def _save_array(directory, stem, array, compression=None):
+    """Save array as <stem>.npy (memory-mappable) or compressed as
+    <stem>.<codec> (sorted integer arrays are delta-encoded first).
+
+    :return: description of compressed file (None if not compressed)
+    :rtype: dict
+    """
+
+    array = _little_endian(np.ascontiguousarray(array))
+
+    if compression is not None and array.nbytes >= COMPRESS_MIN_SIZE:
+        delta = _is_sorted(array)
+        encoded = np.diff(array, prepend=array.dtype.type(0)) if delta else array
+        data = memoryview(encoded).cast('B')
+        codec = choose_codec(data, compression)
+        if codec is not None:
+            with open(os.path.join(directory, f"{stem}.{codec}"), "wb") as f:
+                f.write(CODECS[codec][0](data))
+            return {'codec': codec, 'delta': delta, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+    np.save(os.path.join(directory, stem + ".npy"), array)
+
+
+def _load_array(directory, stem, compressed=None):
+    """Load array saved by _save_array().
+
+    :param dict compressed: description of compressed file (None: memory-map <stem>.npy)
+
+    :return: array
+    :rtype: ndarray
+    """
+
+    if compressed is None:
+        return _map_array(os.path.join(directory, stem + ".npy"))
+
+    codec = compressed['codec']
+    with open(os.path.join(directory, f"{stem}.{codec}"), "rb") as f:
+        data = bytearray(CODECS[codec][1](f.read()))
+    array = np.frombuffer(data, dtype=compressed['dtype'])
+    if compressed['delta']:
+        array = np.cumsum(array, dtype=array.dtype)
+
+    return array.reshape(compressed['shape'])
+
+
+###########
+# COLUMNS #
+###########
+def _write_column(directory, name, values, compression=None):
+    """write one column to disk
+
+    :return: column description for manifest
+    :rtype: dict
+    """
+
+    kind = _column_kind(values)
+    compressed = dict()
+
+    def save(stem, array):
+        description = _save_array(directory, stem, array, compression)
+        if description is not None:
+            compressed[stem] = description
+
+    if kind == 'numeric':
+        save(name, values)
+        description = {'kind': kind, 'file': name, 'dtype': values.dtype.str}
+
+    elif kind == 'masked':
+        mask = np.asarray(values.isna())
+        data = values.to_numpy(dtype=values.dtype.numpy_dtype, na_value=0)
+        save(name, data)
+        save(name + "-mask", mask)
+        description = {'kind': kind, 'file': name, 'dtype': values.dtype.name}
+
+    elif kind == 'string':
+        mask = np.array([_is_missing(v) for v in values], dtype=bool)
+        encoded = [b"" if m else v.encode('utf-8') for v, m in zip(values, mask)]
+        offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = b"".join(encoded)
+        codec = choose_codec(blob, compression)
+        if codec is None:
+            with open(os.path.join(directory, name + ".bin"), "wb") as f:
+                f.write(blob)
+        else:
+            with open(os.path.join(directory, f"{name}-bin.{codec}"), "wb") as f:
+                f.write(CODECS[codec][0](blob))
+            compressed[name + "-bin"] = {'codec': codec}
+        save(name + "-offsets", offsets)
+        if mask.any():
+            save(name + "-mask", mask)
+        description = {'kind': kind, 'file': name, 'dtype': 'object', 'nulls': bool(mask.any())}
+
+    else:
+        raise TypeError(f'cannot store column of dtype "{values.dtype}"')
+
+    if compressed:
+        description['compressed'] = compressed
+
+    return description
+
+
+def _read_column(directory, description):
+    """read one column from disk
+
+    :return: column values
+    :rtype: ndarray or ExtensionArray
+    """
+
+    name = description['file']
+    kind = description['kind']
+    compressed = description.get('compressed', dict())
+
+    def load(stem):
+        return _load_array(directory, stem, compressed.get(stem))
+
+    if kind == 'numeric':
+        return load(name)
+
+    if kind == 'masked':
+        data = load(name)
+        mask = np.array(load(name + "-mask"))
+        return MASKED_ARRAYS[data.dtype.kind](data, mask)
+
+    if kind == 'string':
+        offsets = np.asarray(load(name + "-offsets"))
+        if name + "-bin" in compressed:
+            codec = compressed[name + "-bin"]['codec']
+            with open(os.path.join(directory, f"{name}-bin.{codec}"), "rb") as f:
+                blob = CODECS[codec][1](f.read())
+        else:
+            with open(os.path.join(directory, name + ".bin"), "rb") as f:
+                blob = f.read()
+        values = np.empty(len(offsets) - 1, dtype=object)
+        values[:] = [blob[start:end].decode('utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+        if description.get('nulls', False):
+            mask = np.asarray(load(name + "-mask"))
+            values[mask] = None
+        return values
+
+    raise ValueError(f'unknown column kind "{kind}"')
+
+
+##############
+# EVALUATION #
+##############
+def _frame_columns(df):
+    """list of (label, values, is_index) for all columns and index levels
+    of a DataFrame; None if the DataFrame cannot be stored columnar
+
+    """
+
+    if not df.columns.is_unique or isinstance(df.columns, MultiIndex):
+        return None
+    if not all(_is_label(c) for c in df.columns) or not _is_label(df.columns.name):
+        return None
+
+    columns = list()
+    if not isinstance(df.index, RangeIndex):
+        if not all(_is_label(n) for n in df.index.names):
+            return None
+        for level in range(df.index.nlevels):
+            columns.append((df.index.names[level], df.index.get_level_values(level).array, True))
+
+    for label in df.columns:
+        columns.append((label, df[label].array, False))
+
+    # unwrap numpy-backed pandas arrays
+    columns = [
+        (label, values.to_numpy() if type(values).__name__ == 'NumpyExtensionArray' else values, is_index)
+        for label, values, is_index in columns
+    ]
+
+    if any(_column_kind(values) is None for _, values, _ in columns):
+        return None
+
+    return columns
+
+
+def is_columnar(value):
+    """can value be stored in columnar format?
+
+    :param value: object to store
+
+    :return: whether value is a DataFrame, ndarray or set of integers
+             that can be stored without pickling
+    :rtype: bool
+    """
+
+    if isinstance(value, DataFrame):
+        return _frame_columns(value) is not None
+
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in 'biuf'
+
+    if isinstance(value, (set, frozenset)):
+        return all(isinstance(v, (int, np.integer)) and not isinstance(v, bool) for v in value)
+
+    return False
+
+
+###########
+# WRITING #
+###########
+def _write(directory, value, compression=None):
+    """write value into an existing (empty) directory"""
+
+    manifest = {'format': FORMAT, 'version': VERSION}
+
+    if isinstance(value, DataFrame):
+
+        manifest['type'] = 'DataFrame'
+        manifest['length'] = len(value)
+        manifest['columns_name'] = _label(value.columns.name)
+        if isinstance(value.index, RangeIndex):
+            manifest['range'] = [value.index.start, value.index.stop, value.index.step]
+            manifest['index_name'] = _label(value.index.name)
+
+        descriptions = list()
+        for nr, (label, values, is_index) in enumerate(_frame_columns(value)):
+            description = _write_column(directory, f"c{nr}", values, compression)
+            description['name'] = _label(label)
+            description['index'] = is_index
+            descriptions.append(description)
+        manifest['columns'] = descriptions
+
+    elif isinstance(value, np.ndarray):
+
+        manifest['type'] = 'ndarray'
+        manifest['compressed'] = _save_array(directory, "array", value, compression)
+
+    elif isinstance(value, (set, frozenset)):
+
+        manifest['type'] = 'set'
+        manifest['compressed'] = _save_array(directory, "array", np.array(sorted(value), dtype='<i8'), compression)
+
+    else:
+        raise TypeError(f'cannot store object of type "{type(value).__name__}" in columnar format')
+
+    with open(os.path.join(directory, MANIFEST), "wt") as f:
+        json.dump(manifest, f)
+
+
+def _remove_entry(path):
+    """remove file or directory (if it exists)"""
+
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def columnar_version(path):
+    """Directory of the current version of an entry (see write_columnar).
+
+    :param str path: directory of the entry
+
+    :return: directory of the current version
+    :rtype: str
+    """
+
+    try:
+        with open(os.path.join(path, POINTER), "rt") as f:
+            return os.path.join(path, f.read().strip())
+    except FileNotFoundError:
+        # entries without versions
+        if os.path.isfile(os.path.join(path, MANIFEST)):
+            return path
+        raise
+
+
+def write_columnar(path, value, compression=None):
+    """Write DataFrame, array or set of integers to directory in columnar
+    format.  The version is written to a temporary directory first,
+    moved into the entry and then made current by atomically
+    replacing the pointer, so readers never see partial or missing
+    entries.  Previous versions are removed afterwards (readers keep
+    their open maps).
+
+    :param str path: directory of the entry
+    :param value: DataFrame, ndarray or set of integers
+    :param str compression: None, 'auto', or name of codec (see CODECS)
+
+    """
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+
+    name = f"v-{uuid4().hex}"
+    tmp = os.path.join(parent, f".tmp-{uuid4().hex}")
+    os.makedirs(tmp)
+    try:
+        _write(tmp, value, compression)
+        with open(os.path.join(tmp, "." + POINTER), "wt") as f:
+            f.write(name)
+        for attempt in range(RETRIES):
+            # the entry might be removed concurrently
+            try:
+                os.makedirs(path, exist_ok=True)
+                previous = [entry for entry in os.listdir(path) if entry != POINTER and not entry.startswith(".")]
+                os.rename(tmp, os.path.join(path, name))
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            raise OSError(f'could not move entry "{path}" into place')
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    # make version current
+    try:
+        os.replace(os.path.join(path, name, "." + POINTER), os.path.join(path, POINTER))
+    except FileNotFoundError:
+        logger.info(f'entry "{path}" was removed concurrently')
+        return
+
+    # remove previous versions (and files of entries without versions),
+    # unless a concurrent writer made one of them current in the meantime
+    for entry in previous:
+        try:
+            if columnar_version(path) == os.path.join(path, entry):
+                continue
+        except FileNotFoundError:
+            return
+        _remove_entry(os.path.join(path, entry))
+
+
+###########
+# READING #
+###########
+def read_columnar(path):
+    """Read DataFrame, array or set stored by write_columnar().  Numeric
+    columns are memory-mapped (copy-on-write) unless compressed.  If
+    the version is removed while reading, the version that replaced
+    it is read.
+
+    :param str path: directory of the entry
+
+    :return: stored object
+    :rtype: DataFrame or ndarray or set
+    """
+
+    for attempt in range(RETRIES):
+        version = columnar_version(path)
+        try:
+            return _read(version)
+        except FileNotFoundError:
+            if attempt == RETRIES - 1 or columnar_version(path) == version:
+                raise
+
+
+def _read(path):
+    """read entry from directory of one version"""
+
+    with open(os.path.join(path, MANIFEST), "rt") as f:
+        manifest = json.load(f)
+
+    if manifest.get('format') != FORMAT or manifest.get('version') != VERSION:
+        raise ValueError(f'unsupported storage format in "{path}"')
+
+    if manifest['type'] == 'ndarray':
+        return _load_array(path, "array", manifest.get('compressed'))
+
+    if manifest['type'] == 'set':
+        return set(_load_array(path, "array", manifest.get('compressed')).tolist())
+
+    # DataFrame
+    data = dict()
+    index_names = list()
+    index_values = list()
+    for description in manifest['columns']:
+        values = _read_column(path, description)
+        if description['index']:
+            index_names.append(description['name'])
+            index_values.append(values)
+        else:
+            data[description['name']] = values
+
+    if 'range' in manifest:
+        index = RangeIndex(*manifest['range'], name=manifest['index_name'])
+    elif len(index_values) == 1:
+        index = Index(index_values[0], name=index_names[0])
+    else:
+        index = MultiIndex.from_arrays(index_values, names=index_names)
+
+    columns = Index(list(data.keys()), name=manifest['columns_name'], dtype=object if len(data) == 0 else None)
+    df = DataFrame(data, index=index, columns=columns, copy=False)
+
+    return df
+
+
+def remove_columnar(path):
+    """Remove entry (if it exists).
+
+    :param str path: directory of the entry
+
+    """
+
+    if os.path.isdir(path):
+        trash = os.path.join(os.path.dirname(os.path.abspath(path)), f".del-{uuid4().hex}")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+
+############
+# PICKLING #
+############
+def write_pickle(path, value, compression=None):
+    """Pickle object to file.  The object is written to a temporary
+    file first and then atomically renamed.  Compressed pickles start
+    with PICKLE_MAGIC and the name of the codec.
+
+    :param str path: path of the file
+    :param value: object to pickle
+    :param str compression: None, 'auto', or name of codec (see CODECS)
+
+    """
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+
+    tmp = os.path.join(parent, f".tmp-{uuid4().hex}")
+    try:
+        with open(tmp, "wb") as f:
+            if compression is None:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            else:
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                codec = choose_codec(data, compression)
+                if codec is None:
+                    f.write(data)
+                else:
+                    f.write(PICKLE_MAGIC + codec.encode() + b"\n")
+                    f.write(CODECS[codec][0](data))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def read_pickle(path):
+    """Unpickle object from file.
+
+    :param str path: path of the file
+
+    :return: stored object
+    """
+
+    with open(path, "rb") as f:
+        if f.read(len(PICKLE_MAGIC)) != PICKLE_MAGIC:
+            f.seek(0)
+            return pickle.load(f)
+        codec = f.readline().decode().strip()
+        return pickle.loads(CODECS[codec][1](f.read()))
+
+
+def remove_pickle(path):
+    """Remove file (if it exists).
+
+    :param str path: path of the file
+
+    """
+
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
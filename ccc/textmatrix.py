@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""textmatrix.py
+
+persistent sparse frequency matrix of the regions of an s-attribute
+(e.g. texts) × the types of a p-attribute (combination), in CSR
+layout:
+
+- indptr.npy: row pointers (one row per region)
+- indices.npy: packed keys of types (see counts.pack_ids), sorted per row
+- data.npy: frequencies of the types in the regions
+- starts.npy, ends.npy: boundaries of the regions
+- meta.json: s-attribute, p-attributes, lexicon sizes, number of regions
+
+the matrix is built once (e.g. by ccc-warmup --matrix) and
+memory-mapped afterwards.  marginals of unions of regions are sums of
+rows; tokens of intervals that do not cover complete regions are
+counted exactly on lexicon ids.  the matrix lives in the cache
+directory of the corpus and is thus invalidated with the cache when
+the corpus changes; it is evicted like cache entries when it has not
+been used (see DataDirectory.collect).
+
+"""
+import json
+import logging
+import os
+import shutil
+from math import prod
+
+# requirements
+import numpy as np
+
+# part of module
+from .counts import intervals2cpos, pack_ids, unpack_keys, valid_intervals
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 2 ** 22
+
+
+def text_matrices(directory, counts, p_atts=['word']):
+    """Built matrices of a p-attribute (combination) for all s-attributes.
+
+    :param str directory: /path/to/cache/directory/
+    :param Counts counts: counts of the corpus (attribute handles)
+    :param list p_atts: p-attribute (combination)
+
+    :return: matrices
+    :rtype: list of TextMatrix
+    """
+
+    try:
+        s_atts = sorted(os.listdir(os.path.join(directory, "textmatrix")))
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+    matrices = [TextMatrix(directory, counts, s_att, p_atts) for s_att in s_atts]
+
+    return [matrix for matrix in matrices if matrix.exists()]
+
+
+class TextMatrix:
+    """Memory-mapped sparse frequency matrix of regions of an
+    s-attribute × types of a p-attribute (combination).
+
+    """
+
+    def __init__(self, directory, counts, s_att='text', p_atts=['word']):
+        """
+        :param str directory: /path/to/cache/directory/
+        :param Counts counts: counts of the corpus (attribute handles)
+        :param str s_att: s-attribute (regions = rows)
+        :param list p_atts: p-attribute (combination) (types = columns)
+        """
+
+        self.path = os.path.join(directory, "textmatrix", s_att, "-".join(p_atts))
+        self.counts = counts
+        self.s_att = s_att
+        self.p_atts = p_atts
+        self._arrays = None
+
+    def __str__(self):
+
+        return f'text matrix of "{self.s_att}" × "{" ".join(self.p_atts)}" in "{self.path}"'
+
+    def exists(self):
+        """Is the matrix built (for the current lexicon sizes)?
+
+        :rtype: bool
+        """
+
+        try:
+            with open(os.path.join(self.path, "meta.json"), "rt") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        return meta['sizes'] == self.counts.sizes(self.p_atts)
+
+    def remove(self):
+        """Remove the matrix."""
+
+        self._arrays = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def build(self, chunk_size=CHUNK_SIZE):
+        """Count all types of the p-attribute (combination) in each region
+        of the s-attribute (in chunks of regions) and write the matrix
+        (atomically).
+
+        :param int chunk_size: (approximate) number of corpus positions per chunk
+        """
+
+        sizes = self.counts.sizes(self.p_atts)
+        att = self.counts.attributes.attribute(self.s_att, 's')
+        regions = np.array([att[struc][:2] for struc in range(len(att))], dtype=np.int64).reshape(-1, 2)
+        starts, ends = regions[:, 0], regions[:, 1]
+        lengths = ends - starts + 1
+        logger.info(f'building {str(self)}')
+
+        # chunks of complete regions
+        cuts = np.searchsorted(np.cumsum(lengths), np.arange(chunk_size, lengths.sum(), chunk_size))
+        bounds = np.unique(np.concatenate([[0], cuts + 1, [len(lengths)]]).clip(max=len(lengths)))
+
+        rows, indices, data = list(), list(), list()
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            keys = pack_ids(self.counts._ids(intervals2cpos(starts[first: last], ends[first: last]), self.p_atts), sizes)
+            row = np.repeat(np.arange(first, last, dtype=np.int64), lengths[first: last])
+
+            # distinct (row, key) pairs
+            order = np.lexsort((keys, row))
+            row, keys = row[order], keys[order]
+            new = np.ones(len(keys), dtype=bool)
+            new[1:] = (row[1:] != row[:-1]) | (keys[1:] != keys[:-1])
+            positions = np.flatnonzero(new)
+            rows.append(row[positions])
+            indices.append(keys[positions])
+            data.append(np.diff(np.append(positions, len(keys))))
+
+        rows = np.concatenate(rows) if rows else np.array([], dtype=np.int64)
+        indptr = np.zeros(len(starts) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(rows, minlength=len(starts)))
+        index_dtype = np.int32 if prod(sizes) < 2 ** 31 else np.int64
+        indices = np.concatenate(indices).astype(index_dtype) if indices else np.array([], dtype=index_dtype)
+        data = np.concatenate(data).astype(np.int32) if data else np.array([], dtype=np.int32)
+
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        for name, array in [('indptr', indptr), ('indices', indices), ('data', data), ('starts', starts), ('ends', ends)]:
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        with open(os.path.join(tmp, "meta.json"), "wt") as f:
+            json.dump({'s_att': self.s_att, 'p_atts': self.p_atts, 'sizes': sizes, 'regions': len(starts)}, f)
+
+        self.remove()
+        try:
+            os.replace(tmp, self.path)
+        except OSError:
+            # concurrently built by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        logger.info(f'built {str(self)}: {len(starts)} regions, {len(indices)} non-zero entries')
+
+    @property
+    def arrays(self):
+        """memory-mapped indptr, indices, data, starts, ends"""
+
+        if self._arrays is None:
+            self._arrays = tuple(
+                np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r')
+                for name in ['indptr', 'indices', 'data', 'starts', 'ends']
+            )
+            # mark as used (see DataDirectory.collect)
+            os.utime(self.path)
+        return self._arrays
+
+    def split(self, starts, ends):
+        """Split intervals into complete regions and remaining intervals.
+
+        :param starts: start positions of intervals
+        :param ends: end positions of intervals (inclusive)
+
+        :return: rows (regions completely covered, with duplicates),
+                 starts and ends of remaining intervals
+        :rtype: tuple(ndarray, ndarray, ndarray)
+        """
+
+        starts, ends = valid_intervals(starts, ends)
+        _, _, _, region_starts, region_ends = self.arrays
+
+        # first region starting in and last region ending in interval
+        first = np.searchsorted(region_starts, starts, side='left')
+        last = np.searchsorted(region_ends, ends, side='right') - 1
+        complete = first <= last
+
+        # rows of complete regions
+        rows = intervals2cpos(first[complete], last[complete]).astype(np.int64)
+
+        # remainders left and right of complete regions, or whole interval
+        region_starts, region_ends = np.asarray(region_starts), np.asarray(region_ends)
+        first_start = region_starts[first[complete]]
+        last_end = region_ends[last[complete]]
+
+        # gaps between consecutive complete regions (s-attributes need not tile the corpus)
+        before = intervals2cpos(first[complete], last[complete] - 1).astype(np.int64)
+        gap_starts = region_ends[before] + 1
+        gap_ends = region_starts[before + 1] - 1
+
+        rest_starts = np.concatenate([starts[~complete], starts[complete], last_end + 1, gap_starts])
+        rest_ends = np.concatenate([ends[~complete], first_start - 1, ends[complete], gap_ends])
+
+        return (rows, ) + valid_intervals(rest_starts, rest_ends)
+
+    def intervals(self, starts, ends, items=True):
+        """Count the p-attribute (combination) in intervals: complete
+        regions are summed up from the matrix, remaining tokens are
+        counted on lexicon ids.
+
+        :param starts: start positions of intervals
+        :param ends: end positions of intervals (inclusive)
+        :param bool items: index by item? (else: by packed key, see pack_ids)
+
+        :return: counts of the p-attribute (combination) in the intervals
+        :rtype: FreqFrame
+        """
+
+        indptr, indices, data, _, _ = self.arrays
+        sizes = self.counts.sizes(self.p_atts)
+        rows, rest_starts, rest_ends = self.split(starts, ends)
+        logger.info(f'{len(rows)} complete regions, {int((rest_ends - rest_starts + 1).sum())} remaining tokens')
+
+        # rows of complete regions and remaining tokens (frequency 1)
+        positions = intervals2cpos(np.asarray(indptr)[rows], np.asarray(indptr)[rows + 1] - 1)
+        cpos = intervals2cpos(rest_starts, rest_ends)
+        keys = np.concatenate([
+            np.asarray(indices)[positions].astype(np.int64),
+            pack_ids(self.counts._ids(cpos, self.p_atts), sizes)
+        ])
+        weights = np.concatenate([
+            np.asarray(data)[positions].astype(np.int64),
+            np.ones(len(cpos), dtype=np.int64)
+        ])
+
+        keys, inverse = np.unique(keys, return_inverse=True)
+        freqs = np.bincount(inverse.ravel(), weights=weights, minlength=len(keys)).astype(np.int64)
+
+        return self.counts._decode(keys, unpack_keys(keys, sizes), freqs, self.p_atts, items)
@@ -8,14 +8,14 @@ various utilities for the module
 import logging
 import pkgutil
 import re
-from functools import wraps
+import unicodedata
+from functools import lru_cache, wraps
 from timeit import default_timer
 from trieregex import TrieRegEx as TRE
 
 # requirements
 import numpy as np
 from pandas import NA, DataFrame
-from unidecode import unidecode
 
 logger = logging.getLogger(__name__)
 
@@ -397,6 +397,30 @@ def merge_s_atts(s_query, s_break, s_meta):
 ##################
 # p-att handling #
 ##################
+@lru_cache(maxsize=2**20)
+def fold_string(string, flags="%cd"):
+    """Fold string like CQP: %c lower-cases, %d removes diacritics
+    (combining marks after canonical decomposition).
+
+    :param str string: string to fold
+    :param str flags: %c, %d, %cd
+
+    :return: folded string
+    :rtype: str
+    """
+
+    if "c" in flags:
+        string = string.lower()
+
+    if "d" in flags:
+        string = "".join(
+            c for c in unicodedata.normalize("NFD", string) if not unicodedata.combining(c)
+        )
+        string = unicodedata.normalize("NFC", string)
+
+    return string
+
+
 def fold_item(item, flags="%cd"):
 
     if flags is None:
@@ -406,14 +430,7 @@ def fold_item(item, flags="%cd"):
     isstr = isinstance(item, str)
     item = (item, ) if isstr else item
 
-    if "c" in flags:
-        # lower-case
-        item = [i.lower() for i in item]
-
-    if "d" in flags:
-        # TODO align with CWB
-        # remove diacritica
-        item = [unidecode(i) for i in item]
+    item = [fold_string(i, flags) for i in item]
 
     item = item[0] if isstr else tuple(item)
 
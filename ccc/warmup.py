@@ -0,0 +1,277 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+"""warmup.py
+
+precompute and cache expensive per-corpus artifacts:
+
+- marginals of p-attributes and p-attribute combinations (lexicon
+  frequencies, Counts.scan; combinations also indexed by packed keys)
+- spans of s-attributes (dump_from_s_att)
+- persistent marginals indexes of p-attributes and p-attribute
+  combinations (see marginals.py; optional)
+- persistent frequency matrices of regions of s-attributes × types of
+  p-attribute combinations (see textmatrix.py; optional)
+
+each artifact is one task; tasks are run in parallel worker
+processes.  tasks whose artifact is already cached are skipped, so
+warming up is idempotent and can be resumed after an interruption.
+
+command line usage: ccc-warmup CORPUS -p word lemma,pos -s s text [--index] [--matrix]
+
+"""
+import argparse
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from timeit import default_timer
+
+# requirements
+from pandas import DataFrame
+
+# part of module
+from .cwb import Corpus
+
+logger = logging.getLogger(__name__)
+
+
+#########
+# TASKS #
+#########
+def _marginals_identifiers(p_atts):
+    # combinations: also marginals indexed by packed keys (see Corpus._marginals_coded)
+    identifiers = ["-".join(p_atts) + "-marginals"]
+    if len(p_atts) > 1:
+        identifiers.append("-".join(p_atts) + "-coded-marginals")
+    return identifiers
+
+
+def _marginals(corpus, p_atts):
+    corpus._marginals_complex(None, p_atts=p_atts)
+    if len(p_atts) > 1:
+        corpus._marginals_scan_coded(p_atts)
+
+
+def _spans_identifiers(s_att):
+    return [s_att + "-spans"]
+
+
+def _spans(corpus, s_att):
+    corpus.dump_from_s_att(s_att)
+
+
+def _index_exists(corpus, p_atts):
+    return corpus.marginals_index(p_atts).exists()
+
+
+def _index_remove(corpus, p_atts):
+    corpus.marginals_index(p_atts).remove()
+
+
+def _index(corpus, p_atts):
+    corpus.marginals_index(p_atts).build()
+
+
+def _matrix_exists(corpus, target):
+    return corpus.text_matrix(*target).exists()
+
+
+def _matrix_remove(corpus, target):
+    corpus.text_matrix(*target).remove()
+
+
+def _matrix(corpus, target):
+    corpus.text_matrix(*target).build()
+
+
+def _cached(identifiers, compute):
+    """task whose artifacts are cache entries"""
+
+    def exists(corpus, target):
+        return all(corpus.cache.exists(identifier) for identifier in identifiers(target))
+
+    def remove(corpus, target):
+        for identifier in identifiers(target):
+            corpus.cache.delete(identifier)
+
+    return exists, compute, remove
+
+
+# task name → (is artifact available?, computation, removal)
+TASKS = {
+    'marginals': _cached(_marginals_identifiers, _marginals),
+    'spans': _cached(_spans_identifiers, _spans),
+    'index': (_index_exists, _index, _index_remove),
+    'matrix': (_matrix_exists, _matrix, _matrix_remove)
+}
+
+
+def warmup_tasks(p_atts=[['word']], s_atts=[], index=False, matrix=False):
+    """list of tasks for p-attribute combinations and s-attributes;
+    marginals of single p-attributes are included for all
+    combinations.
+
+    :param list p_atts: p-attribute combinations (or single p-attributes)
+    :param list s_atts: s-attributes
+    :param bool index: build persistent marginals indexes?
+    :param bool matrix: build text matrices of s-attributes × p-attribute combinations?
+
+    :return: tasks (task name, target)
+    :rtype: list of tuples
+    """
+
+    combinations = [[p] if isinstance(p, str) else list(p) for p in p_atts]
+    singles = [[p] for combination in combinations for p in combination]
+
+    tasks = list()
+    for combination in singles + combinations:
+        if ('marginals', combination) not in tasks:
+            tasks.append(('marginals', combination))
+    for s_att in s_atts:
+        if ('spans', s_att) not in tasks:
+            tasks.append(('spans', s_att))
+    if index:
+        for combination in singles + combinations:
+            if ('index', combination) not in tasks:
+                tasks.append(('index', combination))
+    if matrix:
+        for s_att in s_atts:
+            for combination in combinations:
+                if ('matrix', (s_att, combination)) not in tasks:
+                    tasks.append(('matrix', (s_att, combination)))
+
+    return tasks
+
+
+def _target_name(target):
+    """p-attribute combination, s-attribute, or s-attribute × p-attribute combination"""
+
+    if isinstance(target, str):
+        return target
+    if isinstance(target, tuple):
+        return f"{target[0]}: {' '.join(target[1])}"
+    return " ".join(target)
+
+
+def run_task(corpus_settings, task, target, force=False):
+    """Run one task (in a worker process).
+
+    :param dict corpus_settings: parameters for initializing the Corpus
+    :param str task: name of task (see TASKS)
+    :param target: p-attribute combination, s-attribute, or tuple of both
+    :param bool force: recompute even if artifact is cached?
+
+    :return: task, target, status ('cached', 'computed', 'failed'), seconds
+    :rtype: dict
+    """
+
+    start = default_timer()
+    exists, compute, remove = TASKS[task]
+    status = 'computed'
+
+    try:
+        corpus = Corpus(**corpus_settings)
+        if force:
+            remove(corpus, target)
+        if exists(corpus, target):
+            status = 'cached'
+        else:
+            compute(corpus, target)
+    except Exception as e:
+        logger.error(f'task "{task}" failed for "{_target_name(target)}": {e}')
+        status = 'failed'
+
+    return {
+        'task': task,
+        'target': _target_name(target),
+        'status': status,
+        'seconds': default_timer() - start
+    }
+
+
+def warmup(corpus_name, p_atts=[['word']], s_atts=[], lib_dir=None,
+           cqp_bin='cqp', registry_dir='/usr/local/share/cwb/registry/',
+           data_dir=None, processes=1, force=False, index=False, matrix=False):
+    """Precompute and cache marginals of p-attribute combinations and
+    spans of s-attributes, optionally build persistent marginals
+    indexes and text matrices.  Cached artifacts are skipped (unless
+    force is True).
+
+    :param str corpus_name: name of corpus in CWB registry
+    :param list p_atts: p-attribute combinations (or single p-attributes)
+    :param list s_atts: s-attributes
+    :param str lib_dir: /path/to/macros/and/wordlists/
+    :param str cqp_bin: /path/to/cqp-binary
+    :param str registry_dir: /path/to/cwb/registry/
+    :param str data_dir: /path/to/data/and/cache/
+    :param int processes: number of worker processes
+    :param bool force: recompute all artifacts?
+    :param bool index: build persistent marginals indexes?
+    :param bool matrix: build text matrices of s-attributes × p-attribute combinations?
+
+    :return: report with status and seconds per task
+    :rtype: DataFrame
+    """
+
+    corpus_settings = {
+        'corpus_name': corpus_name,
+        'lib_dir': lib_dir,
+        'cqp_bin': cqp_bin,
+        'registry_dir': registry_dir,
+        'data_dir': data_dir
+    }
+    tasks = warmup_tasks(p_atts, s_atts, index, matrix)
+    logger.info(f'warming up {len(tasks)} artifacts of corpus "{corpus_name}" with {processes} process(es)')
+
+    start = default_timer()
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(run_task, corpus_settings, task, target, force) for task, target in tasks]
+            records = [future.result() for future in futures]
+    else:
+        records = [run_task(corpus_settings, task, target, force) for task, target in tasks]
+
+    report = DataFrame(records, columns=['task', 'target', 'status', 'seconds'])
+    logger.info(f'warm-up took {round(default_timer() - start, 2)} seconds')
+
+    return report
+
+
+#######
+# CLI #
+#######
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="precompute and cache marginals and spans of a CWB corpus")
+    parser.add_argument('corpus_name', help="name of corpus in CWB registry")
+    parser.add_argument('-p', '--p_atts', nargs='+', default=['word'],
+                        help="p-attributes or comma-separated combinations of p-attributes (e.g. word lemma,pos)")
+    parser.add_argument('-s', '--s_atts', nargs='*', default=[], help="s-attributes")
+    parser.add_argument('-r', '--registry_dir', default='/usr/local/share/cwb/registry/', help="/path/to/cwb/registry/")
+    parser.add_argument('-d', '--data_dir', default=None, help="/path/to/data/and/cache/")
+    parser.add_argument('-l', '--lib_dir', default=None, help="/path/to/macros/and/wordlists/")
+    parser.add_argument('--cqp_bin', default='cqp', help="/path/to/cqp-binary")
+    parser.add_argument('-j', '--processes', type=int, default=1, help="number of worker processes")
+    parser.add_argument('-f', '--force', action='store_true', help="recompute cached artifacts")
+    parser.add_argument('-i', '--index', action='store_true', help="build persistent marginals indexes")
+    parser.add_argument('-m', '--matrix', action='store_true', help="build text matrices of s-attributes × p-attributes")
+    args = parser.parse_args(argv)
+
+    report = warmup(
+        args.corpus_name,
+        p_atts=[p.split(",") for p in args.p_atts],
+        s_atts=args.s_atts,
+        lib_dir=args.lib_dir,
+        cqp_bin=args.cqp_bin,
+        registry_dir=args.registry_dir,
+        data_dir=args.data_dir,
+        processes=args.processes,
+        force=args.force,
+        index=args.index,
+        matrix=args.matrix
+    )
+    print(report.to_string(index=False))
+
+    return 0 if (report['status'] != 'failed').all() else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -96,6 +96,11 @@ setup(
         'ccc'
     ],
     ext_modules=extensions,
+    entry_points={
+        'console_scripts': [
+            'ccc-warmup=ccc.warmup:main'
+        ]
+    },
     python_requires='>=3.8.0',
     install_requires=install_requires,
     classifiers=[
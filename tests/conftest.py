@@ -3,6 +3,8 @@ import os
 import pytest
 from pandas import read_csv
 
+from ccc.counts import read_freq_list
+
 DIR_PATH = os.path.dirname(os.path.realpath(__file__))
 DATA_PATH = os.path.join(DIR_PATH, 'data-dir')
 
@@ -153,3 +155,18 @@ def empirist():
     return {
         'freq_list': freq_list
     }
+
+
+@pytest.fixture
+def keyword_counts(germaparl, empirist):
+    """ counts of germaparl (f1, N1) and empirist (f2, N2) lemmas """
+
+    df1, R1 = read_freq_list(germaparl['freq_list'])
+    df2, R2 = read_freq_list(empirist['freq_list'])
+    df = df1[['freq']].rename(columns={'freq': 'f1'}).join(
+        df2[['freq']].rename(columns={'freq': 'f2'})
+    )
+    df['N1'] = R1
+    df['N2'] = R2
+
+    return df.fillna(0)
@@ -1,6 +1,6 @@
 from ccc import Corpus
-from ccc.utils import (filter_df, fold_item, intersect_intervals,
-                       merge_intervals, preprocess_query)
+from ccc.utils import (filter_df, fold_item, fold_string,
+                       intersect_intervals, merge_intervals, preprocess_query)
 
 from .conftest import DATA_PATH
 
@@ -68,6 +68,16 @@ def test_fold_items():
     assert len(set([fold_item(item) for item in items_francais])) == 1
 
 
+def test_fold_string():
+    assert fold_string('ÄBER', '%c') == 'äber'
+    assert fold_string('ÄBER', '%d') == 'ABER'
+    assert fold_string('ÄBER', '%cd') == 'aber'
+    # combining marks (decomposed input)
+    assert fold_string('Fra\u0301ncais', '%d') == 'Francais'
+    # no transliteration (like CQP)
+    assert fold_string('Straße', '%cd') == 'straße'
+
+
 def test_filter_df(germaparl):
     c = Corpus(germaparl['corpus_name'], registry_dir=germaparl['registry_dir'], data_dir=DATA_PATH)
     subcorpus = c.query(germaparl['query'])
@@ -1,9 +1,18 @@
+import json
 import os
+from multiprocessing import Pool
 from random import randint
+from threading import Thread
+from time import sleep
 
-from pandas import DataFrame
+import pytest
+from numpy import arange, repeat
+from pandas import DataFrame, array
 
-from ccc.cache import Cache, generate_idx, generate_library_idx
+from ccc.cache import (SCHEMA, Cache, artifact_type, generate_idx,
+                       generate_library_idx, hash_object)
+from ccc.datadir import DataDirectory, corpus_fingerprint
+from ccc.storage import choose_codec
 
 from .conftest import DATA_PATH
 
@@ -37,3 +46,394 @@ def test_set_get():
 
 def test_generate_library_idx(germaparl):
     assert isinstance(generate_library_idx(germaparl['lib_dir']), str)
+
+
+def test_columnar_roundtrip():
+
+    cache = Cache(os.path.join(DATA_PATH, 'test-cache'))
+    df = DataFrame({
+        'match': [1, 5, 9],
+        'matchend': [2, 5, 12],
+        0: [1, -1, 3],
+        'text_id': ['A44', None, 'Über'],
+        'contextid': array([1, None, 3], dtype="Int64")
+    }).set_index(['match', 'matchend'])
+    cache.set('test-columnar', df)
+    path_columnar, path_pickle = cache._paths('test-columnar')
+    assert os.path.isdir(path_columnar)
+    assert not os.path.exists(path_pickle)
+    r = cache.get('test-columnar')
+    assert r.equals(df)
+    assert list(r.columns) == [0, 'text_id', 'contextid']
+
+    # copy-on-write: changes are not written back
+    r.iloc[0, 0] = 42
+    assert cache.get('test-columnar').iloc[0, 0] == 1
+
+
+def test_columnar_set_array():
+
+    cache = Cache(os.path.join(DATA_PATH, 'test-cache'))
+    cache.set('test-set', {3, 1, 2})
+    assert cache.get('test-set') == {1, 2, 3}
+    cache.set('test-array', arange(10))
+    assert (cache.get('test-array') == arange(10)).all()
+
+    # objects that cannot be stored columnar are pickled
+    cache.set('test-set', {'a', 'b'})
+    assert cache.get('test-set') == {'a', 'b'}
+    path_columnar, path_pickle = cache._paths('test-set')
+    assert not os.path.isdir(path_columnar)
+    assert os.path.isfile(path_pickle)
+
+
+def test_columnar_replace(tmp_path):
+
+    cache = Cache(str(tmp_path / 'CACHE'))
+    cache.set('test-replace', DataFrame({'a': [0] * 100}))
+    path_columnar, _ = cache._paths('test-replace')
+
+    # readers never see a missing entry while it is replaced
+    def replace():
+        for i in range(1, 200):
+            cache.set('test-replace', DataFrame({'a': [i] * 100}))
+
+    writer = Thread(target=replace)
+    writer.start()
+    misses = 0
+    while writer.is_alive():
+        r = cache.get('test-replace')
+        if r is None:
+            misses += 1
+        else:
+            assert len(r) == 100 and r['a'].nunique() == 1
+    writer.join()
+    assert misses == 0
+    assert cache.get('test-replace')['a'].iloc[0] == 199
+
+    # previous versions are removed
+    assert len([name for name in os.listdir(path_columnar) if name.startswith('v-')]) == 1
+
+
+def cooc_like(n):
+    """DataFrame similar to df_cooc: sorted positions and repeated offsets"""
+    return DataFrame({
+        'match': repeat(arange(0, n, 20), 20)[:n],
+        'cpos': arange(n),
+        'offset': (arange(n) % 20 - 10),
+        'item': ['Seehofer' if i % 3 else None for i in range(n)]
+    }).set_index('match')
+
+
+@pytest.mark.parametrize("compression", ['zlib', 'bz2', 'lzma', 'auto'])
+def test_compression_roundtrip(compression):
+
+    cache = Cache(os.path.join(DATA_PATH, 'test-cache-compression'), compression=compression)
+    df = cooc_like(100000)
+    df['freq'] = array(list(range(99999)) + [None], dtype="Int64")
+    cache.set('test-compressed', df)
+    assert cache.get('test-compressed').equals(df)
+
+    a = arange(-50000, 50000, dtype='int32')
+    cache.set('test-compressed-array', a)
+    r = cache.get('test-compressed-array')
+    assert r.dtype == a.dtype and (r == a).all()
+
+    cache.set('test-compressed-set', set(range(100000)))
+    assert cache.get('test-compressed-set') == set(range(100000))
+
+    cache.set('test-compressed-pickle', {'cpos': list(range(100000))})
+    assert cache.get('test-compressed-pickle') == {'cpos': list(range(100000))}
+
+
+def test_compression_size():
+
+    df = cooc_like(100000)
+    sizes = dict()
+    for compression in [None, 'zlib']:
+        cache = Cache(os.path.join(DATA_PATH, 'test-cache-compression'), compression=compression)
+        cache.stats.reset()
+        cache.set('test-size', df)
+        sizes[compression] = cache.stats.to_frame().loc['size', 'bytes_written']
+    assert sizes['zlib'] * 10 < sizes[None]
+
+    # small and incompressible data is not compressed
+    assert choose_codec(b"x" * 100) is None
+    assert choose_codec(os.urandom(2 ** 17)) is None
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("compression", [None, 'zlib', 'auto'])
+def test_perf_cache_compression(benchmark, compression):
+
+    cache = Cache(os.path.join(DATA_PATH, 'test-cache-compression'), compression=compression)
+    cache.stats.reset()
+    cache.set('perf-compression', cooc_like(2000000))
+    benchmark.extra_info['bytes'] = int(cache.stats.to_frame().loc['compression', 'bytes_written'])
+
+    # load and touch all values
+    benchmark.pedantic(lambda: cache.get('perf-compression')[['cpos', 'offset']].sum(), rounds=5, iterations=1)
+
+
+def test_generate_idx_content():
+
+    df1 = DataFrame({'match': range(1000), 'matchend': range(1000)})
+    df2 = df1.copy()
+    df2.loc[500, 'matchend'] = 0
+
+    # same preview, different content
+    assert str(df1) == str(df2)
+    assert generate_idx([df1]) != generate_idx([df2])
+    assert generate_idx([df1]) == generate_idx([df1.copy()])
+
+    # sets are identified independently of order
+    assert generate_idx([{3, 1, 2}]) == generate_idx([{1, 2, 3}])
+    assert isinstance(hash_object(df1.set_index(['match', 'matchend']).index), str)
+
+
+def test_artifact_type():
+
+    assert artifact_type("df_dump:1234567890") == "df_dump"
+    assert artifact_type("word-lemma-marginals") == "marginals"
+    assert artifact_type("1234567890-df_cooc") == "df_cooc"
+    assert artifact_type("1234567890") == "other"
+
+
+def test_cache_stats(tmp_path):
+
+    path = str(tmp_path / 'test-cache-stats')
+    cache = Cache(path)
+    cache.stats.reset()
+
+    cache.get('s-spans')
+    cache.set('s-spans', DataFrame({'start': range(10), 'end': range(10)}))
+    cache.get('s-spans')
+    cache.get('s-spans')
+    cache.set('df_dump:test', {'a': 1})
+
+    # statistics are shared between caches of the same path
+    stats = Cache(path).stats.to_frame()
+    assert stats.loc['spans', 'hits'] == 2
+    assert stats.loc['spans', 'misses'] == 1
+    assert stats.loc['spans', 'hit_rate'] == 2 / 3
+    assert stats.loc['spans', 'bytes_read'] > 0
+    assert stats.loc['spans', 'bytes_written'] * 2 == stats.loc['spans', 'bytes_read']
+    assert stats.loc['df_dump', 'sets'] == 1
+    assert cache.stats.histogram('spans', 'get').sum() == 3
+
+    # periodic dump
+    if os.path.exists(path + ".stats.jsonl"):
+        os.remove(path + ".stats.jsonl")
+    cache = Cache(path, stats_interval=0)
+    cache.get('s-spans')
+    with open(path + ".stats.jsonl", "rt") as f:
+        record = json.loads(f.readlines()[-1])
+    assert record['counters']['spans']['hits'] == 3
+    cache.stats.interval = None
+
+
+def test_cache_stats_strategies(tmp_path):
+
+    cache = Cache(str(tmp_path / 'test-cache-strategies'))
+    cache.stats.record_strategy('dump-2-split')
+    cache.stats.record_strategy('dump-2-split', 2., 1.)
+    cache.stats.record_strategy('dump-2-split', 4., 3.)
+    cache.stats.record_strategy('matches-1', 1.)
+
+    df = cache.stats.strategies()
+    assert df.loc['dump-2-split', 'chosen'] == 1
+    assert df.loc['dump-2-split', 'mean'] == 3.
+    assert df.loc['dump-2-split', 'estimated_mean'] == 2.
+    assert df.loc['matches-1', 'estimated_runs'] == 0
+    assert cache.stats.to_dict()['strategies']['matches-1']['runs'] == 1
+
+
+def test_data_directory():
+
+    path = os.path.join(DATA_PATH, 'test-datadir')
+    os.makedirs(path, exist_ok=True)
+    directory = DataDirectory(path, 'TEST')
+    directory.collect(max_size=0)
+
+    # NQRs saved by CQP and cache entries
+    for nr, name in enumerate(['Query1', 'Query2', 'df_3']):
+        with open(directory.nqr_path(name), "wb") as f:
+            f.write(b"0" * 100)
+        os.utime(directory.nqr_path(name), (1000 + nr, 1000 + nr))
+    Cache(os.path.join(path, "CACHE")).set('test', {'a': 1})
+
+    assert directory.has_nqr('Query1')
+    assert not directory.has_nqr('Query4')
+    assert not directory.touch('Query4')
+    entries = directory.entries()
+    assert set(entries['kind']) == {'nqr', 'cache'}
+    assert len(entries) == 4
+
+    # age: all NQRs are old, but Query1 was just used
+    directory.touch('Query1')
+    evicted = directory.collect(max_age=3600)
+    assert set(evicted['name']) == {'Query2', 'df_3'}
+    assert directory.has_nqr('Query1')
+
+    # size: policy is applied when registering new NQRs
+    with open(directory.nqr_path('Query5'), "wb") as f:
+        f.write(b"0" * 100)
+    directory.set_policy(max_size=150)
+    directory.register('Query5')
+    assert directory.has_nqr('Query5')
+    assert len(directory.entries()) == 1
+    directory.set_policy()
+
+
+def test_schema_version(monkeypatch):
+
+    cache = Cache(os.path.join(DATA_PATH, 'test-cache'), fingerprint='test')
+    cache.set('s-spans', {'a': 1})
+    cache.set('word-marginals', {'b': 2})
+
+    # increasing the schema version of one artifact invalidates only this artifact
+    monkeypatch.setitem(SCHEMA, 'spans', SCHEMA['spans'] + 1)
+    assert cache.get('s-spans') is None
+    assert cache.get('word-marginals') == {'b': 2}
+
+    # entries of other fingerprints are not visible
+    assert Cache(os.path.join(DATA_PATH, 'test-cache'), fingerprint='other').get('word-marginals') is None
+
+
+def test_corpus_fingerprint(tmp_path):
+
+    home = tmp_path / "data"
+    home.mkdir()
+    (home / "word.lexicon").write_bytes(b"abc")
+    registry = tmp_path / "registry"
+    registry.mkdir()
+    (registry / "test").write_text(f"ID test\nHOME {home}\nATTRIBUTE word\n")
+
+    fingerprint = corpus_fingerprint("TEST", str(registry))
+    assert fingerprint == corpus_fingerprint("TEST", str(registry))
+    assert corpus_fingerprint("MISSING", str(registry)) is None
+
+    # only files of declared attributes are considered
+    (home / "notes.txt").write_text("abc")
+    (home / "backup").mkdir()
+    (home / "backup" / "word.lexicon").write_bytes(b"abcde")
+    assert corpus_fingerprint("TEST", str(registry)) == fingerprint
+
+    # re-encoding changes the fingerprint
+    (home / "word.lexicon").write_bytes(b"abcd")
+    assert corpus_fingerprint("TEST", str(registry)) != fingerprint
+
+    # ... and invalidates NQRs and cache entries
+    path = str(tmp_path / "data-dir")
+    os.makedirs(path)
+    directory = DataDirectory(path, 'TEST')
+    assert directory.validate(fingerprint)
+    Cache(os.path.join(path, "CACHE"), fingerprint=fingerprint).set('s-spans', {'a': 1})
+    with open(directory.nqr_path('Query1'), "wb") as f:
+        f.write(b"0")
+    assert directory.validate(fingerprint)
+    assert len(directory.entries()) == 2
+    assert not directory.validate(corpus_fingerprint("TEST", str(registry)))
+    assert len(directory.entries()) == 0
+
+
+def _single_flight(path, key, computations):
+    """get entry from cache; compute (slowly) and count computations otherwise"""
+
+    cache = Cache(path)
+    value = cache.get(key)
+    if value is None:
+        with cache.lock(key) as waited:
+            if waited:
+                value = cache.get(key)
+            if value is None:
+                with open(computations, "at") as f:
+                    f.write("x")
+                sleep(.5)
+                value = DataFrame({'a': range(10)})
+                cache.set(key, value)
+    return len(value)
+
+
+def test_single_flight_threads():
+
+    path = os.path.join(DATA_PATH, 'test-cache-flight')
+    computations = os.path.join(DATA_PATH, 'test-cache-flight-threads')
+    Cache(path).delete('flight-threads')
+    Cache(path).stats.reset()
+    if os.path.exists(computations):
+        os.remove(computations)
+
+    threads = [Thread(target=_single_flight, args=(path, 'flight-threads', computations)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(computations, "rt") as f:
+        assert f.read() == "x"
+    stats = Cache(path).stats.to_frame()
+    assert stats.loc['threads', 'waits'] == 7
+    assert stats.loc['threads', 'wait_seconds'] > 0
+
+
+def test_single_flight_processes():
+
+    path = os.path.join(DATA_PATH, 'test-cache-flight')
+    computations = os.path.join(DATA_PATH, 'test-cache-flight-processes')
+    Cache(path).delete('flight-processes')
+    if os.path.exists(computations):
+        os.remove(computations)
+
+    with Pool(4) as pool:
+        lengths = pool.starmap(_single_flight, [(path, 'flight-processes', computations)] * 4)
+
+    assert lengths == [10] * 4
+    with open(computations, "rt") as f:
+        assert f.read() == "x"
+
+    # lock files are removed
+    assert os.listdir(os.path.join(Cache(path).directory, ".locks")) == []
+
+
+def _hammer(path, worker, rounds):
+    """write and read overlapping keys; count inconsistent reads"""
+
+    cache = Cache(path)
+    errors = 0
+    for i in range(rounds):
+        cache.set(f'stress-{i % 10}', DataFrame({'worker': [worker] * 100, 'i': range(100)}))
+        cache.set(f'stress-pickle-{i % 10}', {'worker': worker, 'i': list(range(100))})
+        r = cache.get(f'stress-{(i + 5) % 10}')
+        if r is not None and (len(r) != 100 or r['worker'].nunique() != 1):
+            errors += 1
+        r = cache.get(f'stress-pickle-{(i + 5) % 10}')
+        if r is not None and len(r['i']) != 100:
+            errors += 1
+    return errors
+
+
+def run_concurrently(path, processes, rounds):
+
+    with Pool(processes) as pool:
+        errors = pool.starmap(_hammer, [(path, worker, rounds) for worker in range(processes)])
+    return sum(errors)
+
+
+def test_concurrent_readers_writers():
+
+    assert run_concurrently(os.path.join(DATA_PATH, 'test-cache-stress'), 4, 50) == 0
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("processes", [1, 4, 16])
+def test_perf_cache_concurrent(benchmark, processes):
+
+    rounds = 200
+    benchmark.extra_info['operations'] = 4 * rounds * processes
+    errors = benchmark.pedantic(
+        run_concurrently,
+        args=(os.path.join(DATA_PATH, 'test-cache-stress'), processes, rounds),
+        rounds=3, iterations=1
+    )
+    assert errors == 0
@@ -133,6 +133,21 @@ def test_marginals_complex(germaparl):
     assert df['freq']['gehen VVFIN'] == 186
 
 
+@pytest.mark.marginals
+@pytest.mark.parametrize("p_atts,items", [
+    (['lemma'], ["Merkel", "Seehofer", "gehen"]),
+    (['lemma', 'pos'], ["gehen VVFIN", "Seehofer NE", "Merkel NE"])
+])
+def test_marginals_coded(germaparl, p_atts, items):
+    corpus = get_corpus(germaparl)
+    keys = corpus.counts.encode(items, p_atts)
+    df = corpus.marginals(keys, p_atts=p_atts, coded=True)
+    assert list(df.keys) == list(keys)
+    assert df.to_freqframe()['freq'].sort_index().equals(
+        corpus.marginals(items, p_atts=p_atts)['freq'].sort_index()
+    )
+
+
 ################################################
 # CREATING DUMPS ###############################
 ################################################
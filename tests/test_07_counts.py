@@ -1,12 +1,15 @@
 from tempfile import NamedTemporaryFile
 
+import numpy as np
 import pandas as pd
 import pytest
 
-from ccc.counts import (cwb_lexdecode, cwb_scan_corpus, read_freq_list,
-                        score_counts)
+from ccc.counts import (CodedFreqFrame, count_items, cwb_lexdecode,
+                        cwb_scan_corpus, intervals2cpos, keys2items, pack_ids,
+                        prune_counts, read_freq_list, score_counts,
+                        unpack_keys)
 from ccc.cwb import Corpus
-from ccc.utils import format_cqp_query
+from ccc.utils import fold_df, format_cqp_query
 
 from .conftest import DATA_PATH
 
@@ -34,6 +37,18 @@ def test_lexdecode_and_read(germaparl):
     assert df1.equals(df2)
 
 
+def test_read_freq_list_chunks(germaparl):
+
+    df1, R1 = read_freq_list(germaparl['freq_list'], columns=['lemma'])
+    df2, R2 = read_freq_list(germaparl['freq_list'], columns=['lemma'], chunksize=100)
+    assert R1 == R2
+    assert df1.equals(df2)
+
+    df3, R3 = read_freq_list(germaparl['freq_list'], columns=['lemma'], min_freq=0, chunksize=100)
+    assert R3 == R1
+    assert df3['freq'].sum() == R1
+
+
 @pytest.mark.cwb_counts
 def test_cwb_scan_corpus_subcorpora(germaparl):
 
@@ -89,6 +104,48 @@ def test_cwb_scan_corpus_marginal(germaparl):
     assert list(df2.columns) == ['freq', 'lemma', 'pos']
 
 
+@pytest.mark.cwb_counts
+@pytest.mark.parametrize("p_atts", [['word'], ['lemma', 'pos']])
+def test_counts_scan(germaparl, p_atts):
+
+    corpus = get_corpus(germaparl)
+    df1, R1 = cwb_scan_corpus(germaparl['corpus_name'], germaparl['registry_dir'], p_atts=p_atts, min_freq=0)
+    df2 = corpus.counts.scan(p_atts)
+    assert df1['freq'].equals(df2['freq'])
+    assert df2['freq'].sum() == R1
+
+    # sharded and parallel
+    df3 = corpus.counts.scan(p_atts, workers=4, s_att='text')
+    assert df2.equals(df3)
+
+
+def test_counts_shards(germaparl):
+
+    corpus = get_corpus(germaparl)
+    starts, ends = [0, 100, 5000], [49, 2999, 100000]
+    cpos = intervals2cpos(starts, ends)
+    for nr_shards in [1, 3, 16]:
+        for s_att in [None, 'text']:
+            shards = corpus.counts.shards(starts, ends, nr_shards, s_att)
+            assert len(shards) <= nr_shards
+            assert (np.concatenate([intervals2cpos(s, e) for s, e in shards]) == cpos).all()
+
+    # aligned with texts
+    texts = corpus.attributes.attribute('text', 's')
+    for s, e in corpus.counts.shards(nr_shards=4, s_att='text')[1:]:
+        assert texts[texts.cpos2struc(int(s[0]))][0] == s[0]
+
+
+@pytest.mark.benchmark
+@pytest.mark.cwb_counts
+@pytest.mark.parametrize("workers", [1, 2, 4, 8, 16])
+def test_perf_counts_scan(germaparl, benchmark, workers):
+
+    corpus = get_corpus(germaparl)
+    benchmark.pedantic(corpus.counts.scan, args=(['lemma', 'pos'], ), kwargs=dict(workers=workers),
+                       rounds=3, iterations=1)
+
+
 @pytest.mark.marginals
 @pytest.mark.cwb_counts
 def test_marginals(germaparl):
@@ -136,6 +193,102 @@ def test_count_cpos_combo(germaparl):
     assert list(freqframe.columns) == ['freq'] + ['lemma', 'pos']
 
 
+@pytest.mark.cwb_counts
+def test_count_cpos_array(germaparl):
+    corpus = get_corpus(germaparl)
+    cpos = list(range(1, 1000)) + list(range(500, 600)) + [-1]
+    items = [corpus.counts._cpos2patts(p, ['lemma', 'pos']) for p in cpos if p != -1]
+    freqframe = corpus.counts.cpos(np.array(cpos), p_atts=['lemma', 'pos'])
+    assert freqframe.equals(count_items(items, ['lemma', 'pos']))
+    assert corpus.counts.cpos(set(cpos), p_atts=['lemma', 'pos']).equals(
+        corpus.counts.cpos(sorted(set(cpos)), p_atts=['lemma', 'pos'])
+    )
+
+
+def test_pack_ids():
+
+    ids = [np.array([0, 4, 2]), np.array([6, 0, 3]), np.array([1, 1, 0])]
+    keys = pack_ids(ids, [5, 7, 2])
+    assert keys.dtype == 'int64'
+    assert len(set(keys)) == 3
+    assert all((a == b).all() for a, b in zip(unpack_keys(keys, [5, 7, 2]), ids))
+    with pytest.raises(ValueError):
+        pack_ids(ids, [2 ** 32, 2 ** 32])
+
+
+@pytest.mark.cwb_counts
+def test_count_cpos_keys(germaparl):
+    corpus = get_corpus(germaparl)
+    p_atts = ['lemma', 'pos']
+    df_keys = corpus.counts.cpos(range(1, 1000), p_atts=p_atts, items=False)
+    assert df_keys.index.name == 'key'
+    assert df_keys['lemma'].dtype == 'category'
+    assert keys2items(df_keys).equals(corpus.counts.cpos(range(1, 1000), p_atts=p_atts))
+
+    # keys are consistent across frames
+    df_keys2 = corpus.counts.cpos(range(500, 2000), p_atts=p_atts, items=False)
+    common = df_keys.index.intersection(df_keys2.index)
+    assert len(common) > 0
+    for p_att in p_atts:
+        assert (df_keys.loc[common, p_att].astype(str) == df_keys2.loc[common, p_att].astype(str)).all()
+
+
+@pytest.mark.cwb_counts
+@pytest.mark.parametrize("p_atts", [['word'], ['lemma', 'pos']])
+def test_count_cpos_coded(germaparl, p_atts):
+    corpus = get_corpus(germaparl)
+    cpos = list(range(1, 10000))
+    freqframe = corpus.counts.cpos(cpos, p_atts=p_atts)
+    coded = corpus.counts.cpos(cpos, p_atts=p_atts, coded=True)
+    assert list(coded.df.columns) == ['freq']
+    assert coded.to_freqframe().equals(freqframe)
+    assert CodedFreqFrame.from_freqframe(freqframe, corpus.counts, p_atts).to_freqframe().equals(freqframe)
+
+    # integer join with corpus marginals
+    marginals = corpus.counts.scan(p_atts, coded=True)
+    df = coded.join(marginals, rsuffix='_corpus').to_freqframe()
+    assert (df['freq_corpus'] >= df['freq']).all()
+    assert marginals.reindex(coded).to_freqframe()['freq'].to_dict() == \
+        corpus.marginals(freqframe.index, p_atts=p_atts)['freq'].to_dict()
+
+
+@pytest.mark.cwb_counts
+@pytest.mark.parametrize("flags", ['%c', '%d', '%cd'])
+def test_counts_fold(germaparl, flags):
+    corpus = get_corpus(germaparl)
+    for p_atts in [['word'], ['word', 'pos']]:
+        df_keys = corpus.counts.cpos(range(0, 20000), p_atts=p_atts, items=False)
+        folded = keys2items(corpus.counts.fold(df_keys, flags))
+        reference = fold_df(keys2items(df_keys), flags)
+        assert folded['freq'].sort_index().equals(reference['freq'].sort_index())
+        assert corpus.counts.fold(df_keys, flags, p_atts, items=True).equals(reference)
+
+
+@pytest.mark.cwb_counts
+def test_counts_fold_map_cached(germaparl, tmp_path, monkeypatch):
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    fold, types = corpus.counts.fold_map('word', '%cd')
+
+    # other instances (e.g. copies of the corpus) do not rebuild the map
+    monkeypatch.setattr('ccc.counts.fold_string', None)
+    copy = get_corpus(germaparl, data_dir=str(tmp_path))
+    fold_copy, types_copy = copy.counts.fold_map('word', '%cd')
+    assert (fold_copy == fold).all()
+    assert (types_copy == types).all()
+
+    # nothing to fold without flags
+    df_keys = corpus.counts.cpos(range(0, 1000), items=False)
+    assert copy.counts.fold(df_keys, '', items=True).equals(fold_df(corpus.counts.cpos(range(0, 1000)), ''))
+
+
+@pytest.mark.benchmark
+@pytest.mark.cwb_counts
+def test_perf_count_cpos(germaparl, benchmark):
+    corpus = get_corpus(germaparl)
+    cpos = pd.Series(range(0, 100000))
+    benchmark.pedantic(corpus.counts.cpos, args=(cpos, ['lemma', 'pos']), iterations=1, rounds=3)
+
+
 @pytest.mark.marginals
 @pytest.mark.mwus
 @pytest.mark.cwb_counts
@@ -231,6 +384,47 @@ def test_count_mwus_strategies(germaparl):
     assert sum(counts1['freq']) == sum(counts2['freq'])
 
 
+@pytest.mark.mwus
+@pytest.mark.cwb_counts
+def test_count_mwus_batch(germaparl):
+
+    corpus = get_corpus(germaparl)
+    items = ["Horst Seehofer", r"( CSU )", "CSU", "WES324", "CSU"]
+    queries = [
+        format_cqp_query([item]) for item in items
+    ]
+
+    cqp = corpus.start_cqp()
+    counts1 = corpus.counts.mwus(cqp, queries, strategy=1)
+    counts4 = corpus.counts.mwus(cqp, queries, strategy=4)
+    assert counts1.equals(counts4)
+
+    counts2 = corpus.counts.mwus(cqp, queries, p_atts=['word', 'pos'], strategy=2)
+    counts4 = corpus.counts.mwus(cqp, queries, p_atts=['word', 'pos'], strategy=4)
+    cqp.__del__()
+
+    assert list(counts4.index.names) == ['query', 'item']
+    assert counts4.loc[queries[0], 'freq'].sum() == counts1.loc[queries[0], 'freq']
+    assert counts4.loc[queries[2]].equals(counts4.loc[queries[4]])
+    assert "CSU NE" in counts4.loc[queries[2]].index
+    assert set(counts4.index.get_level_values('item')) == set(counts2.index)
+
+
+@pytest.mark.benchmark
+@pytest.mark.mwus
+@pytest.mark.cwb_counts
+@pytest.mark.parametrize("strategy", [1, 4])
+def test_perf_count_mwus(germaparl, benchmark, strategy):
+
+    corpus = get_corpus(germaparl)
+    items = list(corpus.marginals(p_atts=['lemma']).index[:300])
+    queries = [format_cqp_query([item], p_query='lemma') for item in items]
+    cqp = corpus.start_cqp()
+    benchmark.pedantic(corpus.counts.mwus, args=(cqp, queries), kwargs=dict(strategy=strategy),
+                       rounds=3, iterations=1)
+    cqp.__del__()
+
+
 @pytest.mark.cwb_counts
 def test_count_items_subcorpora(germaparl):
 
@@ -297,6 +491,31 @@ def test_counts_dump_mwu_1_no_split(germaparl):
     assert "Helmut Kohl NE NE" in df.index
 
 
+@pytest.mark.cwb_counts
+def test_counts_dump_mwu_vectorized(germaparl):
+
+    corpus = get_corpus(germaparl)
+    dump = corpus.query('[pos="ART"] [pos="ADJA"]* [pos="NN"]').df.reset_index()
+
+    for p_atts in [['word'], ['lemma', 'pos']]:
+        mwus = [
+            tuple(" ".join(m) for m in zip(*[corpus.counts._cpos2patts(cpos, p_atts) for cpos in range(match, matchend + 1)]))
+            for match, matchend in zip(dump['match'], dump['matchend'])
+        ]
+        df = corpus.counts.dump(dump, p_atts=p_atts, split=False, strategy=1)
+        assert df.equals(count_items(mwus, p_atts))
+
+
+@pytest.mark.benchmark
+@pytest.mark.cwb_counts
+def test_perf_counts_dump_mwu(germaparl, benchmark):
+
+    corpus = get_corpus(germaparl)
+    dump = corpus.query('[pos="ART"] [pos="ADJA"]* [pos="NN"]').df
+    benchmark.pedantic(corpus.counts.dump, args=(dump, 'match', 'matchend', ['lemma', 'pos'], False, 1),
+                       iterations=1, rounds=5)
+
+
 @pytest.mark.cwb_counts
 def test_counts_dump_mwu_2(germaparl):
     strategy = 2
@@ -319,6 +538,86 @@ def test_counts_dump_mwu_2(germaparl):
     assert df["freq"].iloc[0] == 6
 
 
+@pytest.mark.cwb_counts
+def test_counts_dump_auto(germaparl):
+
+    corpus = get_corpus(germaparl)
+    dump = corpus.query('[pos="ART"] [pos="ADJA"]* [pos="NN"]').df
+
+    for p_atts in [['word'], ['lemma', 'pos']]:
+        for split in [False, True]:
+            df = corpus.counts.dump(dump, p_atts=p_atts, split=split)
+            assert df.equals(corpus.counts.dump(dump, p_atts=p_atts, split=split, strategy=1))
+
+
+def test_counts_strategy_stats(germaparl, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    dump = corpus.query('[pos="ART"] [pos="ADJA"]* [pos="NN"]').df
+    corpus.counts.stats.reset()
+
+    corpus.counts.dump(dump, p_atts=['lemma', 'pos'], split=True)
+    corpus.counts.dump(dump, p_atts=['lemma', 'pos'], split=True, strategy=1)
+    df = corpus.counts.stats.strategies()
+    assert df['chosen'].sum() == 1
+    assert df.loc['dump-1-split', 'runs'] >= 1
+    assert df['runs'].sum() == 2
+    assert (df.loc[df['runs'] > 0, 'estimated_mean'] >= 0).all()
+
+
+@pytest.mark.benchmark
+def test_perf_counts_calibrate_dump(germaparl, benchmark, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    dumps = [corpus.query(query).df for query in [
+        '[lemma="Kohl"]', '[pos="ART"] [pos="ADJA"]* [pos="NN"]', '[pos="NN"]'
+    ]]
+    corpus.counts.stats.reset()
+    df = benchmark.pedantic(corpus.counts.calibrate, args=(dumps, ['lemma', 'pos']), iterations=1, rounds=1)
+    assert set(df['name']) == {'dump-1-split', 'dump-1-mwu', 'dump-2-split'}
+    assert set(corpus.counts.stats.strategies().index) == set(df['name'])
+
+
+@pytest.mark.benchmark
+@pytest.mark.cwb_counts
+def test_perf_counts_calibrate(germaparl, benchmark):
+
+    corpus = get_corpus(germaparl)
+    cqp = corpus.start_cqp()
+    dumps = [corpus.query(query).df for query in [
+        '[lemma="Kohl"]', '[pos="ART"] [pos="ADJA"]* [pos="NN"]', '[pos="NN"]'
+    ]]
+    df = benchmark.pedantic(corpus.counts.calibrate, args=(dumps, ['lemma', 'pos'], cqp, 1),
+                            iterations=1, rounds=1)
+    assert set(df['name']) == set(corpus.counts.costs)
+    assert all(min(costs) >= 0 for costs in corpus.counts.costs.values())
+    cqp.__del__()
+
+
+def test_intervals2cpos():
+
+    cpos = intervals2cpos([5, 0, 3, -1, 8], [6, 0, 5, -1, 7])
+    assert cpos.dtype == 'int32'
+    assert list(cpos) == [5, 6, 0, 3, 4, 5]
+    assert len(intervals2cpos([], [])) == 0
+
+
+@pytest.mark.cwb_counts
+def test_counts_intervals(germaparl):
+
+    corpus = get_corpus(germaparl)
+    dump = corpus.query('[lemma="und"] [pos="ART"] [pos="NN"]').df
+
+    for p_atts in [['word'], ['lemma', 'pos'], ['word', 'lemma', 'pos']]:
+        df1 = corpus.counts.dump(dump, p_atts=p_atts, split=True, strategy=1)
+        df2 = corpus.counts.dump(dump, p_atts=p_atts, split=True, strategy=2)
+        assert df1.equals(df2)
+
+    df = corpus.counts.intervals([], [], p_atts=['word', 'pos'])
+    assert len(df) == 0
+    assert list(df.columns) == ['freq', 'word', 'pos']
+
+
 @pytest.mark.cwb_counts
 @pytest.mark.count_matches
 def test_counts_matches_mwu_1(germaparl):
@@ -397,6 +696,26 @@ def test_counts_matches_mwu_3(germaparl):
     cqp.__del__()
 
 
+@pytest.mark.cwb_counts
+@pytest.mark.count_matches
+def test_counts_matches_auto(germaparl):
+
+    corpus = get_corpus(germaparl)
+    cqp = corpus.start_cqp()
+    cqp.nqr_from_query('[lemma="Helmut"%cd] [lemma="Kohl"%cd]', name='Last')
+
+    df = corpus.counts.matches(cqp, 'Last', p_atts=['word'], split=False, flags="%cd")
+    assert df['freq'].to_dict() == corpus.counts.matches(cqp, 'Last', p_atts=['word'], split=False, flags="%cd", strategy=2)['freq'].to_dict()
+    assert "helmut kohl" in df.index
+
+    df = corpus.counts.matches(cqp, 'Last', p_atts=['word'], split=True)
+    assert df['freq'].to_dict() == corpus.counts.matches(cqp, 'Last', p_atts=['word'], split=True, strategy=3)['freq'].to_dict()
+
+    df = corpus.counts.matches(cqp, 'Last', p_atts=['word', 'pos'], split=True)
+    assert "Helmut NE" in df.index
+    cqp.__del__()
+
+
 @pytest.mark.cwb_counts
 def test_counts_mwus(germaparl):
     corpus = get_corpus(germaparl)
@@ -449,3 +768,55 @@ def test_score_counts(germaparl, empirist):
 
     kw = score_counts(df, cut_off=None)
     assert kw['log_likelihood']['die'] == 4087.276827
+
+
+@pytest.mark.parametrize("order", ['log_likelihood', 'conservative_log_ratio', 'dice', 'O11'])
+def test_score_counts_prune(keyword_counts, order):
+
+    df = keyword_counts
+
+    for cut_off in [0, 1, 100, 1000]:
+        kw = score_counts(df, order=order, cut_off=cut_off)
+        assert kw.equals(score_counts(df, order=order, cut_off=cut_off, prune=False))
+
+    # nothing to prune to
+    assert prune_counts(df, order=order, cut_off=0).equals(df)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("prune", [False, True])
+def test_perf_score_counts(keyword_counts, benchmark, prune):
+
+    df = keyword_counts
+    benchmark.pedantic(score_counts, args=(df, ), kwargs=dict(cut_off=100, prune=prune), rounds=5, iterations=1)
+
+
+def test_score_counts_chunks(keyword_counts):
+
+    df = keyword_counts
+
+    kw = score_counts(df, cut_off=None, chunk_size=None)
+    assert kw.equals(score_counts(df, cut_off=None, chunk_size=1000))
+    assert kw.equals(score_counts(df, cut_off=None, chunk_size=1000, workers=4))
+    assert score_counts(df, cut_off=100, chunk_size=None, prune=False).equals(
+        score_counts(df, cut_off=100, chunk_size=1000, workers=4)
+    )
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("chunk_size,workers", [(None, 1), (2**18, 1), (2**18, 4), (2**18, 8)])
+def test_perf_score_counts_chunks(benchmark, chunk_size, workers):
+
+    # 5M types with Zipfian frequencies
+    rng = np.random.default_rng(0)
+    n = 5 * 10**6
+    f1 = rng.zipf(1.6, n).clip(max=10**6)
+    df = pd.DataFrame({
+        'f1': f1,
+        'f2': (f1 * rng.uniform(0, 3, n)).astype(int)
+    }, index=pd.Index([f"type{i}" for i in range(n)], name='item'))
+    df['N1'] = df['f1'].sum()
+    df['N2'] = df['f2'].sum()
+
+    benchmark.pedantic(score_counts, args=(df, ), kwargs=dict(cut_off=None, chunk_size=chunk_size, workers=workers),
+                       rounds=1, iterations=1)
@@ -1,9 +1,12 @@
+from itertools import chain
+
 import pandas as pd
 import pytest
 
 from ccc import Corpus
-from ccc.collocates import Collocates
+from ccc.collocates import Collocates, dump2cooc
 from ccc.keywords import Keywords
+from ccc.utils import node2cotext
 
 from .conftest import DATA_PATH
 
@@ -229,6 +232,68 @@ def test_compare_counts(germaparl, ucs_counts):
     assert (counts['O11'] + counts['O12']).equals(counts['f1_ucs'] - ucs_node_cooc['f_ucs'])
 
 
+def test_collocates_cube(germaparl):
+
+    corpus = get_corpus(germaparl)
+    df_dump = corpus.query('[lemma="und"]', context=10, context_break='s').df
+    collocates = Collocates(corpus, df_dump, ['lemma', 'pos'])
+    keys, cumulative = collocates.cube()
+    assert cumulative.shape[0] == len(keys) and cumulative.shape[1] <= 11
+    assert cumulative[:, -1].sum() == len(collocates.df_cooc)
+
+    # all windows from the cube = windows counted separately
+    for window in [1, 3, 5, 10]:
+        relevant = collocates.df_cooc.loc[abs(collocates.df_cooc['offset']) <= window]
+        pd.testing.assert_frame_equal(
+            collocates.count(window),
+            corpus.counts.cpos(relevant['cpos'], ['lemma', 'pos'])
+        )
+
+
+def test_dump2cooc(germaparl):
+
+    corpus = get_corpus(germaparl)
+    df_dump = corpus.query('[lemma="und"]', context=10, context_break='s').df
+    df_cooc, f1_set = dump2cooc(df_dump)
+
+    # reference: local contexts of each match, deduplicated by smallest offset
+    df = pd.DataFrame.from_records(node2cotext(*[
+        df_dump.reset_index()[c] for c in ['match', 'matchend', 'context', 'contextend']
+    ]))
+    df_infl = pd.DataFrame({
+        'match': list(chain.from_iterable(df['match_list'].values)),
+        'cpos': list(chain.from_iterable(df['cpos_list'].values)),
+        'offset': list(chain.from_iterable(df['offset_list'].values))
+    })
+    df_infl['abs_offset'] = df_infl['offset'].abs()
+    df_defl = df_infl.sort_values(by=['abs_offset', 'cpos'], kind='stable').drop(
+        ['abs_offset'], axis=1
+    ).drop_duplicates(subset='cpos')
+
+    assert f1_set == set(df_defl.loc[df_defl['offset'] == 0]['cpos'])
+    pd.testing.assert_frame_equal(df_cooc, df_defl[df_defl['offset'] != 0])
+    assert df_cooc['offset'].abs().max() <= 10
+
+
+@pytest.mark.benchmark
+def test_perf_dump2cooc(benchmark, germaparl):
+    corpus = get_corpus(germaparl)
+    df_dump = corpus.query('[lemma="und"]', context=20, context_break='text').df
+    benchmark.pedantic(dump2cooc, args=(df_dump, ), rounds=5, iterations=2)
+
+
+@pytest.mark.benchmark
+def test_perf_collocates_windows(benchmark, germaparl):
+
+    def windows(corpus, df_dump):
+        collocates = Collocates(corpus, df_dump, 'lemma', mws=20)
+        return [collocates.count(window) for window in range(1, 21)]
+
+    corpus = get_corpus(germaparl)
+    df_dump = corpus.query('[lemma="und"]', context=20, context_break='text').df
+    benchmark.pedantic(windows, args=(corpus, df_dump), rounds=5, iterations=1)
+
+
 @pytest.mark.benchmark
 def test_perf_collocates(benchmark, germaparl):
     benchmark.pedantic(test_collo_combo, kwargs={'germaparl': germaparl}, rounds=5, iterations=2)
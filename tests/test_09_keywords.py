@@ -1,7 +1,7 @@
 import pytest
 
 from ccc import Corpus
-from ccc.counts import score_counts
+from ccc.counts import CodedFreqFrame, score_counts
 from ccc.keywords import Keywords, keywords
 
 from .conftest import DATA_PATH
@@ -90,6 +90,19 @@ def test_keywords_combo(germaparl):
     assert lines.index[0] == "und KON"
 
 
+def test_keywords_coded(germaparl):
+
+    corpus = get_corpus(germaparl)
+    df_dump = corpus.query('"und" expand to s').df
+    keywords = Keywords(corpus, df_dump, p_query=['lemma', 'pos'])
+    assert isinstance(keywords.counts, CodedFreqFrame)
+
+    # joins on packed keys = joins on items
+    items = Keywords(corpus, None, p_query=['lemma', 'pos'], counts=keywords.counts.to_freqframe())
+    for flags in [None, '%cd']:
+        assert keywords.show(cut_off=None, flags=flags).equals(items.show(cut_off=None, flags=flags))
+
+
 def test_keywords(germaparl):
 
     corpus = get_corpus(germaparl)
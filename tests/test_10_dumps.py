@@ -3,6 +3,7 @@ from pandas import DataFrame
 
 from ccc.cwb import Corpus
 from ccc.dumps import Dumps
+from ccc.utils import fold_df
 
 from .conftest import DATA_PATH
 
@@ -55,6 +56,15 @@ def test_breakdown_p_att(germaparl):
     assert breakdown.loc['gehen']['freq'] == 224
 
 
+def test_breakdown_split_flags(germaparl):
+    corpus = get_corpus(germaparl)
+    dump = corpus.query('[pos="NN"] [pos="NN"]')
+    for p_atts in [['word'], ['lemma', 'pos']]:
+        breakdown = dump.breakdown(p_atts=p_atts, flags="%cd", split=True)
+        reference = fold_df(corpus.counts.dump(dump.df, p_atts=p_atts, split=True), "%cd")
+        assert breakdown.equals(reference)
+
+
 def test_breakdown_anchor(germaparl):
     corpus = get_corpus(germaparl)
     restricted = corpus.query('[pos="APPR"]@1[pos="ADJA"][pos="NN"]')
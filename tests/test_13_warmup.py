@@ -0,0 +1,105 @@
+import pytest
+
+from ccc import Corpus
+from ccc.warmup import main, warmup, warmup_tasks
+
+from .conftest import DATA_PATH
+
+
+def test_warmup_tasks():
+
+    tasks = warmup_tasks([['lemma', 'pos'], 'lemma'], ['s', 'text'])
+    assert tasks == [
+        ('marginals', ['lemma']),
+        ('marginals', ['pos']),
+        ('marginals', ['lemma', 'pos']),
+        ('spans', 's'),
+        ('spans', 'text')
+    ]
+
+
+def test_warmup_tasks_index():
+
+    tasks = warmup_tasks([['lemma', 'pos']], index=True)
+    assert tasks[-3:] == [
+        ('index', ['lemma']),
+        ('index', ['pos']),
+        ('index', ['lemma', 'pos'])
+    ]
+
+
+def test_warmup_tasks_matrix():
+
+    tasks = warmup_tasks([['lemma', 'pos']], ['text_id'], matrix=True)
+    assert tasks[-1] == ('matrix', ('text_id', ['lemma', 'pos']))
+
+
+def test_warmup_matrix(germaparl, tmp_path):
+
+    settings = dict(registry_dir=germaparl['registry_dir'], data_dir=str(tmp_path))
+    report = warmup(germaparl['corpus_name'], [['lemma', 'pos']], ['text_id'], matrix=True, force=True, **settings)
+    assert (report['status'] == 'computed').all()
+    assert list(report['target'])[-1] == 'text_id: lemma pos'
+
+    corpus = Corpus(germaparl['corpus_name'], **settings)
+    assert corpus.text_matrix('text_id', ['lemma', 'pos']).exists()
+
+
+def test_warmup_index(germaparl, tmp_path):
+
+    settings = dict(registry_dir=germaparl['registry_dir'], data_dir=str(tmp_path))
+    report = warmup(germaparl['corpus_name'], [['lemma', 'pos']], index=True, force=True, **settings)
+    assert (report['status'] == 'computed').all()
+
+    corpus = Corpus(germaparl['corpus_name'], **settings)
+    assert corpus.marginals_index(['lemma', 'pos']).exists()
+
+
+def test_warmup(germaparl):
+
+    settings = dict(registry_dir=germaparl['registry_dir'], data_dir=DATA_PATH)
+    report = warmup(germaparl['corpus_name'], [['lemma', 'pos']], ['s'], force=True, **settings)
+    assert (report['status'] == 'computed').all()
+    assert list(report['target']) == ['lemma', 'pos', 'lemma pos', 's']
+
+    # idempotent
+    report = warmup(germaparl['corpus_name'], [['lemma', 'pos']], ['s'], processes=2, **settings)
+    assert (report['status'] == 'cached').all()
+
+    corpus = Corpus(germaparl['corpus_name'], **settings)
+    assert corpus.cache.exists("lemma-pos-marginals")
+    assert corpus.cache.exists("s-spans")
+
+
+def test_warmup_keywords(germaparl, tmp_path):
+
+    settings = dict(registry_dir=germaparl['registry_dir'], data_dir=str(tmp_path))
+    report = warmup(germaparl['corpus_name'], [['lemma', 'pos']], force=True, **settings)
+    assert (report['status'] == 'computed').all()
+
+    # corpus marginals of keywords are retrieved from the cache
+    corpus = Corpus(germaparl['corpus_name'], **settings)
+    assert corpus.cache.exists("lemma-pos-coded-marginals")
+    subcorpus = corpus.query('"SPD"')
+    corpus.cache.stats.reset()
+    assert len(subcorpus.keywords(p_query=['lemma', 'pos'], min_freq=1)) > 0
+    stats = corpus.cache.stats.to_frame()
+    assert stats.loc['marginals', 'hits'] == 1
+    assert stats.loc['marginals', 'misses'] == 0
+
+
+@pytest.mark.benchmark
+def test_perf_warmup(germaparl, benchmark):
+
+    settings = dict(registry_dir=germaparl['registry_dir'], data_dir=DATA_PATH)
+    benchmark.pedantic(
+        warmup, args=(germaparl['corpus_name'], [['word'], ['lemma', 'pos']], ['s', 'text']),
+        kwargs=dict(processes=4, force=True, **settings), rounds=3, iterations=1
+    )
+
+
+def test_warmup_cli(germaparl, capsys):
+
+    assert main([germaparl['corpus_name'], '-p', 'word', 'lemma,pos', '-s', 'text',
+                 '-r', germaparl['registry_dir'], '-d', DATA_PATH, '-j', '2']) == 0
+    assert 'lemma pos' in capsys.readouterr().out
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from ccc import Corpus
+
+from .conftest import DATA_PATH
+
+
+def get_corpus(corpus_settings, data_dir=DATA_PATH):
+
+    return Corpus(
+        corpus_settings['corpus_name'],
+        registry_dir=corpus_settings['registry_dir'],
+        lib_dir=corpus_settings.get('lib_dir', None),
+        data_dir=data_dir
+    )
+
+
+@pytest.mark.parametrize("p_atts", [['lemma'], ['lemma', 'pos']])
+def test_marginals_index(germaparl, p_atts, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    index = corpus.marginals_index(p_atts)
+    index.remove()
+    assert not index.exists()
+
+    df = corpus._marginals_complex(None, p_atts)
+    index.build(chunk_size=10000)
+    assert index.exists()
+    assert index.frame()['freq'].equals(df['freq'])
+
+    items = list(df.index[:1000]) + ["nonexistent " * (len(p_atts) - 1) + "nonexistent"]
+    lookup = index.lookup(items)
+    assert lookup.loc[items[:1000], 'freq'].equals(df.loc[items[:1000], 'freq'])
+    assert lookup.loc[items[-1], 'freq'] == 0
+
+    # used by Corpus.marginals
+    assert corpus.marginals(items, p_atts=p_atts).equals(lookup)
+
+    # without strings
+    assert index.coded().to_freqframe().equals(index.frame())
+
+
+def test_marginals_index_tuples(germaparl, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    index = corpus.marginals_index(['lemma', 'pos'])
+    if not index.exists():
+        index.build()
+    df = index.lookup([('Kohl', 'NE'), ('Kohl', 'ADJA')])
+    assert df.loc['Kohl NE', 'freq'] > 0
+    assert df.loc['Kohl ADJA', 'freq'] == 0
+
+
+def test_marginals_index_collect(germaparl, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    index = corpus.marginals_index(['pos'])
+    index.build()
+    os.makedirs(index.path + ".4242.tmp")   # build in progress
+    entries = corpus.directory.entries()
+    assert list(entries.loc[entries['kind'] == 'marginals', 'name']) == ['pos']
+
+    # using the index marks it as used
+    os.utime(index.path, (1000, 1000))
+    corpus.marginals_index(['pos']).lookup(['NN'])
+    evicted = corpus.directory.collect(max_age=3600)
+    assert 'marginals' not in set(evicted['kind'])
+
+    # unused indexes are evicted, builds in progress are not
+    os.utime(index.path, (1000, 1000))
+    evicted = corpus.directory.collect(max_age=3600)
+    assert list(evicted.loc[evicted['kind'] == 'marginals', 'name']) == ['pos']
+    assert not index.exists()
+    assert os.path.isdir(index.path + ".4242.tmp")
+
+
+@pytest.mark.benchmark
+def test_perf_marginals_index(germaparl, benchmark, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    index = corpus.marginals_index(['lemma', 'pos'])
+    if not index.exists():
+        index.build()
+    items = list(index.frame().index[:5000])
+    benchmark.pedantic(index.lookup, args=(items, ), rounds=5, iterations=1)
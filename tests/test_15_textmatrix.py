@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pytest
+
+from ccc import Corpus
+from ccc.textmatrix import TextMatrix
+
+from .conftest import DATA_PATH
+
+
+def get_corpus(corpus_settings, data_dir=DATA_PATH):
+
+    return Corpus(
+        corpus_settings['corpus_name'],
+        registry_dir=corpus_settings['registry_dir'],
+        lib_dir=corpus_settings.get('lib_dir', None),
+        data_dir=data_dir
+    )
+
+
+@pytest.mark.parametrize("p_atts", [['lemma'], ['lemma', 'pos']])
+def test_text_matrix(germaparl, p_atts, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    matrix = corpus.text_matrix('text_id', p_atts)
+    matrix.remove()
+    assert not matrix.exists()
+    matrix.build(chunk_size=10000)
+    assert matrix.exists()
+
+    # complete texts, partial texts, spans across texts, overlaps
+    df_spans = corpus.dump_from_s_att('text_id').reset_index()
+    starts = list(df_spans['match'][:20]) + [100, 5000, 20000, 20010]
+    ends = list(df_spans['matchend'][:20]) + [250, 60000, 20100, 20020]
+    rows, rest_starts, rest_ends = matrix.split(starts, ends)
+    assert len(rows) > 20
+    assert matrix.intervals(starts, ends).equals(corpus.counts.intervals(starts, ends, p_atts))
+
+
+def test_text_matrix_subcorpus(germaparl, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    matrix = corpus.text_matrix('text_id', ['lemma'])
+    matrix.remove()
+    df_spans = corpus.dump_from_s_att('text_id')
+    subcorpus = corpus.subcorpus('Texts', df_spans.iloc[:10])
+    df = subcorpus.marginals(p_atts=['lemma'])
+
+    matrix.build()
+    assert subcorpus.marginals(p_atts=['lemma'], s_att='text_id').equals(df)
+    assert subcorpus.marginals(['die', 'nonexistent'], p_atts=['lemma'])['freq'].equals(
+        df.reindex(['die', 'nonexistent'], fill_value=0)['freq']
+    )
+
+
+def test_text_matrix_split_gaps(tmp_path):
+
+    # regions of an s-attribute that does not tile the corpus
+    matrix = TextMatrix(str(tmp_path), None, 's_gapped', ['word'])
+    region_starts, region_ends = np.array([0, 20, 30]), np.array([9, 29, 39])
+    matrix._arrays = (None, None, None, region_starts, region_ends)
+
+    rows, rest_starts, rest_ends = matrix.split([0, 5], [39, 25])
+    assert list(rows) == [0, 1, 2]
+    assert sorted(zip(rest_starts, rest_ends)) == [(5, 25), (10, 19)]
+
+    # all tokens are covered exactly once
+    covered = (region_ends[rows] - region_starts[rows] + 1).sum() + (rest_ends - rest_starts + 1).sum()
+    assert covered == 40 + 21
+
+
+def test_text_matrix_collect(germaparl, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    matrix = corpus.text_matrix('text_id', ['pos'])
+    matrix.build()
+    os.makedirs(matrix.path + ".4242.tmp")   # build in progress
+    entries = corpus.directory.entries()
+    assert list(entries.loc[entries['kind'] == 'textmatrix', 'name']) == [os.path.join('text_id', 'pos')]
+
+    # using the matrix marks it as used
+    os.utime(matrix.path, (1000, 1000))
+    corpus.text_matrix('text_id', ['pos']).intervals([0], [100])
+    evicted = corpus.directory.collect(max_age=3600)
+    assert 'textmatrix' not in set(evicted['kind'])
+
+    # unused matrices are evicted, builds in progress are not
+    os.utime(matrix.path, (1000, 1000))
+    evicted = corpus.directory.collect(max_age=3600)
+    assert len(evicted.loc[evicted['kind'] == 'textmatrix']) == 1
+    assert not matrix.exists()
+    assert os.path.isdir(matrix.path + ".4242.tmp")
+
+
+@pytest.mark.benchmark
+def test_perf_text_matrix(germaparl, benchmark, tmp_path):
+
+    corpus = get_corpus(germaparl, data_dir=str(tmp_path))
+    matrix = corpus.text_matrix('text_id', ['lemma', 'pos'])
+    if not matrix.exists():
+        matrix.build()
+    df_spans = corpus.dump_from_s_att('text_id').reset_index()
+    benchmark.pedantic(matrix.intervals, args=(df_spans['match'].values, df_spans['matchend'].values),
+                       rounds=5, iterations=1)